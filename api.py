@@ -6,16 +6,24 @@ import aiofiles
 import configparser
 import asyncio
 import time
+import json
+import threading
 from typing import List
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import uuid
 
-from sources.llm_provider import Provider
+from sources.provider_pool import create_provider
+from sources.model_registry import registry, start_idle_unloader
 from sources.interaction import Interaction
+from sources.router import register_router_models
+from sources.startup import StartupTracker
+from sources.semantic_memory import get_semantic_memory
 from sources.agents import CasualAgent, CoderAgent, FileAgent, PlannerAgent, BrowserAgent
 from sources.browser import Browser, create_driver
 from sources.utility import pretty_print
@@ -61,7 +69,13 @@ def is_running_in_docker():
 
 from celery import Celery
 
-api = FastAPI(title="AgenticSeek API", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start loading the system when the server starts, the API answers 503 until it is ready."""
+    threading.Thread(target=startup.track, args=("interaction", initialize_system), daemon=True).start()
+    yield
+
+api = FastAPI(title="AgenticSeek API", version="0.1.0", lifespan=lifespan)
 celery_app = Celery("tasks", broker="redis://localhost:6379/0", backend="redis://localhost:6379/0")
 celery_app.conf.update(task_track_started=True)
 logger = Logger("backend.log")
@@ -80,10 +94,24 @@ if not os.path.exists(".screenshots"):
     os.makedirs(".screenshots")
 api.mount("/screenshots", StaticFiles(directory=".screenshots"), name="screenshots")
 
+def create_browser(headless: bool, stealth_mode: bool, lang: str) -> Browser:
+    browser = Browser(
+        create_driver(headless=headless, stealth_mode=stealth_mode, lang=lang),
+        anticaptcha_manual_install=stealth_mode
+    )
+    logger.info("Browser initialized")
+    return browser
+
 def initialize_system():
+    """
+    Initialize the agents and the interaction in the background, so the API answers /health while loading.
+    The browser and the models are loaded concurrently, the agents are created while they load.
+    """
+    global interaction
     stealth_mode = config.getboolean('BROWSER', 'stealth_mode')
     personality_folder = "jarvis" if config.getboolean('MAIN', 'jarvis_personality') else "base"
     languages = config["MAIN"]["languages"].split(' ')
+    router_backend = config.get('MAIN', 'router_backend', fallback='vote')
     
     # Force headless mode in containers
     headless = config.getboolean('BROWSER', 'headless_browser')
@@ -102,20 +130,12 @@ def initialize_system():
         logger.info("To see the browser, run 'python cli.py' on your host machine instead")
         
         headless = True
-    
-    provider = Provider(
-        provider_name=config["MAIN"]["provider_name"],
-        model=config["MAIN"]["provider_model"],
-        server_address=config["MAIN"]["provider_server_address"],
-        is_local=config.getboolean('MAIN', 'is_local')
-    )
-    logger.info(f"Provider initialized: {provider.provider_name} ({provider.model})")
 
-    browser = Browser(
-        create_driver(headless=headless, stealth_mode=stealth_mode, lang=languages[0]),
-        anticaptcha_manual_install=stealth_mode
-    )
-    logger.info("Browser initialized")
+    browser_future = startup.submit("browser", create_browser, headless, stealth_mode, languages[0])
+    model_futures = [startup.submit(name, registry.get, name)
+                     for name in register_router_models(router_backend, languages)]
+    if config.getboolean('MAIN', 'semantic_memory', fallback=False):
+        model_futures.append(startup.submit("semantic_memory", get_semantic_memory().load_model))
 
     agents = [
         CasualAgent(
@@ -132,7 +152,10 @@ def initialize_system():
             name="File Agent",
             prompt_path=f"prompts/{personality_folder}/file_agent.txt",
             provider=provider, verbose=False
-        ),
+        )
+    ]
+    browser = browser_future.result()
+    agents += [
         BrowserAgent(
             name="Browser",
             prompt_path=f"prompts/{personality_folder}/browser_agent.txt",
@@ -146,17 +169,27 @@ def initialize_system():
     ]
     logger.info("Agents initialized")
 
+    for future in model_futures:
+        future.result()
     interaction = Interaction(
         agents,
         tts_enabled=config.getboolean('MAIN', 'speak'),
         stt_enabled=config.getboolean('MAIN', 'listen'),
         recover_last_session=config.getboolean('MAIN', 'recover_last_session'),
-        langs=languages
+        langs=languages,
+        router_backend=router_backend
     )
     logger.info("Interaction initialized")
-    return interaction
+    startup.shutdown()
+    start_idle_unloader()
 
-interaction = initialize_system()
+def not_ready_response() -> JSONResponse:
+    return JSONResponse(status_code=503, content={"error": "AgenticSeek is starting", "startup": startup.status()})
+
+provider = create_provider(config)
+logger.info(f"Provider initialized: {provider.provider_name} ({provider.model})")
+interaction = None
+startup = StartupTracker(max_workers=int(os.getenv("STARTUP_WORKERS", 4)))
 is_generating = False
 query_resp_history = []
 
@@ -175,22 +208,66 @@ async def get_screenshot():
 @api.get("/health")
 async def health_check():
     logger.info("Health check endpoint called")
-    return {"status": "healthy", "version": "0.1.0"}
+    status = {"ready": "healthy", "starting": "starting", "failed": "unhealthy"}[startup.state()]
+    content = {"status": status, "version": "0.1.0", "startup": startup.status(),
+               "provider": provider.health.status(), "models": registry.status()}
+    # not ready until every component is loaded, so clients and container healthchecks wait for startup
+    return JSONResponse(status_code=200 if status == "healthy" else 503, content=content)
 
 @api.get("/is_active")
 async def is_active():
     logger.info("Is active endpoint called")
+    if interaction is None:
+        return not_ready_response()
     return {"is_active": interaction.is_active}
 
 @api.get("/stop")
 async def stop():
     logger.info("Stop endpoint called")
+    if interaction is None:
+        return not_ready_response()
     interaction.current_agent.request_stop()
     return JSONResponse(status_code=200, content={"status": "stopped"})
 
+@api.get("/stream")
+async def stream_tokens():
+    """
+    Server-sent events of the tokens generated by the provider, as they are generated.
+    Each event is a JSON object with the agent name, the text delta and whether the completion is done.
+    """
+    logger.info("Stream endpoint called")
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def on_delta(delta):
+        loop.call_soon_threadsafe(queue.put_nowait, delta)
+
+    async def event_generator():
+        provider.add_stream_listener(on_delta)
+        try:
+            while True:
+                try:
+                    delta = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                event = {
+                    "agent_name": interaction.current_agent.agent_name if interaction and interaction.current_agent else "None",
+                    "delta": delta or "",
+                    "done": delta is None
+                }
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            provider.remove_stream_listener(on_delta)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @api.get("/latest_answer")
 async def get_latest_answer():
     global query_resp_history
+    if interaction is None:
+        return not_ready_response()
     if interaction.current_agent is None:
         return JSONResponse(status_code=404, content={"error": "No agent available"})
     uid = str(uuid.uuid4())
@@ -238,6 +315,8 @@ async def think_wrapper(interaction, query):
 async def process_query(request: QueryRequest):
     global is_generating, query_resp_history
     logger.info(f"Processing query: {request.query}")
+    if interaction is None:
+        return not_ready_response()
     query_resp = QueryResponse(
         done="false",
         answer="",
@@ -5,8 +5,12 @@ import argparse
 import configparser
 import asyncio
 
-from sources.llm_provider import Provider
+from sources.provider_pool import create_provider
 from sources.interaction import Interaction
+from sources.router import register_router_models
+from sources.model_registry import registry, start_idle_unloader
+from sources.startup import StartupTracker
+from sources.semantic_memory import get_semantic_memory
 from sources.agents import Agent, CoderAgent, CasualAgent, FileAgent, PlannerAgent, BrowserAgent, McpAgent
 from sources.browser import Browser, create_driver
 from sources.utility import pretty_print
@@ -22,11 +26,16 @@ async def main():
     stealth_mode = config.getboolean('BROWSER', 'stealth_mode')
     personality_folder = "jarvis" if config.getboolean('MAIN', 'jarvis_personality') else "base"
     languages = config["MAIN"]["languages"].split(' ')
+    router_backend = config.get('MAIN', 'router_backend', fallback='vote')
 
-    provider = Provider(provider_name=config["MAIN"]["provider_name"],
-                        model=config["MAIN"]["provider_model"],
-                        server_address=config["MAIN"]["provider_server_address"],
-                        is_local=config.getboolean('MAIN', 'is_local'))
+    provider = create_provider(config)
+
+    # load the routing and translation models while the browser starts
+    startup = StartupTracker()
+    model_futures = [startup.submit(name, registry.get, name)
+                     for name in register_router_models(router_backend, languages)]
+    if config.getboolean('MAIN', 'semantic_memory', fallback=False):
+        model_futures.append(startup.submit("semantic_memory", get_semantic_memory().load_model))
 
     browser = Browser(
         create_driver(headless=config.getboolean('BROWSER', 'headless_browser'), stealth_mode=stealth_mode, lang=languages[0]),
@@ -54,11 +63,17 @@ async def main():
         #            provider=provider, verbose=False), # NOTE under development
     ]
 
+    for future in model_futures:
+        future.result()
+    startup.shutdown()
+    start_idle_unloader()
+
     interaction = Interaction(agents,
                               tts_enabled=config.getboolean('MAIN', 'speak'),
                               stt_enabled=config.getboolean('MAIN', 'listen'),
                               recover_last_session=config.getboolean('MAIN', 'recover_last_session'),
-                              langs=languages
+                              langs=languages,
+                              router_backend=router_backend
                             )
     try:
         while interaction.is_active:
@@ -2,26 +2,15 @@
 
 import argparse
 import time
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 
 from sources.llamacpp_handler import LlamacppLLM
 from sources.ollama_handler import OllamaLLM
 
-parser = argparse.ArgumentParser(description='AgenticSeek server script')
-parser.add_argument('--provider', type=str, help='LLM backend library to use. set to [ollama], [vllm] or [llamacpp]', required=True)
-parser.add_argument('--port', type=int, help='port to use', required=True)
-args = parser.parse_args()
-
 app = Flask(__name__)
 
-assert args.provider in ["ollama", "llamacpp"], f"Provider {args.provider} does not exists. see --help for more information"
-
-handler_map = {
-    "ollama": OllamaLLM(),
-    "llamacpp": LlamacppLLM(),
-}
-
-generator = handler_map[args.provider]
+# created in __main__, so importing the app (eg: by a WSGI server or the reloader) does not load a model
+generator = None
 
 @app.route('/generate', methods=['POST'])
 def start_generation():
@@ -29,12 +18,24 @@ def start_generation():
         return jsonify({"error": "Generator not initialized"}), 401
     data = request.get_json()
     history = data.get('messages', [])
-    if generator.start(history):
-        return jsonify({"message": "Generation started"}), 202
-    return jsonify({"error": "Generation already in progress"}), 402
+    session_id = generator.start(history, model=data.get('model', None))
+    if session_id is not None:
+        return jsonify({"message": "Generation started", "session_id": session_id}), 202
+    return jsonify({"error": "Too many generations in queue"}), 429, {"Retry-After": "2"}
+
+@app.route('/stream')
+def stream():
+    if not generator:
+        return jsonify({"error": "Generator not initialized"}), 405
+    session_id = request.args.get('session_id', None)
+    if generator.get_session(session_id) is None:
+        return jsonify({"error": f"Session {session_id} not found"}), 404
+    return Response(generator.stream(session_id), mimetype='text/plain')
 
 @app.route('/setup', methods=['POST'])
 def setup():
+    if generator is None:
+        return jsonify({"error": "Generator not initialized"}), 405
     data = request.get_json()
     model = data.get('model', None)
     if model is None:
@@ -42,12 +43,50 @@ def setup():
     generator.set_model(model)
     return jsonify({"message": "Model set"}), 200
 
+@app.route('/info')
+def info():
+    if generator is None:
+        return jsonify({"error": "Generator not initialized"}), 405
+    return jsonify({"model": generator.model, "n_ctx": generator.n_ctx}), 200
+
 @app.route('/get_updated_sentence')
 def get_updated_sentence():
     if not generator:
         return jsonify({"error": "Generator not initialized"}), 405
-    print(generator.get_status())
-    return generator.get_status()
+    session_id = request.args.get('session_id', None)
+    status = generator.get_status(session_id)
+    if status is None:
+        return jsonify({"error": f"Session {session_id} not found"}), 404
+    return status
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', threaded=True, debug=True, port=args.port)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='AgenticSeek server script')
+    parser.add_argument('--provider', type=str, help='LLM backend library to use. set to [ollama], [vllm] or [llamacpp]', required=True)
+    parser.add_argument('--port', type=int, help='port to use', required=True)
+    parser.add_argument('--workers', type=int, default=1, help='number of generations running at the same time')
+    parser.add_argument('--queue_size', type=int, default=16, help='number of requests waiting before new ones are refused')
+    parser.add_argument('--cache_size', type=int, default=1024, help='number of responses kept in the response cache, 0 to disable')
+    parser.add_argument('--model', type=str, default=None, help='model to load at start (llamacpp: huggingface repo of the gguf model)')
+    parser.add_argument('--n_ctx', type=int, default=4096, help='llamacpp context size (KV cache length) of each worker')
+    parser.add_argument('--n_threads', type=int, default=None, help='llamacpp CPU threads of each worker, default to the CPU cores divided between the workers')
+    parser.add_argument('--n_batch', type=int, default=512, help='llamacpp prompt processing batch size')
+    parser.add_argument('--state_cache_mb', type=int, default=0, help='llamacpp RAM cache of KV states per worker in MB, 0 to disable')
+    parser.add_argument('--keep_alive', type=str, default="30m", help='ollama duration the model stays loaded after a request')
+    args = parser.parse_args()
+
+    assert args.provider in ["ollama", "llamacpp"], f"Provider {args.provider} does not exists. see --help for more information"
+
+    handler_map = {
+        "ollama": lambda: OllamaLLM(workers=args.workers, queue_size=args.queue_size, cache_size=args.cache_size,
+                                    keep_alive=args.keep_alive),
+        "llamacpp": lambda: LlamacppLLM(workers=args.workers, queue_size=args.queue_size, cache_size=args.cache_size, model=args.model,
+                                        n_ctx=args.n_ctx, n_threads=args.n_threads, n_batch=args.n_batch,
+                                        state_cache_mb=args.state_cache_mb),
+    }
+
+    generator = handler_map[args.provider]()
+    if args.model is not None:
+        generator.set_model(args.model)
+
+    # the reloader would run this block twice, loading the model twice
+    app.run(host='0.0.0.0', threaded=True, debug=False, use_reloader=False, port=args.port)
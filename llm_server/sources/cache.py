@@ -1,36 +1,79 @@
-import os
 import json
+import time
+import sqlite3
+import hashlib
+import threading
 from pathlib import Path
 
 class Cache:
-    def __init__(self, cache_dir='.cache', cache_file='messages.json'):
+    def __init__(self, cache_dir='.cache', cache_file='messages.db', max_entries=1024):
+        """
+        Exact match cache of generated responses, stored in SQLite.
+        The least recently used entries are evicted beyond max_entries.
+        args:
+            cache_dir: folder of the cache database
+            cache_file: name of the cache database
+            max_entries: maximum number of cached responses, 0 disable the cache
+        """
         self.cache_dir = Path(cache_dir)
         self.cache_file = self.cache_dir / cache_file
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        if not self.cache_file.exists():
-            with open(self.cache_file, 'w') as f:
-                json.dump([], f)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.clock = 0.0
+        self.db = sqlite3.connect(self.cache_file, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.db.commit()
 
-        with open(self.cache_file, 'r') as f:
-            self.cache = set(json.load(f))
+    @staticmethod
+    def make_key(model: str, history: list) -> str:
+        """
+        Hash the model and the messages of a request, the handlers generate with the model default sampling.
+        Only the role and content of messages are used, other fields (eg: time) do not change the answer.
+        """
+        messages = [{"role": msg["role"], "content": msg["content"]} for msg in history]
+        payload = json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    def add_message_pair(self, user_message: str, assistant_message: str):
-        """Add a user/assistant pair to the cache if not present."""
-        if not any(entry["user"] == user_message for entry in self.cache):
-            self.cache.append({"user": user_message, "assistant": assistant_message})
-            self._save()
+    def now(self) -> float:
+        """Strictly increasing use time, two uses within the clock resolution keep their order."""
+        self.clock = max(time.time(), self.clock + 1e-6)
+        return self.clock
 
-    def is_cached(self, user_message: str) -> bool:
-        """Check if a user msg is cached."""
-        return any(entry["user"] == user_message for entry in self.cache)
+    def get(self, key: str) -> str | None:
+        """Return the cached response for a key, None if not cached."""
+        if self.max_entries <= 0:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (self.now(), key))
+            self.db.commit()
+        return row[0]
 
-    def get_cached_response(self, user_message: str) -> str | None:
-        """Return the assistant response to a user message if cached."""
-        for entry in self.cache:
-            if entry["user"] == user_message:
-                return entry["assistant"]
-        return None
+    def put(self, key: str, response: str) -> None:
+        """Cache a response and evict the least recently used entries if the cache is full."""
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)",
+                            (key, response, self.now()))
+            self.db.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self.db.commit()
 
-    def _save(self):
-        with open(self.cache_file, 'w') as f:
-            json.dump(self.cache, f, indent=2)
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
@@ -1,28 +1,59 @@
-
 import threading
 import logging
+import queue
+import uuid
+from collections import OrderedDict
 from abc import abstractmethod
 from .cache import Cache
 
+# sent on the stream while waiting for text, never part of a generated text
+HEARTBEAT = "\x00"
+# ends the stream of a failed generation, followed by the error message
+ERROR_MARKER = "\x1e"
+
 class GenerationState:
-    def __init__(self):
+    def __init__(self, session_id: str = None, model: str = None):
         self.lock = threading.Lock()
+        self.updated = threading.Condition(self.lock)
+        self.session_id = session_id
+        self.model = model
         self.last_complete_sentence = ""
         self.current_buffer = ""
+        self.is_queued = False
         self.is_generating = False
-    
+        self.error = None
+
     def status(self) -> dict:
-        return {
+        status = {
+            "session_id": self.session_id,
             "sentence": self.current_buffer,
             "is_complete": not self.is_generating,
             "last_complete_sentence": self.last_complete_sentence,
             "is_generating": self.is_generating,
+            "is_queued": self.is_queued,
         }
+        if self.error is not None:
+            status["error"] = self.error
+        return status
 
 class GeneratorLLM():
-    def __init__(self):
+    def __init__(self, workers: int = 1, queue_size: int = 16, max_sessions: int = 256, cache_size: int = 1024,
+                 cache_dir: str = '.cache'):
+        """
+        args:
+            workers: number of generations running at the same time
+            queue_size: number of requests waiting for a worker before new ones are refused
+            max_sessions: number of sessions kept for status lookup
+            cache_size: number of responses kept in the response cache, 0 disable it
+            cache_dir: folder of the response cache database
+        """
         self.model = None
+        self.n_ctx = None # context size served, None when the backend does not tell
         self.state = GenerationState()
+        self.sessions = OrderedDict()
+        self.sessions_lock = threading.Lock()
+        self.max_sessions = max_sessions
+        self.requests = queue.Queue(maxsize=queue_size)
         self.logger = logging.getLogger(__name__)
         handler = logging.StreamHandler()
         handler.setLevel(logging.INFO)
@@ -30,33 +61,139 @@ class GeneratorLLM():
         handler.setFormatter(formatter)
         self.logger.addHandler(handler)
         self.logger.setLevel(logging.INFO)
-        cache = Cache()
-    
+        self.cache = Cache(cache_dir=cache_dir, max_entries=cache_size)
+        for _ in range(workers):
+            threading.Thread(target=self.scheduler, daemon=True).start()
+
     def set_model(self, model: str) -> None:
         self.logger.info(f"Model set to {model}")
         self.model = model
-    
-    def start(self, history: list) -> bool:
-        if self.model is None:
+
+    def start(self, history: list, model: str = None) -> str | None:
+        """
+        Queue a generation request.
+        args:
+            history: list of messages
+            model: model to use, default to the model set with set_model
+        returns:
+            the session id of the generation, None if the queue is full
+        """
+        model = model or self.model
+        if model is None:
             raise Exception("Model not set")
-        with self.state.lock:
-            if self.state.is_generating:
-                return False
-            self.state.is_generating = True
-            self.logger.info("Starting generation")
-            threading.Thread(target=self.generate, args=(history,)).start()
-        return True
-    
-    def get_status(self) -> dict:
-        with self.state.lock:
-            return self.state.status()
+        state = GenerationState(session_id=str(uuid.uuid4()), model=model)
+        cache_key = self.cache.make_key(model, history)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            # answered without a queue slot, so a full queue does not refuse it
+            self.logger.info(f"Cache hit for generation {state.session_id}")
+            state.current_buffer = cached
+        else:
+            state.is_queued = True
+            state.is_generating = True
+            try:
+                self.requests.put_nowait((state, history, cache_key))
+            except queue.Full:
+                self.logger.warning("Request queue is full, refusing generation")
+                return None
+        with self.sessions_lock:
+            self.sessions[state.session_id] = state
+            self.state = state
+            self.evict_sessions()
+        if cached is None:
+            self.logger.info(f"Queued generation {state.session_id} ({self.requests.qsize()} waiting)")
+        return state.session_id
+
+    def evict_sessions(self) -> None:
+        """Forget the oldest finished sessions when there is more than max_sessions."""
+        for session_id in list(self.sessions.keys()):
+            if len(self.sessions) <= self.max_sessions:
+                return
+            if not self.sessions[session_id].is_generating:
+                del self.sessions[session_id]
+
+    def scheduler(self) -> None:
+        """Worker loop running queued generations in arrival order."""
+        while True:
+            state, history, cache_key = self.requests.get()
+            with state.lock:
+                state.is_queued = False
+                state.updated.notify_all()
+            try:
+                self.logger.info(f"Starting generation {state.session_id}")
+                self.generate(history, state)
+                with state.lock:
+                    response, error = state.current_buffer, state.error
+                if error is None and response:
+                    self.cache.put(cache_key, response)
+            except Exception as e:
+                self.logger.error(f"Generation {state.session_id} failed: {str(e)}")
+                with state.lock:
+                    state.error = str(e)
+            finally:
+                with state.lock:
+                    state.is_generating = False
+                    state.updated.notify_all()
+                self.requests.task_done()
+
+    def get_session(self, session_id: str = None) -> GenerationState | None:
+        """Get the state of a session, or of the last started session if no id is given."""
+        with self.sessions_lock:
+            if session_id is None:
+                return self.state
+            return self.sessions.get(session_id, None)
+
+    def get_status(self, session_id: str = None) -> dict | None:
+        state = self.get_session(session_id)
+        if state is None:
+            return None
+        with state.lock:
+            status = state.status()
+        if status["is_queued"]:
+            with self.requests.mutex:
+                waiting = [s.session_id for s, _, _ in self.requests.queue]
+            status["queue_position"] = waiting.index(state.session_id) if state.session_id in waiting else 0
+        return status
+
+    def stream(self, session_id: str = None, heartbeat: float = 15):
+        """
+        Yield the generated text as it is added to the buffer, until the generation is complete.
+        While no text comes (queued, model loading, long prompt processing), HEARTBEAT is sent every heartbeat seconds
+        so the connection stays open. A failed generation ends with ERROR_MARKER followed by the error.
+        args:
+            session_id: the session to stream, default to the last started session
+            heartbeat: seconds without new text before a heartbeat is sent
+        """
+        state = self.get_session(session_id)
+        if state is None:
+            return
+        sent = 0
+        while True:
+            with state.updated:
+                state.updated.wait_for(
+                    lambda: len(state.current_buffer) > sent or not state.is_generating,
+                    timeout=heartbeat
+                )
+                chunk = state.current_buffer[sent:]
+                sent = len(state.current_buffer)
+                is_complete = not state.is_generating
+                error = state.error
+            if chunk:
+                yield chunk
+            elif not is_complete:
+                yield HEARTBEAT
+            if is_complete:
+                if error is not None:
+                    yield ERROR_MARKER + error
+                return
 
     @abstractmethod
-    def generate(self, history: list) -> None:
+    def generate(self, history: list, state: GenerationState) -> None:
         """
         Generate text using the model.
         args:
             history: list of strings
+            state: the generation state of the session to write the text into
         returns:
             None
         """
@@ -64,4 +201,4 @@ class GeneratorLLM():
 
 if __name__ == "__main__":
     generator = GeneratorLLM()
-    generator.get_status()
\ No newline at end of file
+    generator.get_status()
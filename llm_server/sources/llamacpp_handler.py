@@ -1,40 +1,107 @@
-
-from .generator import GeneratorLLM
-from llama_cpp import Llama
+import os
+import threading
+from .generator import GeneratorLLM, GenerationState
+from llama_cpp import Llama, LlamaRAMCache
 from .decorator import timer_decorator
 
 class LlamacppLLM(GeneratorLLM):
 
-    def __init__(self):
+    def __init__(self, workers: int = 1, queue_size: int = 16, cache_size: int = 1024,
+                 model: str = None, n_ctx: int = 4096, n_threads: int = None, n_batch: int = 512,
+                 state_cache_mb: int = 0, cache_dir: str = '.cache'):
         """
         Handle generation using llama.cpp
+        Each worker gets its own llama.cpp context (slot) with its own KV cache of n_ctx tokens,
+        the model weights are memory mapped once and shared between the slots.
+        A conversation is pinned to the slot that last served it, so llama.cpp only evaluates
+        the part of the prompt that differs from the tokens already in the slot KV cache.
+        args:
+            model: huggingface repo of the gguf model, loaded at start if given
+            n_ctx: context size (KV cache length) of each slot
+            n_threads: number of CPU threads per slot, default to the CPU cores divided between the slots
+            n_batch: prompt processing batch size
+            state_cache_mb: size of the in RAM cache of KV states per slot, 0 disable it
+            cache_dir: folder of the response cache database
         """
-        super().__init__()
-        self.llm = None
-    
+        super().__init__(workers=workers, queue_size=queue_size, cache_size=cache_size, cache_dir=cache_dir)
+        self.workers = workers
+        self.n_ctx = n_ctx
+        # the slots generate at the same time, giving each one every core would oversubscribe the CPU
+        self.n_threads = n_threads or max(1, (os.cpu_count() or 1) // workers)
+        self.n_batch = n_batch
+        self.state_cache_mb = state_cache_mb
+        self.loaded_model = None
+        self.free_slots = []
+        self.slots_prefix = {}
+        self.slots_available = threading.Condition()
+        self.load_lock = threading.Lock()
+        if model is not None:
+            self.set_model(model)
+            self.load_model(model)
+
     @timer_decorator
-    def generate(self, history):
-        if self.llm is None:
-            self.logger.info(f"Loading {self.model}...")
-            self.llm = Llama.from_pretrained(
-                repo_id=self.model,
-                filename="*Q8_0.gguf",
-                n_ctx=4096,
-                verbose=True
-            )
-        self.logger.info(f"Using {self.model} for generation with Llama.cpp")
+    def load_model(self, model: str) -> None:
+        """Load one llama.cpp context per worker for the model."""
+        with self.load_lock:
+            if self.loaded_model == model:
+                return
+            if self.loaded_model is not None:
+                raise Exception(f"llama.cpp server is serving {self.loaded_model}, restart it to use {model}")
+            self.logger.info(f"Loading {model} in {self.workers} slots of {self.n_threads} threads...")
+            for _ in range(self.workers):
+                llm = Llama.from_pretrained(
+                    repo_id=model,
+                    filename="*Q8_0.gguf",
+                    n_ctx=self.n_ctx,
+                    n_threads=self.n_threads,
+                    n_threads_batch=self.n_threads,
+                    n_batch=self.n_batch,
+                    verbose=True
+                )
+                if self.state_cache_mb > 0:
+                    llm.set_cache(LlamaRAMCache(capacity_bytes=self.state_cache_mb * 1024 * 1024))
+                self.release_slot(llm)
+            self.loaded_model = model
+
+    def acquire_slot(self, prefix_key: str) -> Llama:
+        """
+        Wait for a free slot, prefer the slot that last served the same conversation prefix.
+        Otherwise take the least recently used slot.
+        """
+        with self.slots_available:
+            self.slots_available.wait_for(lambda: len(self.free_slots) > 0)
+            llm = next((slot for slot in self.free_slots if self.slots_prefix.get(id(slot)) == prefix_key),
+                       self.free_slots[0])
+            self.free_slots.remove(llm)
+            self.slots_prefix[id(llm)] = prefix_key
+            return llm
+
+    def release_slot(self, llm: Llama) -> None:
+        with self.slots_available:
+            self.free_slots.append(llm)
+            self.slots_available.notify()
+
+    @timer_decorator
+    def generate(self, history, state: GenerationState):
+        self.load_model(state.model)
+        self.logger.info(f"Using {state.model} for generation with Llama.cpp")
+        # the first message (system prompt) identify the agent conversation
+        llm = self.acquire_slot(self.cache.make_key(state.model, history[:1]))
         try:
-            with self.state.lock:
-                self.state.is_generating = True
-                self.state.last_complete_sentence = ""
-                self.state.current_buffer = ""
-            output = self.llm.create_chat_completion(
-                  messages = history
+            stream = llm.create_chat_completion(
+                  messages = history,
+                  stream = True
             )
-            with self.state.lock:
-                self.state.current_buffer = output['choices'][0]['message']['content']
+            for chunk in stream:
+                content = chunk['choices'][0]['delta'].get('content', None)
+                if not content:
+                    continue
+                with state.lock:
+                    state.current_buffer += content
+                    state.updated.notify_all()
         except Exception as e:
             self.logger.error(f"Error: {e}")
+            with state.lock:
+                state.error = str(e)
         finally:
-            with self.state.lock:
-                self.state.is_generating = False
\ No newline at end of file
+            self.release_slot(llm)
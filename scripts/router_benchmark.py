@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Accuracy and latency benchmark of the router backends.
+Run from the repository root: python scripts/router_benchmark.py --backends vote distilled classifier
+Add --cache to print the similarities the router cache threshold is compared to.
+"""
+
+import os
+import sys
+import time
+import argparse
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sources.router import AgentRouter, ROUTER_BACKENDS
+from sources.router_cache import RouterCache
+from sources.model_registry import registry
+
+AGENTS = [
+    SimpleNamespace(agent_name="jarvis", role="talk", type="casual_agent"),
+    SimpleNamespace(agent_name="coder", role="code", type="code_agent"),
+    SimpleNamespace(agent_name="file", role="files", type="file_agent"),
+    SimpleNamespace(agent_name="browser", role="web", type="browser_agent"),
+    SimpleNamespace(agent_name="planner", role="planification", type="planner_agent")
+]
+
+# queries with the agent expected to handle them, not part of the few-shot examples
+QUERIES = [
+    ("hi", "casual_agent"),
+    ("How are you doing today?", "casual_agent"),
+    ("Tell me a funny story", "casual_agent"),
+    ("What do you think about the meaning of life?", "casual_agent"),
+    ("Raconte moi une histoire drole", "casual_agent"),
+    ("给我讲一个有趣的故事", "casual_agent"),
+    ("Write a python script to check if a device on my network is connected to the internet", "code_agent"),
+    ("Help me write a C++ program to sort an array", "code_agent"),
+    ("Can you debug this Java code? It's not working.", "code_agent"),
+    ("Write a bash script that renames all jpg files with the current date", "code_agent"),
+    ("Aide moi à faire un programme c++ pour trier une array.", "code_agent"),
+    ("帮我写一个C++程序来排序数组", "code_agent"),
+    ("Find the old_project.zip file somewhere on my drive", "file_agent"),
+    ("List all the pdf files in my documents folder", "file_agent"),
+    ("Delete the temporary files in the downloads folder", "file_agent"),
+    ("Hé trouve moi le old_project.zip, il est quelque part sur mon disque.", "file_agent"),
+    ("Search the web for the latest news on the tesla stock", "browser_agent"),
+    ("Find on the web the latest research papers on AI", "browser_agent"),
+    ("Can you browse the web and find me a 4090 for cheap?", "browser_agent"),
+    ("Who won the football world cup in 2022? search online", "browser_agent"),
+    ("Trouve moi les derniers articles de recherche sur l'IA sur internet", "browser_agent"),
+    ("在网上找到最新的人工智能研究论文。", "browser_agent"),
+    ("Search for a weather api and then make an app using this api", "planner_agent"),
+    ("Plan a 3-day trip to New York, including flights and hotels", "planner_agent"),
+    ("Find the best rated python web frameworks online, compare them and write a report in a file", "planner_agent"),
+    ("Research the top 5 electric cars, then write a python script plotting their range", "planner_agent"),
+    ("Planifie un trip de 3 jours à Paris, y compris les vols et hotels.", "planner_agent"),
+    ("计划一次为期3天的纽约之旅，包括机票和酒店。", "planner_agent")
+]
+
+# pairs of queries routed the same way, a near-duplicate must reuse the decision of the other
+NEAR_DUPLICATES = [
+    ("Find the old_project.zip file somewhere on my drive", "find the old_project.zip file somewhere on my drive please"),
+    ("Write a python script to ping a website", "Write a Python script that pings a website"),
+    ("Search the web for the latest news on the tesla stock", "search the web for the latest tesla stock news"),
+    ("How are you doing today?", "how are you doing today ?")
+]
+# pairs of similar wording but another agent, a decision must not be reused between them
+DIFFERENT_INTENTS = [
+    ("Find the old_project.zip file somewhere on my drive", "Find the old_project repository somewhere on github"),
+    ("Write a python script to ping a website", "Search the web for a python script to ping a website"),
+    ("Search the web for the latest news on the tesla stock", "Search the web for the latest news on the tesla stock and plot it in python"),
+    ("Tell me a funny story", "Write a funny story in story.txt")
+]
+
+def cache_similarities(backend: str) -> None:
+    """Cosine similarities of the embeddings the router cache compares, to choose its similarity threshold."""
+    router = AgentRouter(AGENTS, supported_language=["en", "fr", "zh"], backend=backend)
+    threshold = router.cache.similarity_threshold
+    for name, pairs in [("near-duplicates", NEAR_DUPLICATES), ("different intents", DIFFERENT_INTENTS)]:
+        print(f"\n{name} (threshold {threshold}):")
+        for a, b in pairs:
+            vectors = router.embed_queries([a, b])
+            vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            similarity = float(vectors[0] @ vectors[1])
+            print(f"{similarity:>7.3f} {'reused' if similarity >= threshold else 'routed':>7}  {a} | {b}")
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def benchmark(backend: str) -> dict:
+    memory_before = registry.memory_usage()
+    start = time.time()
+    router = AgentRouter(AGENTS, supported_language=["en", "fr", "zh"], backend=backend)
+    load_time = time.time() - start
+    router.cache = RouterCache(max_size=0)
+    router.select_agent(QUERIES[0][0]) # warm up
+    decisions, latencies = [], []
+    for text, _ in QUERIES:
+        start = time.perf_counter()
+        agent = router.select_agent(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+        decisions.append(agent.type if agent else None)
+    correct = sum(decision == expected for decision, (_, expected) in zip(decisions, QUERIES))
+    return {
+        "backend": backend,
+        "decisions": decisions,
+        "accuracy": correct / len(QUERIES),
+        "load_time": load_time,
+        "memory_mb": (registry.memory_usage() - memory_before) / 2**20,
+        "mean_ms": sum(latencies) / len(latencies),
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the router backends.")
+    parser.add_argument("--backends", nargs="+", default=ROUTER_BACKENDS, choices=ROUTER_BACKENDS)
+    parser.add_argument("--cache", action="store_true", help="print the router cache similarities instead")
+    args = parser.parse_args()
+    if args.cache:
+        for backend in args.backends:
+            cache_similarities(backend)
+        return
+    results = [benchmark(backend) for backend in args.backends]
+    reference = next((result for result in results if result["backend"] == "vote"), None)
+    print(f"\n{'backend':<12}{'accuracy':>10}{'agreement':>11}{'mean ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'load s':>9}{'+MB':>8}")
+    for result in results:
+        agreement = "-"
+        if reference is not None:
+            same = sum(a == b for a, b in zip(result["decisions"], reference["decisions"]))
+            agreement = f"{same / len(QUERIES):.0%}"
+        print(f"{result['backend']:<12}{result['accuracy']:>10.0%}{agreement:>11}{result['mean_ms']:>10.1f}"
+              f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['load_time']:>9.1f}{result['memory_mb']:>8.0f}")
+
+if __name__ == "__main__":
+    main()
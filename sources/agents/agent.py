@@ -48,7 +48,9 @@ class Agent():
         self.status_message = "Haven't started yet"
         self.stop = False
         self.verbose = verbose
-        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.speech_executor = ThreadPoolExecutor(max_workers=1)
+        self.llm_task = None
+        self.llm_cancelled = False
     
     @property
     def get_agent_name(self) -> str:
@@ -126,6 +128,16 @@ class Agent():
         """
         self.stop = True
         self.status_message = "Stopped"
+        self.cancel_llm_request()
+
+    def cancel_llm_request(self) -> None:
+        """
+        Abort the in-flight LLM generation, closing the upstream stream immediately.
+        Providers running in a thread keep generating in the background, see Provider.threaded_stream.
+        """
+        if self.llm_task is not None and not self.llm_task.done():
+            self.llm_cancelled = True
+            self.llm_task.cancel()
     
     @abstractmethod
     def process(self, prompt, speech_module) -> str:
@@ -160,17 +172,32 @@ class Agent():
     async def llm_request(self) -> Tuple[str, str]:
         """
         Asynchronously ask the LLM to process the prompt.
+        The request can be aborted with cancel_llm_request, the partial answer is then returned.
         """
         self.status_message = "Thinking..."
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.executor, self.sync_llm_request)
-    
-    def sync_llm_request(self) -> Tuple[str, str]:
+        self.llm_task = asyncio.ensure_future(self.async_llm_request())
+        try:
+            return await self.llm_task
+        except asyncio.CancelledError:
+            if not self.llm_cancelled or not self.llm_task.cancelled():
+                raise
+            self.llm_cancelled = False
+            return "", None
+
+    async def async_llm_request(self) -> Tuple[str, str]:
         """
-        Ask the LLM to process the prompt and return the answer and the reasoning.
+        Ask the LLM to process the prompt without blocking the event loop and return the answer and the reasoning.
         """
-        memory = self.memory.get()
-        thought = self.llm.respond(memory, self.verbose)
+        memory = await self.memory.get_with_recall_async()
+        thought = ""
+        try:
+            async for delta in self.llm.respond_stream_async(memory, self.verbose):
+                thought += delta
+        except asyncio.CancelledError:
+            if not self.llm_cancelled:
+                raise
+            self.llm_cancelled = False
+            pretty_print("LLM request cancelled.", color="warning")
 
         reasoning = self.extract_reasoning_text(thought)
         answer = self.remove_reasoning_text(thought)
@@ -185,7 +212,7 @@ class Agent():
                     "Hold on, I’m crunching numbers.",
                     "Working on it, please let me think."]
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.executor, lambda: speech_module.speak(messages[random.randint(0, len(messages)-1)]))
+        return await loop.run_in_executor(self.speech_executor, lambda: speech_module.speak(messages[random.randint(0, len(messages)-1)]))
     
     def get_last_tool_type(self) -> str:
         return self.blocks_result[-1].tool_type if len(self.blocks_result) > 0 else None
@@ -41,7 +41,9 @@ class BrowserAgent(Agent):
         self.memory = Memory(self.load_prompt(prompt_path),
                         recover_last_session=False, # session recovery in handled by the interaction class
                         memory_compression=False,
-                        model_provider=provider.get_model_name() if provider else None)
+                        model_provider=provider.get_model_name() if provider else None,
+                        context_window=provider.get_context_window() if provider else None,
+                        agent_type=self.type)
     
     def get_today_date(self) -> str:
         """Get the date"""
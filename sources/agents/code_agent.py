@@ -33,7 +33,9 @@ class CoderAgent(Agent):
         self.memory = Memory(self.load_prompt(prompt_path),
                         recover_last_session=False, # session recovery in handled by the interaction class
                         memory_compression=False,
-                        model_provider=provider.get_model_name())
+                        model_provider=provider.get_model_name(),
+                        context_window=provider.get_context_window(),
+                        agent_type=self.type)
     
     def add_sys_info_prompt(self, prompt):
         """Add system information to the prompt."""
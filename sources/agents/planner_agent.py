@@ -33,9 +33,19 @@ class PlannerAgent(Agent):
         self.memory = Memory(self.load_prompt(prompt_path),
                                 recover_last_session=False, # session recovery in handled by the interaction class
                                 memory_compression=False,
-                                model_provider=provider.get_model_name())
+                                model_provider=provider.get_model_name(),
+                                context_window=provider.get_context_window(),
+                                agent_type=self.type)
         self.logger = Logger("planner_agent.log")
     
+    def request_stop(self) -> None:
+        """
+        Request the planner and the agent working on its current task to stop.
+        """
+        super().request_stop()
+        for agent in self.agents.values():
+            agent.cancel_llm_request()
+
     def get_task_names(self, text: str) -> List[str]:
         """
         Extracts task names from the given text.
@@ -156,6 +166,8 @@ class PlannerAgent(Agent):
             animate_thinking("Thinking...", color="status")
             self.memory.push('user', prompt)
             answer, reasoning = await self.llm_request()
+            if self.stop:
+                return []
             if "NO_UPDATE" in answer:
                 return []
             agents_tasks = self.parse_agent_tasks(answer)
@@ -0,0 +1,123 @@
+import time
+import threading
+from typing import Callable, Dict
+
+from sources.logger import Logger
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of sending a request to an endpoint whose circuit is open."""
+    pass
+
+class EndpointHealth:
+    """
+    Cached reachability and circuit breaker state of an endpoint.
+    """
+    def __init__(self):
+        self.is_online = True
+        self.monitored = False
+        self.last_check = 0.0
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def jsonify(self) -> dict:
+        return {
+            "is_online": self.is_online,
+            "last_check": self.last_check,
+            "consecutive_failures": self.consecutive_failures,
+            "circuit_open": self.opened_at is not None
+        }
+
+class HealthMonitor:
+    """
+    HealthMonitor checks endpoints reachability in a background thread and keeps a circuit breaker per endpoint.
+    Lookups never block on DNS or network, they return the last known state.
+    """
+    def __init__(self, probe: Callable[[str], bool],
+                 ttl: float = 60,
+                 failure_threshold: int = 3,
+                 cooldown: float = 30):
+        """
+        Args:
+            probe (Callable): Function checking if an address is reachable, run in the background thread.
+            ttl (float): Seconds before the reachability of an endpoint is checked again.
+            failure_threshold (int): Consecutive failures before the circuit of an endpoint opens.
+            cooldown (float): Seconds an open circuit refuses requests before letting one through.
+        """
+        self.probe = probe
+        self.ttl = ttl
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.endpoints: Dict[str, EndpointHealth] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.logger = Logger("health_monitor.log")
+
+    def register(self, address: str) -> None:
+        """Start monitoring an address."""
+        with self.lock:
+            health = self.endpoints.setdefault(address, EndpointHealth())
+            if health.monitored:
+                return
+            health.monitored = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def run(self) -> None:
+        """Background loop probing the endpoints whose state expired."""
+        while True:
+            self.wakeup.clear()
+            with self.lock:
+                expired = [address for address, health in self.endpoints.items()
+                           if health.monitored and time.time() - health.last_check >= self.ttl]
+            for address in expired:
+                online = self.probe(address)
+                with self.lock:
+                    health = self.endpoints[address]
+                    health.is_online = online
+                    health.last_check = time.time()
+                if not online:
+                    self.logger.warning(f"Endpoint {address} is unreachable.")
+            self.wakeup.wait(timeout=self.ttl)
+
+    def is_online(self, address: str) -> bool:
+        """Last known reachability of an address, optimistic for addresses not checked yet."""
+        self.register(address)
+        with self.lock:
+            return self.endpoints[address].is_online
+
+    def allow_request(self, address: str) -> bool:
+        """
+        Whether a request to the address should be attempted.
+        An open circuit refuses requests until the cooldown is over, then lets requests through again (half open).
+        """
+        with self.lock:
+            health = self.endpoints.get(address, None)
+            if health is None or health.opened_at is None:
+                return True
+            return time.time() - health.opened_at >= self.cooldown
+
+    def record_success(self, address: str) -> None:
+        """Close the circuit of an address after a successful request."""
+        with self.lock:
+            health = self.endpoints.setdefault(address, EndpointHealth())
+            health.consecutive_failures = 0
+            health.opened_at = None
+            health.is_online = True
+
+    def record_failure(self, address: str) -> None:
+        """Count a failed request, open the circuit once the failure threshold is reached."""
+        with self.lock:
+            health = self.endpoints.setdefault(address, EndpointHealth())
+            health.consecutive_failures += 1
+            if health.consecutive_failures >= self.failure_threshold:
+                if health.opened_at is None:
+                    self.logger.warning(f"Circuit opened for {address} after {health.consecutive_failures} failures.")
+                health.opened_at = time.time()
+        self.wakeup.set()
+
+    def status(self) -> dict:
+        with self.lock:
+            return {address: health.jsonify() for address, health in self.endpoints.items()}
@@ -16,7 +16,8 @@ class Interaction:
                  tts_enabled: bool = True,
                  stt_enabled: bool = True,
                  recover_last_session: bool = False,
-                 langs: List[str] = ["en", "zh"]
+                 langs: List[str] = ["en", "zh"],
+                 router_backend: str = "vote"
                 ):
         self.is_active = True
         self.current_agent = None
@@ -27,7 +28,7 @@ class Interaction:
         self.tts_enabled = tts_enabled
         self.stt_enabled = stt_enabled
         self.recover_last_session = recover_last_session
-        self.router = AgentRouter(self.agents, supported_language=langs)
+        self.router = AgentRouter(self.agents, supported_language=langs, backend=router_backend)
         self.ai_name = self.find_ai_name()
         self.speech = None
         self.transcriber = None
@@ -1,29 +1,65 @@
 from typing import List, Tuple, Type, Dict
+import os
 import re
+import threading
+from collections import OrderedDict
 import langid
 from transformers import MarianMTModel, MarianTokenizer
 
 from sources.utility import pretty_print, animate_thinking
 from sources.logger import Logger
+from sources.model_registry import registry
 
 class LanguageUtility:
     """LanguageUtility for language, or emotion identification"""
-    def __init__(self, supported_language: List[str] = ["en", "fr", "zh"]):
+    def __init__(self, supported_language: List[str] = ["en", "fr", "zh"],
+                 cache_size: int = 1024,
+                 num_beams: int | None = None,
+                 max_new_tokens: int = 256):
         """
         Initialize the LanguageUtility class
         args:
             supported_language: list of languages for translation, determine which Helsinki-NLP model to load
+            cache_size: number of translations kept in cache
+            num_beams: beams of the translation search, 1 for greedy decoding (fastest),
+                       None for the TRANSLATION_NUM_BEAMS env variable or the model default
+            max_new_tokens: maximum length of a translation in tokens
         """
-        self.translators_tokenizer = None 
-        self.translators_model = None
         self.logger = Logger("language.log")
         self.supported_language = supported_language
+        self.cache_size = cache_size
+        if num_beams is None and os.getenv("TRANSLATION_NUM_BEAMS"):
+            num_beams = int(os.getenv("TRANSLATION_NUM_BEAMS"))
+        self.num_beams = num_beams
+        self.max_new_tokens = max_new_tokens
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
         self.load_model()
     
     def load_model(self) -> None:
-        animate_thinking("Loading language utility...", color="status")
-        self.translators_tokenizer = {lang: MarianTokenizer.from_pretrained(f"Helsinki-NLP/opus-mt-{lang}-en") for lang in self.supported_language if lang != "en"}
-        self.translators_model = {lang: MarianMTModel.from_pretrained(f"Helsinki-NLP/opus-mt-{lang}-en") for lang in self.supported_language if lang != "en"}
+        """
+        Register the translation models of the supported languages.
+        They are loaded on the first translation from their language and shared through the model registry.
+        """
+        self.register_translators(self.supported_language)
+
+    @staticmethod
+    def register_translators(languages: List[str]) -> List[str]:
+        """
+        Declare the translation models of languages in the model registry, returns their names.
+        """
+        names = []
+        for lang in languages:
+            if lang != "en":
+                name = f"Helsinki-NLP/opus-mt-{lang}-en"
+                registry.register(name, LanguageUtility.translator_loader(lang))
+                names.append(name)
+        return names
+
+    @staticmethod
+    def translator_loader(lang: str):
+        name = f"Helsinki-NLP/opus-mt-{lang}-en"
+        return lambda: (MarianTokenizer.from_pretrained(name), MarianMTModel.from_pretrained(name))
     
     def detect_language(self, text: str) -> str:
         """
@@ -46,16 +82,43 @@ class LanguageUtility:
             origin_lang: ISO language code
         Returns: translated str
         """
+        return self.translate_batch([text], origin_lang)[0]
+
+    def translate_batch(self, texts: List[str], origin_lang: str) -> List[str]:
+        """
+        Translate several texts to English with one padded generate call, cached translations are reused
+        Args:
+            texts: strings to translate
+            origin_lang: ISO language code
+        Returns: translated strs, in the order of texts
+        """
         if origin_lang == "en":
-            return text
-        if origin_lang not in self.translators_tokenizer:
+            return list(texts)
+        if origin_lang not in self.supported_language:
             pretty_print(f"Language {origin_lang} not supported for translation", color="error")
-            return text
-        tokenizer = self.translators_tokenizer[origin_lang]
-        inputs = tokenizer(text, return_tensors="pt", padding=True)
-        model = self.translators_model[origin_lang]
-        translation = model.generate(**inputs)
-        return tokenizer.decode(translation[0], skip_special_tokens=True)
+            return list(texts)
+        translations = {}
+        with self.cache_lock:
+            for text in texts:
+                if (origin_lang, text) in self.cache:
+                    self.cache.move_to_end((origin_lang, text))
+                    translations[text] = self.cache[(origin_lang, text)]
+        missing = list(dict.fromkeys(text for text in texts if text not in translations))
+        if missing:
+            tokenizer, model = registry.get(f"Helsinki-NLP/opus-mt-{origin_lang}-en")
+            inputs = tokenizer(missing, return_tensors="pt", padding=True, truncation=True)
+            generate_kwargs = {"max_new_tokens": self.max_new_tokens}
+            if self.num_beams is not None:
+                generate_kwargs["num_beams"] = self.num_beams
+            outputs = model.generate(**inputs, **generate_kwargs)
+            decoded = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            with self.cache_lock:
+                for text, translation in zip(missing, decoded):
+                    translations[text] = translation
+                    self.cache[(origin_lang, text)] = translation
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+        return [translations[text] for text in texts]
 
     def analyze(self, text):
         """
@@ -1,21 +1,73 @@
 import os
+import json
+import asyncio
 import platform
 import socket
 import subprocess
-import time
+import threading
+import importlib.util
 from urllib.parse import urlparse
 
 import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from ollama import Client as OllamaClient
-from openai import OpenAI
+from ollama import AsyncClient as OllamaAsyncClient
+from openai import OpenAI, AsyncOpenAI
 
 from sources.logger import Logger
+from sources.health_monitor import HealthMonitor, CircuitOpenError
+from sources.rate_limiter import RateLimiter, RateLimitExceeded, find_rate_limit_error
 from sources.utility import pretty_print, animate_thinking
 
+# context size asked to Ollama when the config has none, its own default (2048 or 4096 tokens) is too small for agents
+DEFAULT_OLLAMA_NUM_CTX = 8192
+
+# markers of the self-hosted server stream, see llm_server/sources/generator.py
+SERVER_HEARTBEAT = "\x00"
+SERVER_ERROR_MARKER = "\x1e"
+
+class ServerStreamDecoder:
+    """
+    Decode the text stream of the self-hosted server: heartbeats are dropped and the text after the error marker
+    is the error of a failed generation.
+    """
+    def __init__(self):
+        self.error = None
+
+    def decode(self, chunk: str) -> str:
+        """Generated text of a chunk of the stream."""
+        chunk = chunk.replace(SERVER_HEARTBEAT, "")
+        if self.error is not None:
+            self.error += chunk
+            return ""
+        if SERVER_ERROR_MARKER in chunk:
+            chunk, self.error = chunk.split(SERVER_ERROR_MARKER, 1)
+        return chunk
+
+    def raise_on_error(self, server: str) -> None:
+        if self.error is not None:
+            raise Exception(f"Generation failed on server {server}: {self.error}")
+
 class Provider:
-    def __init__(self, provider_name, model, server_address="127.0.0.1:5000", is_local=False):
+    def __init__(self, provider_name, model, server_address="127.0.0.1:5000", is_local=False,
+                 max_connections: int = 20, timeout: float = 600, health: HealthMonitor = None,
+                 requests_per_minute: float = None, tokens_per_minute: float = None,
+                 context_window: int = None):
+        """
+        Args:
+            provider_name (str): Name of the provider (ollama, openai, server...).
+            model (str): Model used for generation.
+            server_address (str): Address of the server for local or self-hosted providers.
+            is_local (bool): Whether the provider runs locally.
+            max_connections (int): Maximum number of pooled connections per HTTP client.
+            timeout (float): Timeout in seconds of the HTTP requests to the provider.
+            health (HealthMonitor): Health monitor shared with other providers, created if not given.
+            requests_per_minute (float): Requests per minute allowed by the provider, None for no limit.
+            tokens_per_minute (float): Prompt tokens per minute allowed by the provider, None for no limit.
+            context_window (int): Context size in tokens, sent to Ollama as num_ctx. None to use the server context.
+        """
         self.provider_name = provider_name.lower()
         self.model = model
         self.is_local = is_local
@@ -35,7 +87,46 @@ class Provider:
             "deepseek-private": self.deepseek_private_fn,
             "test": self.test_fn
         }
+        self.available_stream_providers = {
+            "ollama": self.ollama_stream_fn,
+            "server": self.server_stream_fn,
+            "openai": self.openai_stream_fn,
+            "lm-studio": self.lm_studio_stream_fn,
+        }
+        self.available_async_stream_providers = {
+            "ollama": self.ollama_async_stream_fn,
+            "server": self.server_async_stream_fn,
+            "openai": self.openai_async_stream_fn,
+            "lm-studio": self.lm_studio_async_stream_fn,
+            "google": self.google_async_stream_fn,
+            "deepseek": self.deepseek_async_stream_fn,
+            "openrouter": self.openrouter_async_stream_fn,
+        }
+        self.stream_listeners = []
+        # keep local models loaded between agent steps so the server can reuse the KV cache of the shared prompt prefix
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
         self.logger = Logger("provider.log")
+        # HTTP clients are created once and reused by all agents to keep connections alive
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.http_client = httpx.Client(
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=10.0)
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=max_connections))
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max_connections))
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        # async clients are bound to the event loop they were created in, they are kept per event loop
+        self.async_clients = {}
+        self.closing_tasks = set()
+        self.health = health if health is not None else HealthMonitor(probe=self.is_ip_online)
+        # requests over the provider rate limits are queued and rate limited requests are retried
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute, model_name=model)
+        self.context_window = context_window
+        self.served_context = None
         self.api_key = None
         self.internal_url, self.in_docker = self.get_internal_url()
         self.unsafe_providers = ["openai", "deepseek", "dsk_deepseek", "together", "google", "openrouter"]
@@ -50,6 +141,47 @@ class Provider:
     def get_model_name(self) -> str:
         return self.model
 
+    def get_context_window(self) -> int | None:
+        """
+        Context size in tokens the server actually serves for the model, None when it is the model context window (APIs).
+        Local servers serve less than the model context window: Ollama gets it as num_ctx in each request,
+        llama.cpp and the self-hosted server are asked for their n_ctx.
+        """
+        if self.served_context is None:
+            self.served_context = self.find_context_window()
+            self.logger.info(f"Context window served by {self.provider_name}: {self.served_context}")
+        return self.served_context
+
+    def find_context_window(self) -> int | None:
+        if self.provider_name == "ollama":
+            num_ctx = self.context_window or DEFAULT_OLLAMA_NUM_CTX
+            model_context = self.get_ollama_model_context()
+            return min(num_ctx, model_context) if model_context else num_ctx
+        if self.context_window:
+            return self.context_window
+        try:
+            if self.provider_name == "server":
+                return self.http_client.get(f"{self.server_ip}/info", timeout=5).json().get("n_ctx", None)
+            if self.provider_name in ["openai", "lm-studio"] and self.is_local:
+                # llama.cpp server, other local servers do not have this route
+                base_url = self.get_openai_base_url().removesuffix("/").removesuffix("/v1")
+                props = self.http_client.get(f"{base_url}/props", timeout=5).json()
+                return props["default_generation_settings"]["n_ctx"]
+        except Exception as e:
+            self.logger.warning(f"Could not get the context size of {self.provider_name} at {self.server_ip}: {str(e)}")
+        return None
+
+    def get_ollama_model_context(self) -> int | None:
+        """Context window of the model from the Ollama /api/show route, None if the server can't tell."""
+        try:
+            response = self.http_client.post(f"{self.get_ollama_host()}/api/show", json={"model": self.model}, timeout=5)
+            for key, value in response.json().get("model_info", {}).items():
+                if key.endswith(".context_length"):
+                    return int(value)
+        except Exception as e:
+            self.logger.warning(f"Could not get the context length of {self.model} from Ollama: {str(e)}")
+        return None
+
     def get_api_key(self, provider):
         load_dotenv()
         api_key_var = f"{provider.upper()}_API_KEY"
@@ -66,35 +198,289 @@ class Provider:
             return "http://localhost", False
         return url, True
 
+    def get_client(self, key: tuple, factory):
+        """
+        Get a pooled API client, creating it with factory on first use.
+        Args:
+            key (tuple): Identify the client, eg: its type, base url and api key.
+            factory (Callable): Create the client.
+        """
+        with self.clients_lock:
+            if key not in self.clients:
+                self.clients[key] = factory()
+            return self.clients[key]
+
+    def get_openai_client(self, api_key, base_url=None) -> OpenAI:
+        """
+        Get a pooled OpenAI compatible client sharing the provider HTTP connections.
+        """
+        return self.get_client(("openai", base_url, api_key),
+                               lambda: OpenAI(api_key=api_key, base_url=base_url,
+                                              http_client=self.http_client, timeout=self.timeout))
+
+    def get_ollama_client(self, host) -> OllamaClient:
+        """
+        Get a pooled Ollama client for the host.
+        """
+        return self.get_client(("ollama", host),
+                               lambda: OllamaClient(host=host, timeout=self.timeout,
+                                                    limits=httpx.Limits(max_connections=self.max_connections)))
+
+    def get_async_client(self, key: tuple, factory):
+        """
+        Get a pooled async API client for the running event loop, creating it with factory on first use.
+        The clients of event loops closed since the last new event loop are closed.
+        """
+        loop = asyncio.get_running_loop()
+        stale = []
+        with self.clients_lock:
+            if loop not in self.async_clients:
+                stale = [self.async_clients.pop(old_loop) for old_loop in list(self.async_clients) if old_loop.is_closed()]
+                self.async_clients[loop] = {("http",): httpx.AsyncClient(
+                    http2=importlib.util.find_spec("h2") is not None,
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections),
+                    timeout=httpx.Timeout(self.timeout, connect=10.0)
+                )}
+            clients = self.async_clients[loop]
+        for old_clients in stale:
+            task = loop.create_task(self.close_async_clients(list(old_clients.values())))
+            self.closing_tasks.add(task)
+            task.add_done_callback(self.closing_tasks.discard)
+        if key not in clients:
+            clients[key] = factory()
+        return clients[key]
+
+    async def close_async_clients(self, clients: list) -> None:
+        """
+        Close async clients and their connection pools.
+        Clients of a closed event loop can't always close their connections cleanly, errors are only logged.
+        """
+        for client in clients:
+            close = getattr(client, "aclose", None) or getattr(client, "close", None)
+            if close is None and hasattr(client, "_client"): # ollama async client
+                close = client._client.aclose
+            if close is None:
+                continue
+            try:
+                result = close()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                self.logger.warning(f"Could not close async client {type(client).__name__}: {str(e)}")
+
+    def get_async_http_client(self) -> httpx.AsyncClient:
+        """
+        Get the shared async HTTP client of the running event loop.
+        """
+        return self.get_async_client(("http",), None)
+
+    def get_async_openai_client(self, api_key, base_url=None) -> AsyncOpenAI:
+        """
+        Get a pooled async OpenAI compatible client sharing the provider async HTTP connections.
+        """
+        return self.get_async_client(("openai", base_url, api_key),
+                                     lambda: AsyncOpenAI(api_key=api_key, base_url=base_url,
+                                                         http_client=self.get_async_http_client(), timeout=self.timeout))
+
+    def add_stream_listener(self, listener) -> None:
+        """
+        Register a callback receiving every generated text delta.
+        The callback is called with None once a completion is finished.
+        """
+        self.stream_listeners.append(listener)
+
+    def remove_stream_listener(self, listener) -> None:
+        if listener in self.stream_listeners:
+            self.stream_listeners.remove(listener)
+
+    def notify_stream_listeners(self, delta) -> None:
+        for listener in list(self.stream_listeners):
+            try:
+                listener(delta)
+            except Exception as e:
+                self.logger.warning(f"Stream listener failed: {str(e)}")
+
     def respond(self, history, verbose=True):
         """
         Use the choosen provider to generate text.
         """
+        return "".join(self.respond_stream(history, verbose))
+
+    def respond_stream(self, history, verbose=True, raise_on_failure=False):
+        """
+        Use the choosen provider to generate text, yielding it as it is generated.
+        Providers without streaming support yield their whole answer at once.
+        With raise_on_failure, errors are raised instead of being answered to the user (used for failover).
+        """
+        stream_llm = self.available_stream_providers.get(self.provider_name, None)
         llm = self.available_providers[self.provider_name]
         self.logger.info(f"Using provider: {self.provider_name} at {self.server_ip}")
+        if not self.health.allow_request(self.server_ip):
+            self.logger.warning(f"Circuit open for {self.server_ip}, skipping request.")
+            if raise_on_failure:
+                raise CircuitOpenError(f"Circuit open for {self.server_ip}")
+            yield f"Server {self.server_ip} seem offline. Unable to answer."
+            self.notify_stream_listeners(None)
+            return
         try:
-            thought = llm(history, verbose)
+            chunks = self.rate_limited_stream(
+                lambda: stream_llm(history, verbose) if stream_llm else [llm(history, verbose)], history)
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                self.notify_stream_listeners(chunk)
+                yield chunk
+            self.health.record_success(self.server_ip)
         except KeyboardInterrupt:
             self.logger.warning("User interrupted the operation with Ctrl+C")
-            return "Operation interrupted by user. REQUEST_EXIT"
-        except ConnectionError as e:
+            yield "Operation interrupted by user. REQUEST_EXIT"
+        except Exception as e:
+            if raise_on_failure:
+                self.record_provider_error(e)
+                raise
+            yield self.handle_provider_error(e)
+        finally:
+            self.notify_stream_listeners(None)
+
+    async def respond_async(self, history, verbose=True):
+        """
+        Use the choosen provider to generate text without blocking the event loop.
+        """
+        thought = ""
+        async for chunk in self.respond_stream_async(history, verbose):
+            thought += chunk
+        return thought
+
+    async def respond_stream_async(self, history, verbose=True, raise_on_failure=False):
+        """
+        Use the choosen provider to generate text asynchronously, yielding it as it is generated.
+        Cancelling the task consuming this generator closes the upstream stream immediately.
+        Providers without async support run in a thread and yield their whole answer at once, see threaded_stream.
+        With raise_on_failure, errors are raised instead of being answered to the user (used for failover).
+        """
+        stream_llm = self.available_async_stream_providers.get(self.provider_name, None)
+        llm = self.available_providers[self.provider_name]
+        self.logger.info(f"Using provider: {self.provider_name} at {self.server_ip} (async)")
+        if not self.health.allow_request(self.server_ip):
+            self.logger.warning(f"Circuit open for {self.server_ip}, skipping request.")
+            if raise_on_failure:
+                raise CircuitOpenError(f"Circuit open for {self.server_ip}")
+            yield f"Server {self.server_ip} seem offline. Unable to answer."
+            self.notify_stream_listeners(None)
+            return
+        try:
+            chunks = self.rate_limited_stream_async(
+                lambda: stream_llm(history, verbose) if stream_llm else self.threaded_stream(llm, history, verbose), history)
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                self.notify_stream_listeners(chunk)
+                yield chunk
+            self.health.record_success(self.server_ip)
+        except asyncio.CancelledError:
+            self.logger.warning(f"Generation with {self.provider_name} cancelled.")
+            raise
+        except Exception as e:
+            if raise_on_failure:
+                self.record_provider_error(e)
+                raise
+            yield self.handle_provider_error(e)
+        finally:
+            self.notify_stream_listeners(None)
+
+    def rate_limited_stream(self, make_stream, history):
+        """
+        Wait for the provider rate limits before starting a stream, retry it while it is rate limited.
+        A stream is only retried before its first chunk, text already yielded can't be taken back.
+        Args:
+            make_stream (Callable): Start the stream of the provider.
+            history (list): The conversation sent, to count its tokens.
+        """
+        tokens = self.rate_limiter.estimate_tokens(history)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(tokens)
+            started = False
+            try:
+                for chunk in make_stream():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or self.rate_limiter.retry_delay(e, attempt) is None:
+                    raise
+                attempt += 1
+
+    async def rate_limited_stream_async(self, make_stream, history):
+        """
+        Asynchronous version of rate_limited_stream.
+        """
+        tokens = self.rate_limiter.estimate_tokens(history)
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire_async(tokens)
+            started = False
+            try:
+                async for chunk in make_stream():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or self.rate_limiter.retry_delay(e, attempt) is None:
+                    raise
+                attempt += 1
+
+    async def threaded_stream(self, llm, history, verbose=False):
+        """
+        Run a blocking provider function in a thread.
+        These providers (huggingface, together, dsk_deepseek, deepseek-private and test) can't be cancelled:
+        cancelling only stops waiting for them, the thread keeps generating until the provider answers
+        and its answer is discarded.
+        """
+        yield await asyncio.to_thread(llm, history, verbose)
+
+    def record_provider_error(self, e: Exception) -> None:
+        """
+        Count connection errors and timeouts in the circuit breaker of the provider endpoint.
+        """
+        message = str(e).lower()
+        if isinstance(e, ConnectionError) or any(word in message for word in ["refused", "timed out", "timeout", "connect"]):
+            self.health.record_failure(self.server_ip)
+
+    def handle_provider_error(self, e: Exception) -> str:
+        """
+        Record a provider exception in the circuit breaker, then answer it to the user or raise it with more context.
+        """
+        self.record_provider_error(e)
+        return self.format_provider_error(e)
+
+    def format_provider_error(self, e: Exception) -> str:
+        """
+        Turn a provider exception, already recorded in the circuit breaker, into an answer for the user
+        or raise it with more context.
+        """
+        if isinstance(e, CircuitOpenError):
+            return f"Server {self.server_ip} seem offline. Unable to answer."
+        if isinstance(e, ConnectionError):
             raise ConnectionError(f"{str(e)}\nConnection to {self.server_ip} failed.")
-        except AttributeError as e:
+        if isinstance(e, AttributeError):
             raise NotImplementedError(f"{str(e)}\nIs {self.provider_name} implemented ?")
-        except ModuleNotFoundError as e:
+        if isinstance(e, ModuleNotFoundError):
             raise ModuleNotFoundError(
                 f"{str(e)}\nA import related to provider {self.provider_name} was not found. Is it installed ?")
-        except Exception as e:
-            if "try again later" in str(e).lower():
-                return f"{self.provider_name} server is overloaded. Please try again later."
-            if "refused" in str(e):
-                return f"Server {self.server_ip} seem offline. Unable to answer."
-            raise Exception(f"Provider {self.provider_name} failed: {str(e)}") from e
-        return thought
+        if find_rate_limit_error(e) is not None:
+            return f"{self.provider_name} rate limit reached. Please try again later."
+        if "try again later" in str(e).lower():
+            return f"{self.provider_name} server is overloaded. Please try again later."
+        if "refused" in str(e):
+            return f"Server {self.server_ip} seem offline. Unable to answer."
+        raise Exception(f"Provider {self.provider_name} failed: {str(e)}") from e
 
     def is_ip_online(self, address: str, timeout: int = 10) -> bool:
         """
         Check if an address is online by sending a ping request.
+        This blocks on DNS and ping, the hot path use the cached state of self.health instead.
         """
         if not address:
             return False
@@ -120,67 +506,116 @@ class Provider:
         """
         Use a remote server with LLM to generate text.
         """
-        thought = ""
-        route_setup = f"{self.server_ip}/setup"
+        return "".join(self.server_stream_fn(history, verbose))
+
+    def server_stream_fn(self, history, verbose=False):
+        """
+        Use a remote server with LLM to generate text, yielding the chunks streamed by the server.
+        """
         route_gen = f"{self.server_ip}/generate"
+        route_stream = f"{self.server_ip}/stream"
 
-        if not self.is_ip_online(self.server_ip):
+        if not self.health.is_online(self.server_ip):
             pretty_print(f"Server is offline at {self.server_ip}", color="failure")
 
         try:
-            requests.post(route_setup, json={"model": self.model})
-            requests.post(route_gen, json={"messages": history})
-            is_complete = False
-            while not is_complete:
-                try:
-                    response = requests.get(f"{self.server_ip}/get_updated_sentence")
-                    if "error" in response.json():
-                        pretty_print(response.json()["error"], color="failure")
-                        break
-                    thought = response.json()["sentence"]
-                    is_complete = bool(response.json()["is_complete"])
-                    time.sleep(2)
-                except requests.exceptions.RequestException as e:
-                    pretty_print(f"HTTP request failed: {str(e)}", color="failure")
-                    break
-                except ValueError as e:
-                    pretty_print(f"Failed to parse JSON response: {str(e)}", color="failure")
-                    break
-                except Exception as e:
-                    pretty_print(f"An error occurred: {str(e)}", color="failure")
-                    break
+            response = self.session.post(route_gen, json={"messages": history, "model": self.model})
+            if response.status_code == 429:
+                raise RateLimitExceeded(f"Server {self.server_ip} is busy: {response.json()['error']}. Try again later.",
+                                        retry_after=response.headers.get("Retry-After"))
+            if response.status_code != 202:
+                raise Exception(f"Server {self.server_ip} is busy: {response.json()['error']}. Try again later.")
+            session_id = response.json()["session_id"]
+            decoder = ServerStreamDecoder()
+            try:
+                with self.session.get(route_stream, params={"session_id": session_id}, stream=True) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                        chunk = decoder.decode(chunk)
+                        if not chunk:
+                            continue
+                        if verbose:
+                            print(chunk, end="", flush=True)
+                        yield chunk
+            except requests.exceptions.RequestException as e:
+                raise ConnectionError(f"Stream from server {self.server_ip} failed: {str(e)}") from e
+            decoder.raise_on_error(self.server_ip)
         except KeyError as e:
             raise Exception(
                 f"{str(e)}\nError occured with server route. Are you using the correct address for the config.ini provider?") from e
-        except Exception as e:
-            raise e
-        return thought
 
-    def ollama_fn(self, history, verbose=False):
+    async def server_async_stream_fn(self, history, verbose=False):
         """
-        Use local or remote Ollama server to generate text.
+        Use a remote server with LLM to generate text asynchronously, yielding the chunks streamed by the server.
+        """
+        route_gen = f"{self.server_ip}/generate"
+        route_stream = f"{self.server_ip}/stream"
+        client = self.get_async_http_client()
+
+        if not self.health.is_online(self.server_ip):
+            pretty_print(f"Server is offline at {self.server_ip}", color="failure")
+
+        try:
+            response = await client.post(route_gen, json={"messages": history, "model": self.model})
+            if response.status_code == 429:
+                raise RateLimitExceeded(f"Server {self.server_ip} is busy: {response.json()['error']}. Try again later.",
+                                        retry_after=response.headers.get("Retry-After"))
+            if response.status_code != 202:
+                raise Exception(f"Server {self.server_ip} is busy: {response.json()['error']}. Try again later.")
+            session_id = response.json()["session_id"]
+            decoder = ServerStreamDecoder()
+            try:
+                async with client.stream("GET", route_stream, params={"session_id": session_id}) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_text():
+                        chunk = decoder.decode(chunk)
+                        if not chunk:
+                            continue
+                        if verbose:
+                            print(chunk, end="", flush=True)
+                        yield chunk
+            except httpx.HTTPError as e:
+                raise ConnectionError(f"Stream from server {self.server_ip} failed: {str(e)}") from e
+            decoder.raise_on_error(self.server_ip)
+        except KeyError as e:
+            raise Exception(
+                f"{str(e)}\nError occured with server route. Are you using the correct address for the config.ini provider?") from e
+
+    def get_ollama_host(self) -> str:
+        """
+        Get the address of the Ollama server.
         """
-        thought = ""
-        
         # Check for custom OLLAMA_BASE_URL from environment
         custom_base_url = os.getenv("OLLAMA_BASE_URL")
         if custom_base_url:
-            host = custom_base_url
-        else:
-            host = f"{self.internal_url}:11434" if self.is_local else f"http://{self.server_address}"
-        
-        client = OllamaClient(host=host)
+            return custom_base_url
+        return f"{self.internal_url}:11434" if self.is_local else f"http://{self.server_address}"
+
+    def ollama_fn(self, history, verbose=False):
+        """
+        Use local or remote Ollama server to generate text.
+        """
+        return "".join(self.ollama_stream_fn(history, verbose))
+
+    def ollama_stream_fn(self, history, verbose=False):
+        """
+        Use local or remote Ollama server to generate text, yielding each chunk.
+        """
+        host = self.get_ollama_host()
+        client = self.get_ollama_client(host)
 
         try:
             stream = client.chat(
                 model=self.model,
                 messages=history,
                 stream=True,
+                keep_alive=self.keep_alive,
+                options={"num_ctx": self.get_context_window()},
             )
             for chunk in stream:
                 if verbose:
                     print(chunk["message"]["content"], end="", flush=True)
-                thought += chunk["message"]["content"]
+                yield chunk["message"]["content"]
         except httpx.ConnectError as e:
             raise Exception(
                 f"\nOllama connection failed at {host}. Check if the server is running."
@@ -189,14 +624,74 @@ class Provider:
             if hasattr(e, 'status_code') and e.status_code == 404:
                 animate_thinking(f"Downloading {self.model}...")
                 client.pull(self.model)
-                self.ollama_fn(history, verbose)
+                yield from self.ollama_stream_fn(history, verbose)
+                return
             if "refused" in str(e).lower():
                 raise Exception(
                     f"Ollama connection refused at {host}. Is the server running?"
                 ) from e
             raise e
 
-        return thought
+    async def ollama_async_stream_fn(self, history, verbose=False):
+        """
+        Use local or remote Ollama server to generate text asynchronously, yielding each chunk.
+        """
+        host = self.get_ollama_host()
+        client = self.get_async_client(("ollama", host),
+                                       lambda: OllamaAsyncClient(host=host, timeout=self.timeout))
+
+        try:
+            stream = await client.chat(
+                model=self.model,
+                messages=history,
+                stream=True,
+                keep_alive=self.keep_alive,
+                options={"num_ctx": self.get_context_window()},
+            )
+            async for chunk in stream:
+                if verbose:
+                    print(chunk["message"]["content"], end="", flush=True)
+                yield chunk["message"]["content"]
+        except httpx.ConnectError as e:
+            raise Exception(
+                f"\nOllama connection failed at {host}. Check if the server is running."
+            ) from e
+        except Exception as e:
+            if hasattr(e, 'status_code') and e.status_code == 404:
+                animate_thinking(f"Downloading {self.model}...")
+                await client.pull(self.model)
+                async for chunk in self.ollama_async_stream_fn(history, verbose):
+                    yield chunk
+                return
+            if "refused" in str(e).lower():
+                raise Exception(
+                    f"Ollama connection refused at {host}. Is the server running?"
+                ) from e
+            raise e
+
+    async def openai_compatible_async_stream(self, api_key, base_url, model, history, verbose=False, name="OpenAI"):
+        """
+        Generate text asynchronously with an OpenAI compatible API, yielding each chunk.
+        The HTTP stream is closed as soon as the consuming task is cancelled.
+        """
+        client = self.get_async_openai_client(api_key, base_url)
+
+        try:
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=history,
+                stream=True,
+            )
+            async with stream:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content or ""
+                    if verbose:
+                        print(content, end="", flush=True)
+                    yield content
+        except Exception as e:
+            raise Exception(f"{name} API error: {str(e)}") from e
 
     def huggingface_fn(self, history, verbose=False):
         """
@@ -214,9 +709,9 @@ class Provider:
         thought = completion.choices[0].message
         return thought.content
 
-    def openai_fn(self, history, verbose=False):
+    def get_openai_base_url(self) -> str | None:
         """
-        Use openai to generate text.
+        Get the base url of the openai provider, None for the official API.
         """
         base_url = self.server_ip
         if self.is_local and self.in_docker:
@@ -224,11 +719,16 @@ class Provider:
                 host, port = base_url.split(':')
             except Exception as e:
                 port = "8000"
-            client = OpenAI(api_key=self.api_key, base_url=f"{self.internal_url}:{port}")
+            return f"{self.internal_url}:{port}"
         elif self.is_local:
-            client = OpenAI(api_key=self.api_key, base_url=f"http://{base_url}")
-        else:
-            client = OpenAI(api_key=self.api_key)
+            return f"http://{base_url}"
+        return None
+
+    def openai_fn(self, history, verbose=False):
+        """
+        Use openai to generate text.
+        """
+        client = self.get_openai_client(self.api_key, self.get_openai_base_url())
 
         try:
             response = client.chat.completions.create(
@@ -244,13 +744,42 @@ class Provider:
         except Exception as e:
             raise Exception(f"OpenAI API error: {str(e)}") from e
 
+    def openai_stream_fn(self, history, verbose=False):
+        """
+        Use openai to generate text, yielding each chunk.
+        """
+        client = self.get_openai_client(self.api_key, self.get_openai_base_url())
+
+        try:
+            stream = client.chat.completions.create(
+                model=self.model,
+                messages=history,
+                stream=True,
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content or ""
+                if verbose:
+                    print(content, end="", flush=True)
+                yield content
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}") from e
+
+    def openai_async_stream_fn(self, history, verbose=False):
+        """
+        Use openai to generate text asynchronously.
+        """
+        return self.openai_compatible_async_stream(self.api_key, self.get_openai_base_url(),
+                                                   self.model, history, verbose, name="OpenAI")
+
     def anthropic_fn(self, history, verbose=False):
         """
         Use Anthropic to generate text.
         """
         from anthropic import Anthropic
 
-        client = Anthropic(api_key=self.api_key)
+        client = self.get_client(("anthropic", self.api_key), lambda: Anthropic(api_key=self.api_key))
         system_message = None
         messages = []
         for message in history:
@@ -284,7 +813,7 @@ class Provider:
         if self.is_local:
             raise Exception("Google Gemini is not available for local use. Change config.ini")
 
-        client = OpenAI(api_key=self.api_key, base_url="https://generativelanguage.googleapis.com/v1beta/openai/")
+        client = self.get_openai_client(self.api_key, "https://generativelanguage.googleapis.com/v1beta/openai/")
         try:
             response = client.chat.completions.create(
                 model=self.model,
@@ -299,12 +828,21 @@ class Provider:
         except Exception as e:
             raise Exception(f"GOOGLE API error: {str(e)}") from e
 
+    def google_async_stream_fn(self, history, verbose=False):
+        """
+        Use google gemini to generate text asynchronously.
+        """
+        if self.is_local:
+            raise Exception("Google Gemini is not available for local use. Change config.ini")
+        return self.openai_compatible_async_stream(self.api_key, "https://generativelanguage.googleapis.com/v1beta/openai/",
+                                                   self.model, history, verbose, name="GOOGLE")
+
     def together_fn(self, history, verbose=False):
         """
         Use together AI for completion
         """
         from together import Together
-        client = Together(api_key=self.api_key)
+        client = self.get_client(("together", self.api_key), lambda: Together(api_key=self.api_key))
         if self.is_local:
             raise Exception("Together AI is not available for local use. Change config.ini")
 
@@ -326,7 +864,7 @@ class Provider:
         """
         Use deepseek api to generate text.
         """
-        client = OpenAI(api_key=self.api_key, base_url="https://api.deepseek.com")
+        client = self.get_openai_client(self.api_key, "https://api.deepseek.com")
         if self.is_local:
             raise Exception("Deepseek (API) is not available for local use. Change config.ini")
         try:
@@ -342,9 +880,18 @@ class Provider:
         except Exception as e:
             raise Exception(f"Deepseek API error: {str(e)}") from e
 
-    def lm_studio_fn(self, history, verbose=False):
+    def deepseek_async_stream_fn(self, history, verbose=False):
         """
-        Use local lm-studio server to generate text.
+        Use deepseek api to generate text asynchronously.
+        """
+        if self.is_local:
+            raise Exception("Deepseek (API) is not available for local use. Change config.ini")
+        return self.openai_compatible_async_stream(self.api_key, "https://api.deepseek.com",
+                                                   "deepseek-chat", history, verbose, name="Deepseek")
+
+    def get_lm_studio_route(self) -> str:
+        """
+        Get the chat completion route of the lm-studio server.
         """
         if self.in_docker:
             # Extract port from server_address if present
@@ -354,7 +901,13 @@ class Provider:
             url = f"{self.internal_url}:{port}"
         else:
             url = f"http://{self.server_ip}"
-        route_start = f"{url}/v1/chat/completions"
+        return f"{url}/v1/chat/completions"
+
+    def lm_studio_fn(self, history, verbose=False):
+        """
+        Use local lm-studio server to generate text.
+        """
+        route_start = self.get_lm_studio_route()
         payload = {
             "messages": history,
             "temperature": 0.7,
@@ -363,7 +916,7 @@ class Provider:
         }
 
         try:
-            response = requests.post(route_start, json=payload, timeout=30)
+            response = self.session.post(route_start, json=payload, timeout=30)
             if response.status_code != 200:
                 raise Exception(f"LM Studio returned status {response.status_code}: {response.text}")
             if not response.text.strip():
@@ -397,11 +950,93 @@ class Provider:
             raise Exception(f"Unexpected error: {str(e)}") from e
         return thought
 
+    def lm_studio_stream_fn(self, history, verbose=False):
+        """
+        Use local lm-studio server to generate text, yielding each chunk of the server-sent events.
+        """
+        route_start = self.get_lm_studio_route()
+        payload = {
+            "messages": history,
+            "temperature": 0.7,
+            "max_tokens": 4096,
+            "model": self.model,
+            "stream": True
+        }
+
+        try:
+            with self.session.post(route_start, json=payload, timeout=30, stream=True) as response:
+                if response.status_code != 200:
+                    raise Exception(f"LM Studio returned status {response.status_code}: {response.text}")
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        choices = json.loads(data).get("choices", [])
+                    except ValueError as json_err:
+                        raise Exception(f"Invalid JSON from LM Studio: {data[:200]}") from json_err
+                    if not choices:
+                        continue
+                    content = choices[0].get("delta", {}).get("content") or ""
+                    if verbose:
+                        print(content, end="", flush=True)
+                    yield content
+        except requests.exceptions.Timeout:
+            raise Exception("LM Studio request timed out - check if server is responsive")
+        except requests.exceptions.ConnectionError:
+            raise Exception(f"Cannot connect to LM Studio at {route_start} - check if server is running")
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"HTTP request failed: {str(e)}") from e
+
+    async def lm_studio_async_stream_fn(self, history, verbose=False):
+        """
+        Use local lm-studio server to generate text asynchronously, yielding each chunk of the server-sent events.
+        """
+        route_start = self.get_lm_studio_route()
+        client = self.get_async_http_client()
+        payload = {
+            "messages": history,
+            "temperature": 0.7,
+            "max_tokens": 4096,
+            "model": self.model,
+            "stream": True
+        }
+
+        try:
+            async with client.stream("POST", route_start, json=payload) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise Exception(f"LM Studio returned status {response.status_code}: {response.text}")
+                async for line in response.aiter_lines():
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        choices = json.loads(data).get("choices", [])
+                    except ValueError as json_err:
+                        raise Exception(f"Invalid JSON from LM Studio: {data[:200]}") from json_err
+                    if not choices:
+                        continue
+                    content = choices[0].get("delta", {}).get("content") or ""
+                    if verbose:
+                        print(content, end="", flush=True)
+                    yield content
+        except httpx.TimeoutException:
+            raise Exception("LM Studio request timed out - check if server is responsive")
+        except httpx.ConnectError:
+            raise Exception(f"Cannot connect to LM Studio at {route_start} - check if server is running")
+        except httpx.HTTPError as e:
+            raise Exception(f"HTTP request failed: {str(e)}") from e
+
     def openrouter_fn(self, history, verbose=False):
         """
         Use OpenRouter API to generate text.
         """
-        client = OpenAI(api_key=self.api_key, base_url="https://openrouter.ai/api/v1")
+        client = self.get_openai_client(self.api_key, "https://openrouter.ai/api/v1")
         if self.is_local:
             # This case should ideally not be reached if unsafe_providers is set correctly
             # and is_local is False in config for openrouter
@@ -420,6 +1055,15 @@ class Provider:
         except Exception as e:
             raise Exception(f"OpenRouter API error: {str(e)}") from e
 
+    def openrouter_async_stream_fn(self, history, verbose=False):
+        """
+        Use OpenRouter API to generate text asynchronously.
+        """
+        if self.is_local:
+            raise Exception("OpenRouter is not available for local use. Change config.ini")
+        return self.openai_compatible_async_stream(self.api_key, "https://openrouter.ai/api/v1",
+                                                   self.model, history, verbose, name="OpenRouter")
+
     def dsk_deepseek(self, history, verbose=False):
         """
         Use: xtekky/deepseek4free
@@ -444,13 +1088,13 @@ class Provider:
                 if chunk['type'] == 'text':
                     thought += chunk['content']
             return thought
-        except AuthenticationError:
+        except AuthenticationError as e:
             raise AuthenticationError("Authentication failed. Please check your token.") from e
-        except RateLimitError:
-            raise RateLimitError("Rate limit exceeded. Please wait before making more requests.") from e
+        except RateLimitError as e:
+            raise RateLimitExceeded("Rate limit exceeded. Please wait before making more requests.") from e
         except CloudflareError as e:
             raise CloudflareError(f"Cloudflare protection encountered: {str(e)}") from e
-        except NetworkError:
+        except NetworkError as e:
             raise NetworkError("Network error occurred. Check your internet connection.") from e
         except APIError as e:
             raise APIError(f"API error occurred: {str(e)}") from e
@@ -493,14 +1137,14 @@ class Provider:
         # 获取API密钥（可选，某些私有部署可能不需要）
         api_key = self.get_api_key("deepseek_private") if hasattr(self, 'api_key') and self.api_key else "dummy-key"
         
-        client = OpenAI(api_key=api_key, base_url=base_url)
+        client = self.get_openai_client(api_key, base_url)
         
         try:
             # 检查服务器连接
             server_address_for_check = base_url_from_env or self.server_address
             server_host = server_address_for_check.split('/')[2] if '//' in server_address_for_check else server_address_for_check.split('/')[0]
             
-            if not self.is_ip_online(server_host):
+            if not self.health.is_online(server_host):
                 raise Exception(f"Private DeepSeek server is offline at {server_host}")
             
             response = client.chat.completions.create(
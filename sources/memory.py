@@ -1,20 +1,29 @@
 import time
+import asyncio
 import datetime
 import uuid
 import os
 import sys
 import json
+import threading
 from typing import List, Tuple, Type, Dict
 import torch
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 import configparser
 
 from sources.utility import timer_decorator, pretty_print, animate_thinking
 from sources.logger import Logger
+from sources.token_budget import TokenBudget, get_context_window
+from sources.memory_compressor import get_shared_compressor
+from sources.session_log import SessionLog
+from sources.session_index import SessionIndex
+from sources.semantic_memory import get_semantic_memory
 
 config = configparser.ConfigParser()
 config.read('config.ini')
 
+# minimum tokens given to a text trimmed to the context, eg: a web page
+MIN_TEXT_TOKENS = 1024
+
 class Memory():
     """
     Memory is a class for managing the conversation memory
@@ -23,81 +32,81 @@ class Memory():
     def __init__(self, system_prompt: str,
                  recover_last_session: bool = False,
                  memory_compression: bool = True,
-                 model_provider: str = "deepseek-r1:14b"):
+                 model_provider: str = "deepseek-r1:14b",
+                 context_window: int | None = None,
+                 agent_type: str | None = None):
         self.memory = [{'role': 'system', 'content': system_prompt}]
+        self.agent_type = agent_type
         
         self.logger = Logger("memory.log")
         self.session_time = datetime.datetime.now()
         self.session_id = str(uuid.uuid4())
         self.conversation_folder = f"conversations/"
         self.session_recovered = False
-        if recover_last_session:
-            self.load_memory()
-            self.session_recovered = True
+        self.session_log = None
         # memory compression system
-        self.model = None
-        self.tokenizer = None
+        self.compressor = None
         self.device = self.get_cuda_device()
         self.memory_compression = memory_compression
         self.model_provider = model_provider
+        # the context served by the provider is often smaller than the context window of the model
+        self.budget = TokenBudget(model_provider,
+                                  context_window=context_window or config.getint("MAIN", "context_window", fallback=None))
         if self.memory_compression:
             self.download_model()
+        self.semantic_memory = None
+        self.indexing_thread = None
+        if config.getboolean("MAIN", "semantic_memory", fallback=False):
+            self.semantic_memory = get_semantic_memory(self.conversation_folder)
+        if recover_last_session:
+            self.load_memory()
+            self.session_recovered = True
 
     def get_ideal_ctx(self, model_name: str) -> int | None:
         """
-        Estimate context size based on the model name.
-        EXPERIMENTAL for memory compression
+        Context size of the model in tokens.
         """
-        import re
-        import math
-
-        def extract_number_before_b(sentence: str) -> int:
-            match = re.search(r'(\d+)b', sentence, re.IGNORECASE)
-            return int(match.group(1)) if match else None
-
-        model_size = extract_number_before_b(model_name)
-        if not model_size:
-            return None
-        base_size = 7  # Base model size in billions
-        base_context = 4096  # Base context size in tokens
-        scaling_factor = 1.5  # Approximate scaling factor for context size growth
-        context_size = int(base_context * (model_size / base_size) ** scaling_factor)
-        context_size = 2 ** round(math.log2(context_size))
-        self.logger.info(f"Estimated context size for {model_name}: {context_size} tokens.")
-        return context_size
+        if model_name == self.budget.model_name:
+            return self.budget.context_window
+        return get_context_window(model_name)
     
     def download_model(self):
-        """Download the model if not already downloaded."""
-        animate_thinking("Loading memory compression model...", color="status")
-        self.tokenizer = AutoTokenizer.from_pretrained("pszemraj/led-base-book-summary")
-        self.model = AutoModelForSeq2SeqLM.from_pretrained("pszemraj/led-base-book-summary")
-        self.logger.info("Memory compression system initialized.")
+        """Use the summarization model shared by all agents, it is only loaded on first compression."""
+        self.compressor = get_shared_compressor()
     
     def get_filename(self) -> str:
         """Get the filename for the save file."""
-        return f"memory_{self.session_time.strftime('%Y-%m-%d_%H-%M-%S')}.txt"
+        return f"memory_{self.session_time.strftime('%Y-%m-%d_%H-%M-%S')}.jsonl"
     
     def save_memory(self, agent_type: str = "casual_agent") -> None:
-        """Save the session memory to a file."""
+        """
+        Save the session memory to a file.
+        The first save writes the conversation to the session log, then every change is appended as it happens,
+        so later saves have nothing left to write.
+        """
+        if self.session_log is not None:
+            return
         if not os.path.exists(self.conversation_folder):
             self.logger.info(f"Created folder {self.conversation_folder}.")
-            os.makedirs(self.conversation_folder)
+            os.makedirs(self.conversation_folder, exist_ok=True) # the semantic memory may create it meanwhile
         save_path = os.path.join(self.conversation_folder, agent_type)
-        if not os.path.exists(save_path):
-            os.makedirs(save_path)
+        os.makedirs(save_path, exist_ok=True)
         filename = self.get_filename()
         path = os.path.join(save_path, filename)
-        json_memory = json.dumps(self.memory)
-        with open(path, 'w') as f:
-            self.logger.info(f"Saved memory json at {path}")
-            f.write(json_memory)
+        self.session_log = SessionLog(path)
+        self.session_log.reset(self.memory)
+        self.index_messages(self.memory, agent_type)
+        index = SessionIndex(self.conversation_folder)
+        index.register(agent_type, self.session_id, self.session_time.strftime('%Y-%m-%d_%H-%M-%S'), path)
+        index.close()
+        self.logger.info(f"Saving memory log at {path}")
     
     def find_last_session_path(self, path) -> str:
-        """Find the last session path."""
+        """Find the last session path by listing the folder, for sessions saved before the session index."""
         saved_sessions = []
         for filename in os.listdir(path):
             if filename.startswith('memory_'):
-                date = filename.split('_')[1]
+                date = filename.split('.')[0]
                 saved_sessions.append((filename, date))
         saved_sessions.sort(key=lambda x: x[1], reverse=True)
         if len(saved_sessions) > 0:
@@ -132,7 +141,11 @@ class Memory():
         return json_memory
 
     def load_memory(self, agent_type: str = "casual_agent") -> None:
-        """Load the memory from the last session."""
+        """
+        Load the memory from the last session.
+        The last session is found with one indexed query, then its log is read backward from the end
+        until the context is full, so recovering a long conversation only reads the messages it keeps.
+        """
         if self.session_recovered == True:
             return
         pretty_print(f"Loading {agent_type} past memories... ", color="status")
@@ -140,28 +153,119 @@ class Memory():
         if not os.path.exists(save_path):
             pretty_print("No memory to load.", color="success")
             return
-        filename = self.find_last_session_path(save_path)
-        if filename is None:
-            pretty_print("Last session memory not found.", color="warning")
+        index = SessionIndex(self.conversation_folder)
+        path = index.last_session(agent_type)
+        index.close()
+        if path is None:
+            filename = self.find_last_session_path(save_path)
+            if filename is None:
+                pretty_print("Last session memory not found.", color="warning")
+                return
+            path = os.path.join(save_path, filename)
+        try:
+            memory = self.memory[:1] + self.recover_tail(path)
+        except ValueError:
+            memory = self.load_full_session(path)
+        if len(memory) <= 1:
+            pretty_print("Last session memory is empty.", color="warning")
             return
-        path = os.path.join(save_path, filename)
-        self.memory = self.load_json_file(path) 
-        if self.memory[-1]['role'] == 'user':
-            self.memory.pop()
+        self.memory = memory
         self.compress()
+        self.index_session(path, agent_type)
         pretty_print("Session recovered successfully", color="success")
+
+    def index_messages(self, messages: list, agent_type: str | None = None) -> None:
+        """Add messages to the semantic memory, already indexed messages are skipped."""
+        if self.semantic_memory is None:
+            return
+        for msg in messages:
+            if msg['role'] != 'system':
+                self.semantic_memory.add(msg['content'], msg['role'], self.session_id, agent_type or self.agent_type)
+
+    def index_session(self, path: str, agent_type: str | None = None) -> None:
+        """
+        Add a whole saved session to the semantic memory so its messages left on disk can be recalled.
+        The session is read in a background thread, recovery only reads the messages it keeps.
+        """
+        if self.semantic_memory is None:
+            return
+        def index():
+            try:
+                memory = SessionLog.replay(path) if path.endswith(".jsonl") else self.load_json_file(path)
+                self.index_messages(memory or [], agent_type)
+            except Exception as e:
+                self.logger.warning(f"Could not index session {path} in semantic memory: {str(e)}")
+        self.indexing_thread = threading.Thread(target=index, daemon=True)
+        self.indexing_thread.start()
+
+    def recover_tail(self, path: str) -> list:
+        """
+        The most recent messages of a session log that fit in the model context after the system prompt.
+        The last message is dropped if it is from the user, it was never answered.
+        Raises ValueError for sessions saved before per message snapshots.
+        """
+        if not path.endswith(".jsonl"):
+            raise ValueError(f"{path} is not a session log.")
+        remaining = self.budget.remaining(self.memory[:1])
+        messages = []
+        last = True
+        for index, message in SessionLog.read_tail(path):
+            if index == 0: # system prompt of the saved session, the one of the agent is kept
+                break
+            if last and message['role'] == 'user':
+                last = False
+                continue
+            last = False
+            remaining -= self.budget.count(message['content']) + self.budget.tokens_per_message
+            if remaining < 0:
+                break
+            messages.append(message)
+        self.logger.info(f"Recovered the last {len(messages)} messages of {path}.")
+        return messages[::-1]
+
+    def load_full_session(self, path: str) -> list:
+        """Load a session saved before per message snapshots, all of it is read then its tail is kept."""
+        if path.endswith(".jsonl"):
+            memory = SessionLog.replay(path)
+        else:
+            memory = self.load_json_file(path) # sessions saved before the session log
+        if len(memory) == 0:
+            return memory
+        if memory[-1]['role'] == 'user':
+            memory.pop()
+        return self.tail_within_budget(memory)
+
+    def tail_within_budget(self, memory: list) -> list:
+        """
+        Keep the system prompt and the most recent messages that fit in the model context.
+        Older messages of a long conversation are left on disk instead of being loaded and compressed.
+        """
+        system, messages = memory[:1], memory[1:]
+        remaining = self.budget.remaining(system)
+        start = len(messages)
+        while start > 0:
+            remaining -= self.budget.count(messages[start-1]['content']) + self.budget.tokens_per_message
+            if remaining < 0:
+                break
+            start -= 1
+        if start > 0:
+            self.logger.info(f"Recovered the last {len(messages) - start} of {len(messages)} messages.")
+        return system + messages[start:]
     
     def reset(self, memory: list = []) -> None:
         self.logger.info("Memory reset performed.")
         self.memory = memory
+        if self.session_log is not None:
+            self.session_log.reset(self.memory)
     
     def push(self, role: str, content: str) -> int:
         """Push a message to the memory."""
-        ideal_ctx = self.get_ideal_ctx(self.model_provider)
-        if ideal_ctx is not None:
-            if self.memory_compression and len(content) > ideal_ctx * 1.5:
-                self.logger.info(f"Compressing memory: Content {len(content)} > {ideal_ctx} model context.")
-                self.compress()
+        if self.memory_compression:
+            needed = self.budget.count(content) + self.budget.tokens_per_message
+            remaining = self.budget.remaining(self.memory)
+            if needed > remaining:
+                self.logger.info(f"Compressing memory: {needed} tokens > {remaining} tokens left in model context.")
+                self.compress(needed)
         curr_idx = len(self.memory)
         if self.memory[curr_idx-1]['content'] == content:
             pretty_print("Warning: same message have been pushed twice to memory", color="error")
@@ -170,12 +274,18 @@ class Memory():
             self.memory.append({'role': role, 'content': content})
         else:
             self.memory.append({'role': role, 'content': content, 'time': time_str, 'model_used': self.model_provider})
+        if self.session_log is not None:
+            self.session_log.push(self.memory[-1], self.memory)
+        if self.semantic_memory is not None and role != 'system':
+            self.semantic_memory.add(content, role, self.session_id, self.agent_type)
         return curr_idx-1
     
     def clear(self) -> None:
         """Clear all memory except system prompt"""
         self.logger.info("Memory clear performed.")
         self.memory = self.memory[:1]
+        if self.session_log is not None:
+            self.session_log.reset(self.memory)
     
     def clear_section(self, start: int, end: int) -> None:
         """
@@ -188,10 +298,53 @@ class Memory():
         start = max(0, start) + 1
         end = min(end, len(self.memory)-1) + 2
         self.memory = self.memory[:start] + self.memory[end:]
+        if self.session_log is not None:
+            self.session_log.reset(self.memory)
     
     def get(self) -> list:
         return self.memory
 
+    def get_with_recall(self, k: int = 3, max_snippet_tokens: int = 256) -> list:
+        """
+        Get the memory with the past messages most relevant to the last user message added to it.
+        Recalled messages are only added to the prompt sent, not to the memory,
+        and only come from the conversations of the same agent when the memory has an agent type.
+        Args:
+            k (int): Maximum number of recalled messages.
+            max_snippet_tokens (int): Tokens kept of each recalled message.
+        """
+        if self.semantic_memory is None or len(self.memory) < 2 or self.memory[-1]['role'] != 'user':
+            return self.memory
+        last = self.memory[-1]
+        try:
+            results = self.semantic_memory.search(last['content'], k=k,
+                                                  exclude={msg['content'] for msg in self.memory},
+                                                  agent_type=self.agent_type)
+        except Exception as e:
+            self.logger.warning(f"Semantic memory search failed: {str(e)}")
+            return self.memory
+        remaining = self.budget.remaining(self.memory)
+        snippets = []
+        for score, entry in results:
+            snippet = self.budget.trim(entry['content'], max_snippet_tokens)
+            remaining -= self.budget.count(snippet)
+            if remaining < 0:
+                break
+            snippets.append(f"- {entry['role']}: {snippet}")
+        if not snippets:
+            return self.memory
+        self.logger.info(f"Recalled {len(snippets)} past messages.")
+        context = "Relevant past conversation:\n" + "\n".join(snippets)
+        return self.memory[:-1] + [{**last, 'content': f"{context}\n\n{last['content']}"}]
+
+    async def get_with_recall_async(self, k: int = 3, max_snippet_tokens: int = 256) -> list:
+        """
+        get_with_recall in a thread, the query embedding runs the sentence model without blocking the event loop.
+        """
+        if self.semantic_memory is None:
+            return self.memory
+        return await asyncio.to_thread(self.get_with_recall, k, max_snippet_tokens)
+
     def get_cuda_device(self) -> str:
         if torch.backends.mps.is_available():
             return "mps"
@@ -209,64 +362,82 @@ class Memory():
         Returns:
             str: The summarized text
         """
-        if self.tokenizer is None or self.model is None:
+        if self.compressor is None:
             self.logger.warning("No tokenizer or model to perform summarization.")
             return text
         if len(text) < min_length*1.5:
             return text
-        max_length = len(text) // 2 if len(text) > min_length*2 else min_length*2
-        input_text = "summarize: " + text
-        inputs = self.tokenizer(input_text, return_tensors="pt", max_length=512, truncation=True)
-        summary_ids = self.model.generate(
-            inputs['input_ids'],
-            max_length=max_length,
-            min_length=min_length,
-            length_penalty=1.0,
-            num_beams=4,
-            early_stopping=True
-        )
-        summary = self.tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-        summary.replace('summary:', '')
-        self.logger.info(f"Memory summarized from len {len(text)} to {len(summary)}.")
+        summary = self.compressor.summarize(text)
         self.logger.info(f"Summarized text:\n{summary}")
         return summary
     
     #@timer_decorator
-    def compress(self) -> str:
+    def compress(self, needed_tokens: int = 0) -> None:
         """
-        Compress (summarize) the memory using the model.
+        Compress (summarize) the memory using the model, until it fits in the model context.
+        The longest messages are sent to the background compressor, their summaries replace them once ready.
+        Args:
+            needed_tokens (int): Tokens to keep free for a message about to be pushed.
         """
-        if self.tokenizer is None or self.model is None:
+        if self.compressor is None:
             self.logger.warning("No tokenizer or model to perform memory compression.")
             return
-        for i in range(len(self.memory)):
-            if self.memory[i]['role'] == 'system':
-                continue
-            if len(self.memory[i]['content']) > 1024:
-                self.memory[i]['content'] = self.summarize(self.memory[i]['content'])
+        deficit = needed_tokens - self.budget.remaining(self.memory)
+        candidates = [msg for msg in self.memory
+                      if msg['role'] != 'system' and len(msg['content']) > 1024]
+        candidates.sort(key=lambda msg: self.budget.count(msg['content']), reverse=True)
+        for message in candidates:
+            if deficit <= 0:
+                break
+            deficit -= self.budget.count(message['content']) // 2 # summaries are about half as long
+            self.compressor.submit(message['content'],
+                                   lambda original, summary, message=message: self.replace_content(message, original, summary))
+
+    def replace_content(self, message: dict, original: str, summary: str) -> None:
+        """Replace a message by its summary, unless it changed since it was sent for compression."""
+        if message['content'] != original:
+            return
+        message['content'] = summary
+        if self.session_log is None:
+            return
+        for index, msg in enumerate(self.memory):
+            if msg is message:
+                self.session_log.replace(index, summary)
+
+    def wait_compression(self) -> None:
+        """Block until the pending compressions are applied to the memory."""
+        if self.compressor is not None:
+            self.compressor.wait()
     
-    def trim_text_to_max_ctx(self, text: str) -> str:
+    def trim_text_to_max_ctx(self, text: str, max_tokens: int | None = None) -> str:
         """
         Truncate a text to fit within the maximum context size of the model.
+        Args:
+            text (str): The text to truncate.
+            max_tokens (int): Tokens allowed for the text, default to the tokens left after the memory
+                              and the prompt wrapping the text.
         """
-        ideal_ctx = self.get_ideal_ctx(self.model_provider)
-        return text[:ideal_ctx] if ideal_ctx is not None else text
+        if max_tokens is None:
+            # keep a minimum for the text even when the memory fills the context, the memory is compressed on push
+            min_tokens = min(MIN_TEXT_TOKENS, self.budget.context_window // 4)
+            max_tokens = max(self.budget.remaining(self.memory) - 512, min_tokens)
+        return self.budget.trim(text, max_tokens)
     
     #@timer_decorator
     def compress_text_to_max_ctx(self, text) -> str:
         """
         Compress a text to fit within the maximum context size of the model.
         """
-        if self.tokenizer is None or self.model is None:
+        if self.compressor is None:
             self.logger.warning("No tokenizer or model to perform memory compression.")
             return text
-        ideal_ctx = self.get_ideal_ctx(self.model_provider)
-        if ideal_ctx is None:
-            self.logger.warning("No ideal context size found.")
-            return text
-        while len(text) > ideal_ctx:
-            self.logger.info(f"Compressing text: {len(text)} > {ideal_ctx} model context.")
-            text = self.summarize(text)
+        max_tokens = self.budget.remaining(self.memory)
+        while self.budget.count(text) > max_tokens:
+            self.logger.info(f"Compressing text: {self.budget.count(text)} > {max_tokens} tokens left in model context.")
+            summary = self.summarize(text)
+            if len(summary) >= len(text):
+                return self.budget.trim(summary, max_tokens)
+            text = summary
         return text
 
 if __name__ == "__main__":
@@ -297,7 +468,8 @@ Ensure the file exists in the specified location.
     memory.push('assistant', sample_text)
     
     print("\n---\nmemory before:", memory.get())
-    memory.compress()
+    memory.compress(memory.budget.remaining(memory.get()) + 1)
+    memory.wait_compression()
     print("\n---\nmemory after:", memory.get())
     #memory.save_memory()
     
\ No newline at end of file
@@ -0,0 +1,178 @@
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, List
+
+import torch
+
+from sources.logger import Logger
+from sources.model_registry import registry
+
+class MemoryCompressor:
+    """
+    MemoryCompressor summarizes messages in a background thread so compression never blocks the agent loop.
+    Messages waiting for the worker are summarized together in one padded generate call,
+    and summaries are cached by content hash so a text is never summarized twice.
+    The summarization model is loaded on first use from the model registry, which unloads it when idle.
+    """
+    def __init__(self, model_name: str = "pszemraj/led-base-book-summary",
+                 batch_size: int = 8,
+                 cache_size: int = 256,
+                 min_length: int = 64):
+        """
+        Args:
+            model_name (str): The seq2seq summarization model to load from huggingface.
+            batch_size (int): Maximum number of messages summarized in one generate call.
+            cache_size (int): Number of summaries kept in cache.
+            min_length (int): Minimum length of a summary, shorter texts are not summarized.
+        """
+        self.model_name = model_name
+        self.model_lock = threading.Lock()
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.min_length = min_length
+        self.cache = OrderedDict()
+        self.callbacks = {}
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.logger = Logger("memory.log")
+
+    def load_model(self) -> tuple:
+        """
+        The tokenizer and summarization model, from the model registry which loads them on first use.
+        They are not kept between batches, so unloading them from the registry frees them.
+        """
+        return registry.get(self.model_name, self.model_loader)
+
+    def model_loader(self):
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+        return AutoTokenizer.from_pretrained(self.model_name), AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_cached(self, text: str) -> str | None:
+        """Cached summary of a text, None if it was never summarized."""
+        key = self.content_hash(text)
+        with self.lock:
+            summary = self.cache.get(key, None)
+            if summary is not None:
+                self.cache.move_to_end(key)
+            return summary
+
+    def cache_summary(self, text: str, summary: str) -> None:
+        with self.lock:
+            self.cache[self.content_hash(text)] = summary
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def submit(self, text: str, callback: Callable[[str, str], None]) -> None:
+        """
+        Summarize a text in the background, callback is called with the text and its summary once ready.
+        A cached summary is given to the callback immediately.
+        """
+        summary = self.get_cached(text)
+        if summary is not None:
+            callback(text, summary)
+            return
+        key = self.content_hash(text)
+        with self.lock:
+            already_pending = key in self.callbacks
+            self.callbacks.setdefault(key, []).append(callback)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        if not already_pending:
+            self.requests.put(text)
+
+    def run(self) -> None:
+        """Background loop summarizing the waiting messages by batch."""
+        while True:
+            texts = [self.requests.get()]
+            while len(texts) < self.batch_size:
+                try:
+                    texts.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                summaries = self.summarize_batch(texts)
+            except Exception as e:
+                # nothing is cached and no callback is called, the messages are submitted again on next compression
+                self.logger.error(f"Memory compression of {len(texts)} messages failed, they are kept as is: {str(e)}")
+                with self.lock:
+                    for text in texts:
+                        self.callbacks.pop(self.content_hash(text), None)
+                for _ in texts:
+                    self.requests.task_done()
+                continue
+            for text, summary in zip(texts, summaries):
+                self.cache_summary(text, summary)
+                with self.lock:
+                    callbacks = self.callbacks.pop(self.content_hash(text), [])
+                for callback in callbacks:
+                    try:
+                        callback(text, summary)
+                    except Exception as e:
+                        self.logger.warning(f"Memory compression callback failed: {str(e)}")
+                self.requests.task_done()
+
+    def wait(self) -> None:
+        """Block until every submitted text is summarized."""
+        self.requests.join()
+
+    def summarize(self, text: str) -> str:
+        """Summarize a text in the calling thread, using the cache."""
+        summary = self.get_cached(text)
+        if summary is None:
+            summary = self.summarize_batch([text])[0]
+            self.cache_summary(text, summary)
+        return summary
+
+    def summarize_batch(self, texts: List[str]) -> List[str]:
+        """
+        Summarize several texts with one padded generate call.
+        Texts too short to be summarized are returned as is.
+        """
+        summaries = list(texts)
+        indexes = [i for i, text in enumerate(texts) if len(text) >= self.min_length*1.5]
+        if not indexes:
+            return summaries
+        batch = [texts[i] for i in indexes]
+        max_length = max(len(text) // 2 if len(text) > self.min_length*2 else self.min_length*2 for text in batch)
+        with self.model_lock:
+            tokenizer, model = self.load_model()
+            inputs = tokenizer(["summarize: " + text for text in batch], return_tensors="pt",
+                               max_length=512, truncation=True, padding=True)
+            with torch.no_grad():
+                summary_ids = model.generate(
+                    inputs['input_ids'],
+                    attention_mask=inputs['attention_mask'],
+                    max_length=max_length,
+                    min_length=self.min_length,
+                    length_penalty=1.0,
+                    num_beams=4,
+                    early_stopping=True
+                )
+            decoded = tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
+        for i, summary in zip(indexes, decoded):
+            summaries[i] = summary.replace('summary:', '').strip()
+            self.logger.info(f"Memory summarized from len {len(texts[i])} to {len(summaries[i])}.")
+        self.logger.info(f"Summarized {len(batch)} messages in one batch.")
+        return summaries
+
+shared_compressor = None
+shared_compressor_lock = threading.Lock()
+
+def get_shared_compressor() -> MemoryCompressor:
+    """
+    The compressor shared by the memories of all agents, so the summarization model is loaded once per process.
+    The model is unloaded when idle by the model registry, see MODEL_IDLE_UNLOAD.
+    """
+    global shared_compressor
+    with shared_compressor_lock:
+        if shared_compressor is None:
+            shared_compressor = MemoryCompressor()
+        return shared_compressor
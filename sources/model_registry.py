@@ -0,0 +1,178 @@
+import os
+import gc
+import time
+import threading
+from typing import Any, Callable, Dict
+
+from sources.logger import Logger
+
+def estimate_size(obj: Any, depth: int = 0) -> int:
+    """
+    Bytes used by the torch weights of a model, a pipeline, a classifier or a tuple of them.
+    """
+    if obj is None or depth > 3:
+        return 0
+    if hasattr(obj, "parameters") and hasattr(obj, "buffers"):
+        tensors = list(obj.parameters()) + list(obj.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    if isinstance(obj, (tuple, list)):
+        return sum(estimate_size(item, depth + 1) for item in obj)
+    if isinstance(obj, dict):
+        return sum(estimate_size(item, depth + 1) for item in obj.values())
+    if hasattr(obj, "model"):
+        return estimate_size(obj.model, depth + 1)
+    return 0
+
+class ModelEntry:
+    """
+    A model of the registry and its usage statistics.
+    """
+    def __init__(self, name: str, loader: Callable[[], Any], pinned: bool = False):
+        self.name = name
+        self.loader = loader
+        self.pinned = pinned
+        self.value = None
+        self.size = 0
+        self.load_time = 0.0
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def jsonify(self) -> dict:
+        return {
+            "loaded": self.value is not None,
+            "pinned": self.pinned,
+            "size_mb": round(self.size / 2**20, 1),
+            "load_time": round(self.load_time, 2),
+            "last_used": self.last_used
+        }
+
+class ModelRegistry:
+    """
+    ModelRegistry loads each model once per process and shares it between all its consumers.
+    Models are loaded on first use, pinned models stay loaded, the others can be unloaded when idle.
+    """
+    def __init__(self):
+        self.entries: Dict[str, ModelEntry] = {}
+        self.lock = threading.Lock()
+        self.idle_thread = None
+        self.idle_stop = threading.Event()
+        self.logger = Logger("model_registry.log")
+
+    def register(self, name: str, loader: Callable[[], Any], pinned: bool = False) -> ModelEntry:
+        """
+        Declare how to load a model, without loading it.
+        Args:
+            name (str): Unique name of the model, eg: its huggingface id.
+            loader (Callable): Load and return the model.
+            pinned (bool): Whether the model must stay loaded, eg: because consumers keep a reference to it.
+        """
+        with self.lock:
+            entry = self.entries.get(name, None)
+            if entry is None:
+                entry = ModelEntry(name, loader, pinned)
+                self.entries[name] = entry
+            entry.pinned = entry.pinned or pinned
+            return entry
+
+    def get(self, name: str, loader: Callable[[], Any] | None = None, pinned: bool = False) -> Any:
+        """
+        Get a model, loading it on first use. Concurrent calls for the same model wait for a single load.
+        Args:
+            name (str): Unique name of the model.
+            loader (Callable): Load and return the model, needed if the model was not registered.
+            pinned (bool): Whether the model must stay loaded.
+        """
+        if loader is not None:
+            entry = self.register(name, loader, pinned)
+        else:
+            with self.lock:
+                entry = self.entries.get(name, None)
+            if entry is None:
+                raise KeyError(f"Model {name} is not registered.")
+        with entry.lock:
+            if entry.value is None:
+                start = time.time()
+                self.logger.info(f"Loading model {name}...")
+                entry.value = entry.loader()
+                entry.load_time = time.time() - start
+                entry.size = estimate_size(entry.value)
+                self.logger.info(f"Loaded model {name} in {entry.load_time:.1f}s ({entry.size / 2**20:.0f} MB).")
+            entry.last_used = time.time()
+            return entry.value
+
+    def is_loaded(self, name: str) -> bool:
+        with self.lock:
+            entry = self.entries.get(name, None)
+        return entry is not None and entry.value is not None
+
+    def unload(self, name: str) -> None:
+        """Drop the registry reference to a model, it is loaded again on next use."""
+        with self.lock:
+            entry = self.entries.get(name, None)
+        if entry is None:
+            return
+        with entry.lock:
+            if entry.value is None:
+                return
+            entry.value = None
+            entry.size = 0
+        gc.collect()
+        self.logger.info(f"Unloaded model {name}.")
+
+    def unload_idle(self, idle_seconds: float) -> None:
+        """Unload the models that are not pinned and were not used for idle_seconds."""
+        with self.lock:
+            entries = list(self.entries.values())
+        for entry in entries:
+            if not entry.pinned and entry.value is not None and time.time() - entry.last_used >= idle_seconds:
+                self.unload(entry.name)
+
+    def start_idle_unloader(self, idle_seconds: float, interval: float | None = None) -> None:
+        """
+        Unload the idle models periodically in a background thread.
+        Args:
+            idle_seconds (float): Seconds without use before a model that is not pinned is unloaded.
+            interval (float): Seconds between two checks, default to a quarter of idle_seconds.
+        """
+        with self.lock:
+            if self.idle_thread is not None:
+                return
+            self.idle_stop.clear()
+            interval = interval or max(idle_seconds / 4, 1.0)
+            self.idle_thread = threading.Thread(target=self.run_idle_unloader, args=(idle_seconds, interval), daemon=True)
+            self.idle_thread.start()
+        self.logger.info(f"Unloading models idle for {idle_seconds:.0f}s.")
+
+    def run_idle_unloader(self, idle_seconds: float, interval: float) -> None:
+        while not self.idle_stop.wait(interval):
+            try:
+                self.unload_idle(idle_seconds)
+            except Exception as e:
+                self.logger.error(f"Unloading idle models failed: {str(e)}")
+
+    def stop_idle_unloader(self) -> None:
+        with self.lock:
+            thread, self.idle_thread = self.idle_thread, None
+        self.idle_stop.set()
+        if thread is not None:
+            thread.join()
+
+    def memory_usage(self) -> int:
+        """Bytes used by the weights of the loaded models."""
+        with self.lock:
+            return sum(entry.size for entry in self.entries.values())
+
+    def status(self) -> dict:
+        with self.lock:
+            return {name: entry.jsonify() for name, entry in self.entries.items()}
+
+registry = ModelRegistry()
+
+def start_idle_unloader() -> None:
+    """
+    Unload the models that are not pinned (eg: translation, memory compression) after MODEL_IDLE_UNLOAD seconds
+    without use, 900 by default, 0 keeps them loaded.
+    """
+    idle_seconds = float(os.getenv("MODEL_IDLE_UNLOAD", 900))
+    if idle_seconds > 0:
+        registry.start_idle_unloader(idle_seconds)
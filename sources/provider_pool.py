@@ -0,0 +1,256 @@
+import time
+import threading
+import configparser
+from typing import List, Tuple
+
+from sources.logger import Logger
+from sources.llm_provider import Provider
+from sources.health_monitor import HealthMonitor, CircuitOpenError
+from sources.utility import pretty_print
+
+class Backend:
+    """
+    A provider of the pool with its load and latency statistics.
+    """
+    def __init__(self, provider: Provider):
+        self.provider = provider
+        self.outstanding = 0
+        self.latency = None # moving average of the time to first token, in seconds
+        self.failures = 0
+
+    def jsonify(self) -> dict:
+        return {
+            "provider": self.provider.provider_name,
+            "model": self.provider.model,
+            "address": self.provider.server_ip,
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "failures": self.failures
+        }
+
+class ProviderPool:
+    """
+    ProviderPool spreads LLM requests over several providers and fails over to the next one when a provider errors.
+    It can be used anywhere a Provider is expected.
+    """
+    strategies = ["least_outstanding", "latency", "priority"]
+
+    def __init__(self, providers: List[Provider], strategy: str = "least_outstanding", smoothing: float = 0.3):
+        """
+        Args:
+            providers (List[Provider]): Providers of the pool, the first one is the primary provider.
+            strategy (str): How the provider of a request is chosen:
+                least_outstanding: the provider with the fewest requests in flight.
+                latency: the provider with the lowest time to first token.
+                priority: always the first available provider, in configuration order.
+            smoothing (float): Weight of the last request in the latency moving average.
+        """
+        if len(providers) == 0:
+            raise ValueError("ProviderPool needs at least one provider.")
+        if strategy not in self.strategies:
+            raise ValueError(f"Unknown load balancing strategy: {strategy}. Choose from {self.strategies}")
+        self.backends = [Backend(provider) for provider in providers]
+        self.strategy = strategy
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.stream_listeners = []
+        self.logger = Logger("provider_pool.log")
+
+    @property
+    def primary(self) -> Provider:
+        return self.backends[0].provider
+
+    @property
+    def provider_name(self) -> str:
+        return self.primary.provider_name
+
+    @property
+    def model(self) -> str:
+        return self.primary.model
+
+    @property
+    def health(self) -> HealthMonitor:
+        return self.primary.health
+
+    def get_model_name(self) -> str:
+        return self.primary.get_model_name()
+
+    def get_context_window(self) -> int | None:
+        """Smallest context served by the providers, so a prompt fits whichever provider answers."""
+        contexts = [backend.provider.get_context_window() for backend in self.backends]
+        contexts = [context for context in contexts if context is not None]
+        return min(contexts) if contexts else None
+
+    def add_stream_listener(self, listener) -> None:
+        """
+        Register a callback receiving every generated text delta.
+        The callback is called with None once a completion is finished.
+        """
+        self.stream_listeners.append(listener)
+
+    def remove_stream_listener(self, listener) -> None:
+        if listener in self.stream_listeners:
+            self.stream_listeners.remove(listener)
+
+    def notify_stream_listeners(self, delta) -> None:
+        for listener in list(self.stream_listeners):
+            try:
+                listener(delta)
+            except Exception as e:
+                self.logger.warning(f"Stream listener failed: {str(e)}")
+
+    def ordered_backends(self) -> List[Backend]:
+        """
+        Backends in the order they should be tried for the next request.
+        Backends with an open circuit are tried last.
+        """
+        with self.lock:
+            backends = list(enumerate(self.backends))
+        if self.strategy == "least_outstanding":
+            backends.sort(key=lambda b: (b[1].outstanding, b[1].latency or 0.0, b[0]))
+        elif self.strategy == "latency":
+            backends.sort(key=lambda b: (b[1].latency or 0.0, b[1].outstanding, b[0]))
+        available = [b for _, b in backends if b.provider.health.allow_request(b.provider.server_ip)]
+        return available + [b for _, b in backends if b not in available]
+
+    def start_request(self, backend: Backend) -> float:
+        with self.lock:
+            backend.outstanding += 1
+        return time.time()
+
+    def end_request(self, backend: Backend, first_token_latency: float | None, failed: bool) -> None:
+        with self.lock:
+            backend.outstanding -= 1
+            backend.failures = backend.failures + 1 if failed else 0
+            if first_token_latency is None:
+                return
+            if backend.latency is None:
+                backend.latency = first_token_latency
+            else:
+                backend.latency = self.smoothing * first_token_latency + (1 - self.smoothing) * backend.latency
+
+    def respond(self, history, verbose=True):
+        """
+        Generate text with the first provider of the pool able to answer.
+        """
+        return "".join(self.respond_stream(history, verbose))
+
+    def respond_stream(self, history, verbose=True):
+        """
+        Generate text with the first provider of the pool able to answer, yielding it as it is generated.
+        A provider failing before its first token is replaced by the next one.
+        Once text was yielded the answer can't be restarted, so a later failure is answered to the user.
+        """
+        errors = []
+        try:
+            for backend in self.ordered_backends():
+                provider = backend.provider
+                start = self.start_request(backend)
+                latency = None
+                try:
+                    for chunk in provider.respond_stream(history, verbose, raise_on_failure=True):
+                        if latency is None:
+                            latency = time.time() - start
+                        self.notify_stream_listeners(chunk)
+                        yield chunk
+                    self.end_request(backend, latency, failed=False)
+                    return
+                except Exception as e:
+                    self.end_request(backend, latency, failed=True)
+                    if latency is not None:
+                        yield provider.format_provider_error(e)
+                        return
+                    self.logger.warning(f"Provider {provider.provider_name} at {provider.server_ip} failed, trying next: {str(e)}")
+                    errors.append((provider, e))
+                except BaseException:
+                    self.end_request(backend, latency, failed=False)
+                    raise
+            yield self.handle_pool_failure(errors)
+        finally:
+            self.notify_stream_listeners(None)
+
+    async def respond_async(self, history, verbose=True):
+        """
+        Generate text with the first provider of the pool able to answer, without blocking the event loop.
+        """
+        thought = ""
+        async for chunk in self.respond_stream_async(history, verbose):
+            thought += chunk
+        return thought
+
+    async def respond_stream_async(self, history, verbose=True):
+        """
+        Asynchronous version of respond_stream, cancelling the consuming task cancels the current provider request.
+        """
+        errors = []
+        try:
+            for backend in self.ordered_backends():
+                provider = backend.provider
+                start = self.start_request(backend)
+                latency = None
+                try:
+                    async for chunk in provider.respond_stream_async(history, verbose, raise_on_failure=True):
+                        if latency is None:
+                            latency = time.time() - start
+                        self.notify_stream_listeners(chunk)
+                        yield chunk
+                    self.end_request(backend, latency, failed=False)
+                    return
+                except Exception as e:
+                    self.end_request(backend, latency, failed=True)
+                    if latency is not None:
+                        yield provider.format_provider_error(e)
+                        return
+                    self.logger.warning(f"Provider {provider.provider_name} at {provider.server_ip} failed, trying next: {str(e)}")
+                    errors.append((provider, e))
+                except BaseException:
+                    self.end_request(backend, latency, failed=False)
+                    raise
+            yield self.handle_pool_failure(errors)
+        finally:
+            self.notify_stream_listeners(None)
+
+    def handle_pool_failure(self, errors: List[Tuple[Provider, Exception]]) -> str:
+        """
+        Answer for the user once every provider of the pool failed, raise if the error can't be answered.
+        The error answered is the one of the last provider tried, skipping the providers with an open circuit
+        unless no request was sent at all.
+        Args:
+            errors (List[Tuple[Provider, Exception]]): The providers tried, in order, with their error.
+        """
+        self.logger.error(f"All {len(self.backends)} providers failed.")
+        sent = [(provider, e) for provider, e in errors if not isinstance(e, CircuitOpenError)]
+        provider, e = (sent or errors)[-1]
+        return provider.format_provider_error(e)
+
+    def status(self) -> list:
+        with self.lock:
+            return [backend.jsonify() for backend in self.backends]
+
+def create_provider(config: configparser.ConfigParser) -> Provider | ProviderPool:
+    """
+    Create the provider described in the MAIN section of the config.
+    Each [PROVIDER.<name>] section adds a fallback provider, the providers are then used through a ProviderPool.
+    Args:
+        config (ConfigParser): The loaded config.ini.
+    Returns:
+        Provider | ProviderPool: The provider to give to the agents.
+    """
+    sections = [config["MAIN"]] + [config[name] for name in config.sections() if name.startswith("PROVIDER.")]
+    providers = []
+    for section in sections:
+        providers.append(Provider(
+            provider_name=section["provider_name"],
+            model=section["provider_model"],
+            server_address=section.get("provider_server_address", "127.0.0.1:5000"),
+            is_local=section.getboolean("is_local", fallback=False),
+            health=providers[0].health if providers else None, # one circuit breaker per endpoint for the whole pool
+            requests_per_minute=section.getfloat("requests_per_minute", fallback=None),
+            tokens_per_minute=section.getfloat("tokens_per_minute", fallback=None),
+            context_window=section.getint("context_window", fallback=None)
+        ))
+    if len(providers) == 1:
+        return providers[0]
+    strategy = config["MAIN"].get("load_balancing", "least_outstanding")
+    pretty_print(f"Using {len(providers)} providers with {strategy} load balancing.", color="status")
+    return ProviderPool(providers, strategy=strategy)
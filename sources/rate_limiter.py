@@ -0,0 +1,175 @@
+import math
+import time
+import random
+import asyncio
+import threading
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+from sources.logger import Logger
+from sources.token_budget import TokenBudget
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a provider refuses a request because of rate limits.
+    """
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously up to its per minute capacity.
+    Reservations can take the bucket below zero, later requests then wait for the debt to be refilled.
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take amount from the bucket, return the seconds to wait before the reservation is covered."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= min(amount, self.capacity) # a request bigger than the bucket only waits for a full bucket
+        return max(0.0, -self.level / self.rate)
+
+class RateLimiter:
+    """
+    RateLimiter queues the requests of a provider to stay within its requests and tokens per minute,
+    and decides how long to wait before retrying a rate limited request.
+    """
+    def __init__(self, requests_per_minute: float | None = None,
+                 tokens_per_minute: float | None = None,
+                 max_retries: int = 6,
+                 base_delay: float = 1.0,
+                 max_delay: float = 60.0,
+                 model_name: str | None = None):
+        """
+        Args:
+            requests_per_minute (float): Maximum requests sent per minute, None for no limit.
+            tokens_per_minute (float): Maximum prompt tokens sent per minute, None for no limit.
+            max_retries (int): Retries of a rate limited request before giving up.
+            base_delay (float): Backoff of the first retry when the provider gives no Retry-After.
+            max_delay (float): Maximum backoff between two retries.
+            model_name (str): Model of the provider, prompt tokens are counted with its tokenizer.
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = TokenBudget(model_name)
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.logger = Logger("rate_limiter.log")
+
+    def estimate_tokens(self, history: list) -> int:
+        """Number of prompt tokens of a conversation, counted like the prompt budget of the memory."""
+        if self.tokens is None:
+            return 0 # no tokens per minute limit, nothing to count
+        return self.budget.count_messages(history)
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        Reserve a request of the given size, return the seconds to wait before sending it.
+        Reservations are served in order so waiting requests are queued rather than refused.
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+        return wait
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until a request of the given size may be sent."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self.logger.info(f"Rate limit reached, request queued for {wait:.1f}s.")
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        """Wait without blocking the event loop until a request of the given size may be sent."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self.logger.info(f"Rate limit reached, request queued for {wait:.1f}s.")
+            await asyncio.sleep(wait)
+
+    def retry_delay(self, e: Exception, attempt: int) -> float | None:
+        """
+        Seconds to wait before retrying a failed request, None if it should not be retried.
+        The Retry-After of the provider is honoured, otherwise the backoff doubles at each attempt with jitter.
+        All requests of the provider are paused for the delay.
+        """
+        if attempt >= self.max_retries:
+            return None
+        error = find_rate_limit_error(e)
+        if error is None:
+            return None
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, 0.1 * retry_after + 0.1)
+        else:
+            backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+            delay = backoff / 2 + random.uniform(0, backoff / 2)
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.logger.warning(f"Rate limited (attempt {attempt + 1}/{self.max_retries}), retrying in {delay:.1f}s: {str(e)}")
+        return delay
+
+def find_rate_limit_error(e: Exception) -> Exception | None:
+    """
+    Find the rate limit error in an exception or the exceptions it was raised from.
+    """
+    error = e
+    while error is not None:
+        if isinstance(error, RateLimitExceeded) or type(error).__name__ == "RateLimitError":
+            return error
+        response = getattr(error, "response", None)
+        if getattr(error, "status_code", None) == 429 or getattr(response, "status_code", None) == 429:
+            return error
+        error = error.__cause__
+    message = str(e).lower()
+    if "rate limit" in message or "too many requests" in message or "error code: 429" in message:
+        return e
+    return None
+
+def parse_retry_after(value) -> float | None:
+    """
+    Seconds to wait from a Retry-After value, either delay seconds or an HTTP-date (RFC 9110).
+    None if the value can't be parsed.
+    """
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        try:
+            date = parsedate_to_datetime(str(value))
+            if date.tzinfo is None:
+                date = date.replace(tzinfo=timezone.utc) # HTTP-dates are always in GMT
+            seconds = date.timestamp() - time.time()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return None
+    if not math.isfinite(seconds):
+        return None
+    return max(0.0, seconds)
+
+def get_retry_after(e: Exception) -> float | None:
+    """
+    Seconds to wait given by the provider in the error or its Retry-After header, None if not given or unparsable.
+    """
+    retry_after = parse_retry_after(getattr(e, "retry_after", None))
+    if retry_after is not None:
+        return retry_after
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = parse_retry_after(headers.get("retry-after-ms"))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return parse_retry_after(headers.get("retry-after"))
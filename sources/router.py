@@ -1,7 +1,11 @@
 import os
 import sys
+import copy
 import torch
 import random
+import threading
+from collections import OrderedDict
+import numpy as np
 from typing import List, Tuple, Type, Dict
 
 from transformers import pipeline
@@ -13,22 +17,136 @@ from sources.agents.casual_agent import CasualAgent
 from sources.agents.planner_agent import FileAgent
 from sources.agents.browser_agent import BrowserAgent
 from sources.language import LanguageUtility
+from sources.model_registry import registry
+from sources.router_cache import RouterCache
+from sources.router_state import RouterState
 from sources.utility import pretty_print, animate_thinking, timer_decorator
 from sources.logger import Logger
 
+# zero-shot model voting with the llm router, for the backends that have one
+ZERO_SHOT_MODELS = {
+    "vote": "facebook/bart-large-mnli",
+    "distilled": "valhalla/distilbart-mnli-12-1"
+}
+ROUTER_BACKENDS = ["vote", "distilled", "classifier", "multilingual"]
+# encoder of the multilingual backend, classifying queries in their language without translation
+MULTILINGUAL_ENCODER = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Dynamic int8 quantization of the linear layers of a model running on CPU."""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_zero_shot(name: str, quantized: bool = False):
+    classifier = pipeline("zero-shot-classification", model=name)
+    if quantized and classifier.device.type == "cpu":
+        classifier.model = quantize_int8(classifier.model)
+    return classifier
+
+def load_router_classifier(path: str, quantized: bool = False) -> AdaptiveClassifier:
+    classifier = AdaptiveClassifier.from_pretrained(path)
+    if quantized and str(getattr(classifier, "device", "cpu")) == "cpu":
+        classifier.model = quantize_int8(classifier.model)
+    return classifier
+
+def llm_router_path() -> str:
+    return "../llm_router" if __name__ == "__main__" else "./llm_router"
+
+def load_multilingual_classifier(quantized: bool = False) -> AdaptiveClassifier:
+    classifier = AdaptiveClassifier(MULTILINGUAL_ENCODER)
+    if quantized and str(getattr(classifier, "device", "cpu")) == "cpu":
+        classifier.model = quantize_int8(classifier.model)
+    return classifier
+
+def llm_router_name(backend: str = "vote") -> str:
+    if backend == "multilingual":
+        return "llm_router-multilingual"
+    return "llm_router" if backend == "vote" else "llm_router-int8"
+
+def needs_translation(backend: str = "vote") -> bool:
+    """Whether queries must be translated to english before being classified by the backend."""
+    return backend != "multilingual"
+
+def register_router_models(backend: str = "vote", languages: List[str] = []) -> List[str]:
+    """
+    Declare the routing models of a backend in the model registry without loading them, so they can be preloaded at startup.
+    Backends:
+        vote: BART large zero-shot classification votes with the llm router.
+        distilled: a distilled BART zero-shot model votes with the llm router, both int8 quantized on CPU.
+        classifier: the llm router alone, int8 quantized on CPU, trained from the few-shot examples.
+        multilingual: a classifier on a multilingual encoder trained from the few-shot examples,
+                      queries are classified in their language so no translation model is loaded.
+    args:
+        backend: The router backend
+        languages: The supported languages, their translation models are included if the backend needs them
+    returns:
+        List[str]: The names of the routing models
+    """
+    if backend not in ROUTER_BACKENDS:
+        raise ValueError(f"Unknown router backend {backend}, expected one of {', '.join(ROUTER_BACKENDS)}.")
+    path = llm_router_path()
+    quantized = backend != "vote"
+    names = []
+    if backend in ZERO_SHOT_MODELS:
+        name = ZERO_SHOT_MODELS[backend]
+        registry.register(name, lambda: load_zero_shot(name, quantized), pinned=True)
+        names.append(name)
+    if backend == "multilingual":
+        registry.register(llm_router_name(backend), lambda: load_multilingual_classifier(quantized), pinned=True)
+    else:
+        registry.register(llm_router_name(backend), lambda: load_router_classifier(path, quantized), pinned=True)
+    names.append(llm_router_name(backend))
+    if needs_translation(backend):
+        names += LanguageUtility.register_translators(languages)
+    return names
+
+class SharedEmbeddings:
+    """
+    Memo of the embeddings computed by the llm router encoder, shared by the classifiers forked from it,
+    so the complexity and talk classifiers embed a query once instead of once each.
+    """
+    def __init__(self, get_embeddings, max_size: int = 64):
+        """
+        Args:
+            get_embeddings (Callable): The embedding function of one of the classifiers.
+            max_size (int): Number of embeddings kept.
+        """
+        self.get_embeddings = get_embeddings
+        self.max_size = max_size
+        self.memo = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __call__(self, texts: List[str]) -> list:
+        with self.lock:
+            missing = list(dict.fromkeys(text for text in texts if text not in self.memo))
+            if missing:
+                for text, embedding in zip(missing, self.get_embeddings(missing)):
+                    self.memo[text] = embedding
+            embeddings = []
+            for text in texts:
+                self.memo.move_to_end(text)
+                embeddings.append(self.memo[text])
+            while len(self.memo) > self.max_size:
+                self.memo.popitem(last=False)
+            return embeddings
+
 class AgentRouter:
     """
     AgentRouter is a class that selects the appropriate agent based on the user query.
     """
-    def __init__(self, agents: list, supported_language: List[str] = ["en", "fr", "zh"]):
+    def __init__(self, agents: list, supported_language: List[str] = ["en", "fr", "zh"], backend: str = "vote"):
         self.agents = agents
+        self.backend = backend
         self.logger = Logger("router.log")
         self.lang_analysis = LanguageUtility(supported_language=supported_language)
         self.pipelines = self.load_pipelines()
+        self.state = RouterState(os.path.join(llm_router_path(), "router_state"),
+                                 os.path.join(llm_router_path(), "model.safetensors"))
         self.talk_classifier = self.load_llm_router()
         self.complexity_classifier = self.load_llm_router()
         self.learn_few_shots_tasks()
         self.learn_few_shots_complexity()
+        self.embeddings = self.share_embeddings([self.talk_classifier, self.complexity_classifier])
+        self.cache = RouterCache(self.embed_queries if self.embeddings is not None else None)
         self.asked_clarify = False
     
     def load_pipelines(self) -> Dict[str, Type[pipeline]]:
@@ -37,26 +155,57 @@ class AgentRouter:
         returns:
             Dict[str, Type[pipeline]]: The loaded pipelines
         """
+        register_router_models(self.backend)
+        if self.backend not in ZERO_SHOT_MODELS:
+            return {}
         animate_thinking("Loading zero-shot pipeline...", color="status")
         return {
-            "bart": pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
+            "bart": registry.get(ZERO_SHOT_MODELS[self.backend])
         }
 
     def load_llm_router(self) -> AdaptiveClassifier:
         """
         Load the LLM router model.
+        The saved router is loaded once, each call returns a copy with its own examples sharing the encoder weights.
         returns:
             AdaptiveClassifier: The loaded model
         exceptions:
             Exception: If the safetensors fails to load
         """
-        path = "../llm_router" if __name__ == "__main__" else "./llm_router"
         try:
             animate_thinking("Loading LLM router model...", color="status")
-            talk_classifier = AdaptiveClassifier.from_pretrained(path)
+            register_router_models(self.backend)
+            base = registry.get(llm_router_name(self.backend))
         except Exception as e:
             raise Exception("Failed to load the routing model. Please run the dl_safetensors.sh script inside llm_router/ directory to download the model.")
-        return talk_classifier
+        return self.fork_classifier(base)
+
+    def fork_classifier(self, base: AdaptiveClassifier) -> AdaptiveClassifier:
+        """
+        Copy a classifier without copying its encoder, the copy can learn examples without changing the original.
+        """
+        model, tokenizer = base.model, base.tokenizer
+        base.model, base.tokenizer = None, None
+        try:
+            classifier = copy.deepcopy(base)
+        finally:
+            base.model, base.tokenizer = model, tokenizer
+        classifier.model, classifier.tokenizer = model, tokenizer
+        return classifier
+
+    def share_embeddings(self, classifiers: List[AdaptiveClassifier]) -> SharedEmbeddings | None:
+        """
+        Make classifiers forked from the same encoder share their query embeddings,
+        predicting with all of them then costs a single encoder pass per query.
+        Returns:
+            SharedEmbeddings | None: The shared embedding function, None if the classifiers can't share it.
+        """
+        if not all(hasattr(classifier, "_get_embeddings") for classifier in classifiers):
+            return None
+        shared = SharedEmbeddings(classifiers[0]._get_embeddings)
+        for classifier in classifiers:
+            classifier._get_embeddings = shared
+        return shared
 
     def get_device(self) -> str:
         if torch.backends.mps.is_available():
@@ -195,10 +344,7 @@ class AgentRouter:
             ("Create a Node.js app to query a public API for event listings and display them", "HIGH"),
             ("Find a file named ‘budget.xlsx’, analyze its data, and generate a chart", "HIGH"),
         ]
-        random.shuffle(few_shots)
-        texts = [text for text, _ in few_shots]
-        labels = [label for _, label in few_shots]
-        self.complexity_classifier.add_examples(texts, labels)
+        self.complexity_classifier = self.learn_examples("complexity", self.complexity_classifier, few_shots)
 
     def learn_few_shots_tasks(self) -> None:
         """
@@ -351,10 +497,29 @@ class AgentRouter:
             ("hi", "talk"),
             ("hello", "talk"),
         ]
+        self.talk_classifier = self.learn_examples("tasks", self.talk_classifier, few_shots)
+
+    def learn_examples(self, name: str, classifier: AdaptiveClassifier, few_shots: List[Tuple[str, str]]) -> AdaptiveClassifier:
+        """
+        Teach few shot examples to a classifier, or load the state learned from the same examples at a previous startup.
+        Args:
+            name (str): Name of the classifier state.
+            classifier (AdaptiveClassifier): The classifier, forked from the llm router.
+            few_shots (List[Tuple[str, str]]): The examples and their labels.
+        Returns:
+            AdaptiveClassifier: The classifier with the examples learned
+        """
+        version = self.state.version(few_shots, self.backend, str(getattr(classifier, "device", "cpu")))
+        learned = self.state.load(name, version, self.fork_classifier(classifier))
+        if learned is not None:
+            return learned
+        few_shots = list(few_shots)
         random.shuffle(few_shots)
         texts = [text for text, _ in few_shots]
         labels = [label for _, label in few_shots]
-        self.talk_classifier.add_examples(texts, labels)
+        classifier.add_examples(texts, labels)
+        self.state.save(name, version, classifier)
+        return classifier
 
     def llm_router(self, text: str) -> tuple:
         """
@@ -376,9 +541,25 @@ class AgentRouter:
         Returns:
             str: The selected label
         """
+        return self.router_vote_with_confidence(text, labels, log_confidence)[0]
+
+    def router_vote_with_confidence(self, text: str, labels: list, log_confidence:bool = False) -> Tuple[str, float]:
+        """
+        Vote between the LLM router and BART model.
+        Args:
+            text: The input text
+            labels: The labels to classify
+        Returns:
+            Tuple[str, float]: The selected label and its share of the vote
+        """
         if len(text) <= 8:
-            return "talk"
-        result_bart = self.pipelines['bart'](text, labels)
+            return "talk", 1.0
+        if "bart" not in self.pipelines:
+            llm_router, confidence_llm_router = self.llm_router(text)
+            self.logger.info(f"Routing for text {text}: LLM-router: {llm_router} ({confidence_llm_router})")
+            return llm_router, confidence_llm_router
+        # one forward pass for all the label hypotheses instead of one per label
+        result_bart = self.pipelines['bart'](text, labels, batch_size=len(labels))
         result_llm_router = self.llm_router(text)
         bart, confidence_bart = result_bart['labels'][0], result_bart['scores'][0]
         llm_router, confidence_llm_router = result_llm_router[0], result_llm_router[1]
@@ -387,7 +568,9 @@ class AgentRouter:
         self.logger.info(f"Routing Vote for text {text}: BART: {bart} ({final_score_bart}) LLM-router: {llm_router} ({final_score_llm})")
         if log_confidence:
             pretty_print(f"Agent choice -> BART: {bart} ({final_score_bart}) LLM-router: {llm_router} ({final_score_llm})")
-        return bart if final_score_bart > final_score_llm else llm_router
+        if final_score_bart > final_score_llm:
+            return bart, final_score_bart
+        return llm_router, final_score_llm
     
     def find_first_sentence(self, text: str) -> str:
         first_sentence = None
@@ -406,25 +589,61 @@ class AgentRouter:
         Returns:
         str: The estimated complexity
         """
+        return self.estimate_complexity_with_confidence(text)[0]
+
+    def estimate_complexity_with_confidence(self, text: str) -> Tuple[str, float]:
+        """
+        Estimate the complexity of the text.
+        Args:
+            text: The input text
+        Returns:
+            Tuple[str, float]: The estimated complexity and the confidence of the classifier
+        """
         try:
             predictions = self.complexity_classifier.predict(text)
         except Exception as e:
             pretty_print(f"Error in estimate_complexity: {str(e)}", color="failure")
-            return "LOW"
+            return "LOW", 0.0
         predictions = sorted(predictions, key=lambda x: x[1], reverse=True)
         if len(predictions) == 0:
-            return "LOW"
+            return "LOW", 0.0
         complexity, confidence = predictions[0][0], predictions[0][1]
         if confidence < 0.5:
             self.logger.info(f"Low confidence in complexity estimation: {confidence}")
-            return "HIGH"
+            return "HIGH", confidence
         if complexity == "HIGH":
-            return "HIGH"
+            return "HIGH", confidence
         elif complexity == "LOW":
-            return "LOW"
+            return "LOW", confidence
         pretty_print(f"Failed to estimate the complexity of the text.", color="failure")
-        return "LOW"
+        return "LOW", 0.0
     
+    def find_agent_by_type(self, agent_type: str) -> Agent | None:
+        for agent in self.agents:
+            if agent.type == agent_type:
+                return agent
+        return None
+
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """
+        Embeddings of texts by the routing classifiers, used to find near-duplicate queries.
+        They go through the embeddings shared by the classifiers, so no other model is loaded
+        and a text embedded for the cache is not embedded again to be classified.
+        """
+        embeddings = self.embeddings(texts)
+        return np.stack([embedding.detach().cpu().numpy() if torch.is_tensor(embedding) else np.asarray(embedding)
+                         for embedding in embeddings])
+
+    def find_cached_agent(self, query: str, decision: str | None) -> Agent | None:
+        """The agent of a routing cache decision, None on cache miss."""
+        if decision is None:
+            return None
+        agent = self.find_agent_by_type(decision)
+        if agent is not None:
+            self.logger.info(f"Routing cache hit for text {query}: {decision}")
+            pretty_print(f"Selected agent: {agent.agent_name} (roles: {agent.role})", color="warning")
+        return agent
+
     def find_planner_agent(self) -> Agent:
         """
         Find the planner agent.
@@ -449,26 +668,39 @@ class AgentRouter:
         assert len(self.agents) > 0, "No agents available."
         if len(self.agents) == 1:
             return self.agents[0]
-        lang = self.lang_analysis.detect_language(text)
+        query = text
+        agent = self.find_cached_agent(query, self.cache.get_exact(query))
+        if agent is not None:
+            return agent
         text = self.find_first_sentence(text)
-        text = self.lang_analysis.translate(text, lang)
+        if needs_translation(self.backend):
+            lang = self.lang_analysis.detect_language(query)
+            text = self.lang_analysis.translate(text, lang)
+        # the text the classifiers predict on is embedded, so the classifiers reuse the embedding of the cache lookup
+        decision, embedding = self.cache.get_similar(query, embedding_text=text)
+        agent = self.find_cached_agent(query, decision)
+        if agent is not None:
+            return agent
         labels = [agent.role for agent in self.agents]
-        complexity = self.estimate_complexity(text)
+        complexity, confidence = self.estimate_complexity_with_confidence(text)
         if complexity == "HIGH":
             pretty_print(f"Complex task detected, routing to planner agent.", color="info")
-            return self.find_planner_agent()
+            planner = self.find_planner_agent()
+            if planner is not None:
+                self.cache.put(query, planner.type, confidence, embedding)
+            return planner
         try:
-            best_agent = self.router_vote(text, labels, log_confidence=False)
+            best_agent, confidence = self.router_vote_with_confidence(text, labels, log_confidence=False)
         except Exception as e:
             raise e
-        for agent in self.agents:
-            if best_agent == agent.role:
-                role_name = agent.role
-                pretty_print(f"Selected agent: {agent.agent_name} (roles: {role_name})", color="warning")
-                return agent
-        pretty_print(f"Error choosing agent.", color="failure")
-        self.logger.error("No agent selected.")
-        return None
+        agent = next((agent for agent in self.agents if agent.role == best_agent), None)
+        if agent is None:
+            pretty_print(f"Error choosing agent.", color="failure")
+            self.logger.error("No agent selected.")
+            return None
+        self.cache.put(query, agent.type, confidence, embedding)
+        pretty_print(f"Selected agent: {agent.agent_name} (roles: {agent.role})", color="warning")
+        return agent
 
 if __name__ == "__main__":
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,147 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from sources.logger import Logger
+
+class RouterCache:
+    """
+    RouterCache remembers the routing decisions of past queries so repeated queries skip the routing models.
+    Identical queries (after normalization) hit an LRU cache, near-duplicates are found by cosine similarity
+    of their embeddings and reuse a prior decision if it was taken with enough confidence.
+    """
+    def __init__(self, embedder: Callable[[List[str]], np.ndarray] | None = None,
+                 max_size: int = 1024,
+                 similarity_threshold: float = 0.95,
+                 min_confidence: float = 0.7):
+        """
+        Args:
+            embedder (Callable): Function embedding a list of texts, None to only cache identical queries.
+            max_size (int): Number of decisions kept in cache.
+            similarity_threshold (float): Minimum cosine similarity for a near-duplicate to reuse a decision.
+            min_confidence (float): Minimum confidence of a decision for near-duplicates to reuse it.
+        """
+        self.embedder = embedder
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self.min_confidence = min_confidence
+        self.entries = OrderedDict()
+        self.matrix = None
+        self.matrix_keys = []
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.logger = Logger("router.log")
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Key of identical queries: lowercase, unicode normalized text without surrounding punctuation and repeated spaces."""
+        text = unicodedata.normalize("NFKC", text).lower()
+        text = re.sub(r"\s+", " ", text)
+        return text.strip(" \t\n.!?,;:。！？，")
+
+    def embed(self, text: str) -> np.ndarray | None:
+        if self.embedder is None:
+            return None
+        try:
+            vector = np.asarray(self.embedder([text]), dtype=np.float32)[0]
+        except Exception as e:
+            self.logger.warning(f"Router cache embedding failed: {str(e)}")
+            return None
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, text: str, embedding_text: str | None = None) -> Tuple[str | None, np.ndarray | None]:
+        """
+        Find the cached decision for a query, identical first then near-duplicate.
+        Args:
+            text (str): The user query.
+            embedding_text (str): The text embedded to find near-duplicates, default to the query.
+        Returns:
+            Tuple[str | None, np.ndarray | None]: The decision, None on miss,
+            and the embedding of the query computed on miss, to be given back to put.
+        """
+        decision = self.get_exact(text)
+        if decision is not None:
+            return decision, None
+        return self.get_similar(text, embedding_text)
+
+    def get_exact(self, text: str) -> str | None:
+        """Decision cached for the same query after normalization, without embedding it."""
+        key = self.normalize(text)
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["decision"]
+
+    def get_similar(self, text: str, embedding_text: str | None = None) -> Tuple[str | None, np.ndarray | None]:
+        """
+        Decision of the closest cached query if it is similar enough and was taken with enough confidence.
+        Args:
+            text (str): The user query.
+            embedding_text (str): The text embedded, default to the query. The router gives the text its classifiers
+                                  embed, so the embedding is computed once for the cache and the classifiers.
+        Returns:
+            Tuple[str | None, np.ndarray | None]: The decision, None on miss, and the embedding of the query.
+        """
+        key = self.normalize(text)
+        vector = self.embed(embedding_text if embedding_text is not None else text)
+        if vector is None:
+            with self.lock:
+                self.misses += 1
+            return None, None
+        with self.lock:
+            if self.matrix is None:
+                self.matrix_keys = [k for k, e in self.entries.items()
+                                    if e["embedding"] is not None and e["confidence"] >= self.min_confidence]
+                self.matrix = np.stack([self.entries[k]["embedding"] for k in self.matrix_keys]) if self.matrix_keys else None
+            if self.matrix is not None:
+                scores = self.matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    entry = self.entries[self.matrix_keys[best]]
+                    self.entries.move_to_end(self.matrix_keys[best])
+                    # the near-duplicate is cached as is, so repeating it hits the LRU without embedding
+                    self.entries[key] = {"decision": entry["decision"], "confidence": entry["confidence"], "embedding": None}
+                    if len(self.entries) > self.max_size:
+                        self.entries.popitem(last=False)
+                        self.matrix = None
+                    self.similar_hits += 1
+                    return entry["decision"], vector
+            self.misses += 1
+        return None, vector
+
+    def put(self, text: str, decision: str, confidence: float, embedding: np.ndarray | None = None) -> None:
+        """
+        Cache the decision taken for a query.
+        Args:
+            text (str): The user query.
+            decision (str): The routing decision.
+            confidence (float): Confidence of the decision, between 0 and 1.
+            embedding (np.ndarray): Embedding of the query returned by get, computed from the query if missing.
+        """
+        key = self.normalize(text)
+        if embedding is None and self.embedder is not None:
+            embedding = self.embed(text)
+        with self.lock:
+            self.entries[key] = {"decision": decision, "confidence": confidence, "embedding": embedding}
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self.matrix = None
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.matrix = None
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "similar_hits": self.similar_hits, "misses": self.misses}
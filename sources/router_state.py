@@ -0,0 +1,156 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+from collections import defaultdict
+from typing import Any, List, Tuple
+
+import torch
+from safetensors.torch import save_file, load_file
+
+from sources.logger import Logger
+
+# bump when the way examples are learned or saved changes, to rebuild every saved state
+STATE_FORMAT = 2
+
+class RouterState:
+    """
+    RouterState saves the classifiers of the router once they learned their few-shot examples
+    (example embeddings, prototypes and adaptive head), so a startup reads a file instead of embedding every example again.
+    A state is a folder with the label maps and example texts in JSON and the tensors in safetensors,
+    loading it never runs code from the file.
+    A state is versioned by a hash of its examples, of the llm router weights and of the routing backend,
+    it is rebuilt when one of them changes.
+    """
+    def __init__(self, folder: str, weights_path: str):
+        """
+        Args:
+            folder (str): Folder where the states are saved, next to the llm router weights.
+            weights_path (str): Path of the llm router weights the examples are embedded with.
+        """
+        self.folder = folder
+        self.weights_path = weights_path
+        self.logger = Logger("router.log")
+
+    def version(self, few_shots: List[Tuple[str, str]], *extra: str) -> str:
+        """
+        Hash of the examples, independent of their order, and of everything their learned state depends on.
+        Args:
+            few_shots (List[Tuple[str, str]]): The examples and their labels.
+            extra (str): Other dependencies of the state, eg: the router backend and device.
+        """
+        try:
+            import adaptive_classifier
+            library_version = getattr(adaptive_classifier, "__version__", "unknown")
+        except ImportError:
+            library_version = "unknown"
+        weights = os.stat(self.weights_path) if os.path.exists(self.weights_path) else None
+        key = {
+            "format": STATE_FORMAT,
+            "examples": sorted([text, label] for text, label in few_shots),
+            "weights": [weights.st_size, weights.st_mtime_ns] if weights else None,
+            "library": library_version,
+            "extra": list(extra)
+        }
+        return hashlib.sha256(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+    def path(self, name: str, version: str) -> str:
+        return os.path.join(self.folder, f"{name}-{version}")
+
+    def load(self, name: str, version: str, classifier: Any) -> Any | None:
+        """
+        Restore a saved state into a classifier forked from the shared encoder, None if there is no state for this version.
+        The classifier may be partly changed when the state can't be read, give a copy to keep the original.
+        """
+        path = self.path(name, version)
+        if not os.path.exists(os.path.join(path, "state.json")):
+            return None
+        try:
+            with open(os.path.join(path, "state.json"), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            tensors = load_file(os.path.join(path, "tensors.safetensors"))
+            self.restore(classifier, state, tensors)
+        except Exception as e:
+            self.logger.warning(f"Could not load router state {path}, rebuilding it: {str(e)}")
+            return None
+        self.logger.info(f"Loaded router state {path}.")
+        return classifier
+
+    @staticmethod
+    def restore(classifier: Any, state: dict, tensors: dict) -> None:
+        """Set the learned state of a classifier from the content of a state folder."""
+        from adaptive_classifier import Example
+        examples = defaultdict(list)
+        for label, texts in state["examples"].items():
+            embeddings = tensors[f"examples.{label}"]
+            examples[label] = [Example(text=text, label=label, embedding=embedding.clone())
+                               for text, embedding in zip(texts, embeddings)]
+        prototypes = {label: tensors[f"prototype.{label}"] for label in state["prototypes"]}
+        head = {key[len("adaptive_head."):]: value for key, value in tensors.items() if key.startswith("adaptive_head.")}
+        classifier.label_to_id = state["label_to_id"]
+        classifier.id_to_label = {int(i): label for i, label in state["id_to_label"].items()}
+        classifier.train_steps = state["train_steps"]
+        if "training_history" in state:
+            classifier.training_history = state["training_history"]
+        classifier.memory.examples = examples
+        classifier.memory.prototypes = prototypes
+        classifier.memory._restore_from_save()
+        classifier.adaptive_head = None
+        if head:
+            classifier._initialize_adaptive_head()
+            classifier.adaptive_head.load_state_dict(head)
+
+    @staticmethod
+    def snapshot(classifier: Any) -> Tuple[dict, dict]:
+        """The learned state of a classifier: JSON serializable fields and tensors."""
+        state = {
+            "label_to_id": classifier.label_to_id,
+            "id_to_label": {str(i): label for i, label in classifier.id_to_label.items()},
+            "train_steps": classifier.train_steps,
+            "examples": {},
+            "prototypes": list(classifier.memory.prototypes.keys())
+        }
+        if hasattr(classifier, "training_history"):
+            state["training_history"] = classifier.training_history
+        tensors = {}
+        for label, examples in classifier.memory.examples.items():
+            if not examples:
+                continue
+            state["examples"][label] = [example.text for example in examples]
+            tensors[f"examples.{label}"] = torch.stack([example.embedding.detach().cpu() for example in examples]).contiguous()
+        for label, prototype in classifier.memory.prototypes.items():
+            tensors[f"prototype.{label}"] = prototype.detach().cpu().contiguous()
+        if classifier.adaptive_head is not None:
+            for key, value in classifier.adaptive_head.state_dict().items():
+                tensors[f"adaptive_head.{key}"] = value.detach().cpu().contiguous()
+        return state, tensors
+
+    def save(self, name: str, version: str, classifier: Any) -> None:
+        """
+        Save the learned state of a classifier without its encoder, and remove the states of older versions.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(name, version)
+        tmp_path = path + ".tmp"
+        try:
+            state, tensors = self.snapshot(classifier)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            save_file(tensors, os.path.join(tmp_path, "tensors.safetensors"))
+            with open(os.path.join(tmp_path, "state.json"), 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self.logger.warning(f"Could not save router state {path}: {str(e)}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        for old_path in glob.glob(os.path.join(self.folder, f"{name}-*")):
+            if old_path == path:
+                continue
+            if os.path.isdir(old_path):
+                shutil.rmtree(old_path, ignore_errors=True)
+            else:
+                os.remove(old_path) # states saved before the safetensors format
+        self.logger.info(f"Saved router state {path}.")
@@ -0,0 +1,245 @@
+import os
+import json
+import queue
+import hashlib
+import threading
+import importlib.util
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from sources.logger import Logger
+from sources.model_registry import registry
+
+class SemanticMemory:
+    """
+    SemanticMemory is a vector index over past messages, to recall old but relevant context
+    without sending the whole conversation to the LLM.
+    Messages are embedded in a background thread with a local sentence embedding model,
+    stored append-only on disk, and searched by cosine similarity (FAISS if installed, NumPy otherwise).
+    The index is shared by all agents, each message is tagged with the agent it belongs to so a search can be
+    limited to the past conversations of one agent.
+    """
+    def __init__(self, folder: str = "conversations/",
+                 model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 embedder: Callable[[List[str]], np.ndarray] | None = None,
+                 min_length: int = 32,
+                 batch_size: int = 16):
+        """
+        Args:
+            folder (str): Folder where the index is persisted.
+            model_name (str): The huggingface sentence embedding model, loaded on first use.
+            embedder (Callable): Function embedding a list of texts, replaces the model when given.
+            min_length (int): Messages shorter than this are not indexed.
+            batch_size (int): Maximum number of messages embedded together.
+        """
+        self.folder = folder
+        self.model_name = model_name
+        self.embedder = embedder
+        self.min_length = min_length
+        self.batch_size = batch_size
+        self.model = None
+        self.tokenizer = None
+        self.model_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.entries = []
+        self.hashes = set()
+        self.embeddings = None
+        self.faiss_index = None
+        self.requests = queue.Queue()
+        self.thread = None
+        self.logger = Logger("memory.log")
+        self.embeddings_path = os.path.join(folder, "semantic_index.f32")
+        self.entries_path = os.path.join(folder, "semantic_index.jsonl")
+        self.info_path = os.path.join(folder, "semantic_index.json")
+        self.load()
+
+    @staticmethod
+    def content_hash(text: str, agent_type: str | None = None) -> str:
+        return hashlib.sha256(f"{agent_type or ''}\n{text}".encode("utf-8")).hexdigest()
+
+    def load(self) -> None:
+        """Load the persisted index, ignoring a partially written last entry."""
+        if not os.path.exists(self.info_path) or not os.path.exists(self.entries_path):
+            return
+        with open(self.info_path, 'r') as f:
+            info = json.load(f)
+        if info["model"] != self.model_name:
+            self.logger.warning(f"Semantic memory was indexed with {info['model']}, ignoring it.")
+            return
+        with open(self.entries_path, 'r', encoding='utf-8') as f:
+            entries = []
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        raw = np.fromfile(self.embeddings_path, dtype=np.float32)
+        embeddings = raw[:raw.size - raw.size % info["dim"]].reshape(-1, info["dim"])
+        count = min(len(entries), len(embeddings))
+        if count == 0:
+            return
+        if count != len(entries) or count != len(embeddings):
+            # a crash left one file ahead of the other, truncate both so appended rows stay aligned
+            embeddings[:count].astype(np.float32).tofile(self.embeddings_path)
+            with open(self.entries_path, 'w', encoding='utf-8') as f:
+                for entry in entries[:count]:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.entries = entries[:count]
+        self.hashes = {self.content_hash(entry["content"], entry.get("agent_type")) for entry in self.entries}
+        self.set_embeddings(embeddings[:count])
+        self.logger.info(f"Loaded semantic memory with {count} messages.")
+
+    def set_embeddings(self, embeddings: np.ndarray) -> None:
+        self.embeddings = embeddings
+        if importlib.util.find_spec("faiss") is None:
+            return
+        import faiss
+        self.faiss_index = faiss.IndexFlatIP(embeddings.shape[1])
+        self.faiss_index.add(embeddings)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Normalized embeddings of texts, one row per text."""
+        if self.embedder is not None:
+            vectors = np.asarray(self.embedder(texts), dtype=np.float32)
+        else:
+            vectors = self.embed_with_model(texts)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def load_model(self) -> None:
+        """Load the sentence embedding model now instead of on first use, eg: at startup."""
+        if self.embedder is not None:
+            return
+        with self.model_lock:
+            if self.model is None:
+                self.tokenizer, self.model = registry.get(self.model_name, self.model_loader, pinned=True)
+
+    def embed_with_model(self, texts: List[str]) -> np.ndarray:
+        """Mean pooled embeddings of the sentence embedding model, loaded on first use."""
+        import torch
+        self.load_model()
+        with self.model_lock:
+            inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=256, return_tensors="pt")
+            with torch.no_grad():
+                output = self.model(**inputs).last_hidden_state
+            mask = inputs['attention_mask'].unsqueeze(-1).float()
+            pooled = (output * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        return pooled.numpy().astype(np.float32)
+
+    def model_loader(self):
+        from transformers import AutoTokenizer, AutoModel
+        model = AutoModel.from_pretrained(self.model_name)
+        model.eval()
+        return AutoTokenizer.from_pretrained(self.model_name), model
+
+    def add(self, content: str, role: str, session_id: str | None = None, agent_type: str | None = None) -> None:
+        """Index a message in the background. Short and already indexed messages are skipped."""
+        if len(content) < self.min_length:
+            return
+        with self.lock:
+            key = self.content_hash(content, agent_type)
+            if key in self.hashes:
+                return
+            self.hashes.add(key)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.requests.put({"role": role, "content": content, "session_id": session_id, "agent_type": agent_type})
+
+    def run(self) -> None:
+        """Background loop embedding the waiting messages by batch."""
+        while True:
+            entries = [self.requests.get()]
+            while len(entries) < self.batch_size:
+                try:
+                    entries.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.append(entries, self.embed([entry["content"] for entry in entries]))
+            except Exception as e:
+                self.logger.error(f"Semantic memory indexing failed: {str(e)}")
+                with self.lock:
+                    for entry in entries:
+                        self.hashes.discard(self.content_hash(entry["content"], entry["agent_type"]))
+            finally:
+                for _ in entries:
+                    self.requests.task_done()
+
+    def append(self, entries: List[dict], embeddings: np.ndarray) -> None:
+        """Add embedded messages to the index and to the files on disk."""
+        os.makedirs(self.folder, exist_ok=True)
+        with self.lock:
+            if self.embeddings is None:
+                with open(self.info_path, 'w') as f:
+                    json.dump({"model": self.model_name, "dim": int(embeddings.shape[1])}, f)
+                for path in [self.embeddings_path, self.entries_path]:
+                    if os.path.exists(path):
+                        os.remove(path)
+            with open(self.embeddings_path, 'ab') as f:
+                embeddings.astype(np.float32).tofile(f)
+            with open(self.entries_path, 'a', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.entries.extend(entries)
+            if self.embeddings is None:
+                self.set_embeddings(embeddings)
+            else:
+                self.embeddings = np.vstack([self.embeddings, embeddings])
+                if self.faiss_index is not None:
+                    self.faiss_index.add(embeddings)
+
+    def wait(self) -> None:
+        """Block until every added message is indexed."""
+        self.requests.join()
+
+    def search(self, query: str, k: int = 3, min_score: float = 0.35, exclude: set | None = None,
+               agent_type: str | None = None) -> List[Tuple[float, dict]]:
+        """
+        The k indexed messages most similar to the query.
+        Args:
+            query (str): The text to find related messages for.
+            k (int): Maximum number of messages returned.
+            min_score (float): Minimum cosine similarity of a returned message.
+            exclude (set): Contents to skip, eg: messages already in the prompt.
+            agent_type (str): Only return the messages of this agent, None for the messages of all agents.
+        Returns:
+            List[Tuple[float, dict]]: The similarity and entry of the messages, most similar first.
+        """
+        with self.lock:
+            if self.embeddings is None or len(self.entries) == 0:
+                return []
+            count = len(self.entries)
+        exclude = exclude or set()
+        vector = self.embed([query])
+        # messages of other agents are skipped after ranking, so every message is ranked when filtering
+        candidates = count if agent_type is not None else min(count, k + len(exclude))
+        with self.lock:
+            if self.faiss_index is not None:
+                scores, indexes = self.faiss_index.search(vector, candidates)
+                ranked = list(zip(scores[0], indexes[0]))
+            else:
+                scores = self.embeddings[:count] @ vector[0]
+                top = np.argpartition(-scores, candidates - 1)[:candidates]
+                ranked = sorted(((scores[i], i) for i in top), reverse=True)
+            results = []
+            for score, i in ranked:
+                if i < 0 or score < min_score or self.entries[i]["content"] in exclude:
+                    continue
+                if agent_type is not None and self.entries[i].get("agent_type") != agent_type:
+                    continue
+                results.append((float(score), self.entries[i]))
+                if len(results) == k:
+                    break
+        return results
+
+shared_semantic_memory = {}
+shared_semantic_memory_lock = threading.Lock()
+
+def get_semantic_memory(folder: str = "conversations/") -> SemanticMemory:
+    """The semantic memory of a folder shared by all agents, so its index and model are loaded once."""
+    with shared_semantic_memory_lock:
+        if folder not in shared_semantic_memory:
+            shared_semantic_memory[folder] = SemanticMemory(folder)
+        return shared_semantic_memory[folder]
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import threading
+
+class SessionIndex:
+    """
+    SQLite index of the saved sessions, keyed by agent type, session id and start time.
+    Finding the last session of an agent is an indexed lookup instead of a listing of the conversations folder.
+    """
+    def __init__(self, folder: str = "conversations/", index_file: str = "sessions.db"):
+        """
+        Args:
+            folder (str): The conversations folder, paths in the index are relative to it.
+            index_file (str): Name of the index database in the folder.
+        """
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(folder, index_file), check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                agent_type TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                path TEXT NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_agent_time ON sessions (agent_type, started_at)")
+        self.db.commit()
+
+    def register(self, agent_type: str, session_id: str, started_at: str, path: str) -> None:
+        """
+        Add a session to the index.
+        Args:
+            agent_type (str): Type of the agent owning the session.
+            session_id (str): Unique id of the session.
+            started_at (str): Start time, sortable (eg: 2025-01-31_12-00-00).
+            path (str): Path of the session file.
+        """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO sessions (session_id, agent_type, started_at, path) VALUES (?, ?, ?, ?)",
+                            (session_id, agent_type, started_at, os.path.relpath(path, self.folder)))
+            self.db.commit()
+
+    def last_session(self, agent_type: str) -> str | None:
+        """Path of the last session of an agent that still exists, None if there is none."""
+        with self.lock:
+            while True:
+                row = self.db.execute("SELECT session_id, path FROM sessions WHERE agent_type = ? ORDER BY started_at DESC LIMIT 1",
+                                      (agent_type,)).fetchone()
+                if row is None:
+                    return None
+                session_id, path = row
+                path = os.path.join(self.folder, path)
+                if os.path.exists(path):
+                    return path
+                self.db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self.db.commit()
+
+    def is_empty(self, agent_type: str) -> bool:
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM sessions WHERE agent_type = ? LIMIT 1", (agent_type,)).fetchone() is None
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,167 @@
+import os
+import json
+import threading
+
+from sources.logger import Logger
+
+class SessionLog:
+    """
+    Append-only JSONL log of the changes made to a conversation.
+    Each change is one line, so saving costs O(new messages) and a crash loses at most the line being written.
+    The log is compacted into a single snapshot of the whole conversation once it holds too many records
+    for the conversation size, so replaying it costs O(conversation size), not O(changes ever made).
+    A snapshot is written one message per line, so the most recent messages can be read backward from the end
+    of the log without parsing the rest of the conversation.
+    Records:
+        {"op": "reset", "size": n}: the conversation is replaced by the n messages on the next lines.
+        {"op": "message", "index": i, "message": {...}}: message i of a snapshot.
+        {"op": "push", "index": i, "message": {...}}: message i is appended.
+        {"op": "replace", "index": i, "content": "..."}: the content of message i changed (eg: compression).
+    Logs written before per message snapshots hold {"op": "reset", "messages": [...]} and pushes without index,
+    they can only be replayed whole.
+    """
+    def __init__(self, path: str, compact_min_records: int = 64, compact_ratio: float = 2.0):
+        """
+        Args:
+            path (str): Path of the JSONL file.
+            compact_min_records (int): Records below which the log is never compacted.
+            compact_ratio (float): The log is compacted when it has this many records per message of the conversation.
+        """
+        self.path = path
+        self.compact_min_records = compact_min_records
+        self.compact_ratio = compact_ratio
+        self.records = 0
+        self.lock = threading.Lock()
+        self.logger = Logger("memory.log")
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def append(self, *records: dict) -> None:
+        with self.lock:
+            self.file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            self.file.flush()
+            self.records += len(records)
+
+    @staticmethod
+    def snapshot(memory: list) -> list:
+        """Records replacing the conversation by memory."""
+        return [{"op": "reset", "size": len(memory)}] + [{"op": "message", "index": i, "message": message}
+                                                         for i, message in enumerate(memory)]
+
+    def push(self, message: dict, memory: list) -> None:
+        """Log a message appended to the conversation, compacting the log if needed."""
+        self.append({"op": "push", "index": len(memory) - 1, "message": message})
+        if self.records > self.compact_min_records and self.records > self.compact_ratio * len(memory):
+            self.compact(memory)
+
+    def replace(self, index: int, content: str) -> None:
+        self.append({"op": "replace", "index": index, "content": content})
+
+    def reset(self, memory: list) -> None:
+        self.append(*self.snapshot(memory))
+
+    def compact(self, memory: list) -> None:
+        """Rewrite the log as a single snapshot of the conversation."""
+        tmp_path = self.path + ".tmp"
+        with self.lock:
+            records = self.snapshot(memory)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            self.file.close()
+            os.replace(tmp_path, self.path)
+            self.file = open(self.path, 'a', encoding='utf-8')
+            self.logger.info(f"Compacted session log {self.path} from {self.records} records.")
+            self.records = len(records)
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+    @staticmethod
+    def read_backward(path: str, block_size: int = 65536):
+        """Yield the lines of a log from the last to the first, reading the file one block at a time from its end."""
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            rest = b""
+            while position > 0:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                lines = (f.read(step) + rest).split(b"\n")
+                rest = lines.pop(0) # may be the end of a line starting in the previous block
+                for line in reversed(lines):
+                    if line:
+                        yield line.decode('utf-8', errors='replace')
+            if rest:
+                yield rest.decode('utf-8', errors='replace')
+
+    @staticmethod
+    def read_tail(path: str):
+        """
+        Yield the messages of the conversation from the last to the first as (index, message),
+        with their latest content, by reading the log backward until its last snapshot.
+        Stopping the iteration stops the reading, the older lines are never read nor parsed.
+        Raises ValueError for logs written before per message snapshots, use replay for them.
+        """
+        replaced = {}
+        seen = set()
+        for line in SessionLog.read_backward(path):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # line truncated by a crash while writing
+            if record["op"] == "replace":
+                replaced.setdefault(record["index"], record["content"])
+            elif record["op"] in ("push", "message") and "index" in record:
+                index, message = record["index"], record["message"]
+                if index in seen:
+                    continue
+                seen.add(index)
+                if index in replaced:
+                    message["content"] = replaced[index]
+                yield index, message
+            elif record["op"] == "reset" and "size" in record:
+                return
+            else:
+                raise ValueError(f"{path} was written before per message snapshots.")
+
+    @staticmethod
+    def read_from_last_reset(path: str, block_size: int = 65536) -> list:
+        """
+        Lines of a log starting at its last reset record, read backward from the end of the file
+        so the changes before the last snapshot are never read.
+        """
+        marker = b'{"op": "reset"'
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b""
+            while position > 0:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+                start = data.rfind(b"\n" + marker)
+                if start != -1:
+                    return data[start + 1:].decode('utf-8', errors='replace').splitlines()
+            return data.decode('utf-8', errors='replace').splitlines()
+
+    @staticmethod
+    def replay(path: str) -> list:
+        """
+        Rebuild the conversation from a log, starting from its last snapshot.
+        A truncated last line, left by a crash while writing, is ignored.
+        """
+        memory = []
+        for line in SessionLog.read_from_last_reset(path):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record["op"] == "reset":
+                memory = record.get("messages", [])
+            elif record["op"] in ("push", "message"):
+                memory.append(record["message"])
+            elif record["op"] == "replace" and record["index"] < len(memory):
+                memory[record["index"]]["content"] = record["content"]
+        return memory
@@ -5,6 +5,8 @@ import threading
 import numpy as np
 import time
 
+from sources.model_registry import registry
+
 IMPORT_FOUND = True
 
 try:
@@ -92,14 +94,17 @@ class Transcript:
         device = self.get_device()
         torch_dtype = torch.float16 if device == "cuda" else torch.float32
         model_id = "distil-whisper/distil-medium.en"
-        
+        self.pipe = registry.get(model_id, lambda: self.load_pipeline(model_id, device, torch_dtype), pinned=True)
+
+    def load_pipeline(self, model_id: str, device: str, torch_dtype):
+        """Load the speech recognition pipeline."""
         model = AutoModelForSpeechSeq2Seq.from_pretrained(
             model_id, torch_dtype=torch_dtype, use_safetensors=True
         )
         model.to(device)
         processor = AutoProcessor.from_pretrained(model_id)
         
-        self.pipe = pipeline(
+        return pipeline(
             "automatic-speech-recognition",
             model=model,
             tokenizer=processor.tokenizer,
@@ -0,0 +1,71 @@
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from sources.logger import Logger
+
+class StartupTracker:
+    """
+    StartupTracker loads independent components concurrently at startup and records their readiness.
+    Model loading and browser launch mostly wait on disk, network or native code outside the GIL,
+    so running them in threads brings the startup time close to the slowest single component.
+    """
+    def __init__(self, max_workers: int = 4):
+        """
+        Args:
+            max_workers (int): Maximum number of components loaded at the same time.
+        """
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="startup")
+        self.components: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.logger = Logger("startup.log")
+        self.started_at = time.time()
+
+    def set_state(self, name: str, **state) -> None:
+        with self.lock:
+            self.components.setdefault(name, {}).update(state)
+
+    def track(self, name: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn in the calling thread, recording the state of the component while it loads."""
+        start = time.time()
+        self.set_state(name, status="loading")
+        try:
+            value = fn(*args, **kwargs)
+        except Exception as e:
+            self.set_state(name, status="failed", error=str(e), load_time=round(time.time() - start, 2))
+            self.logger.error(f"Startup of {name} failed: {str(e)}")
+            raise e
+        self.set_state(name, status="ready", load_time=round(time.time() - start, 2))
+        self.logger.info(f"{name} ready in {time.time() - start:.1f}s.")
+        return value
+
+    def submit(self, name: str, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Load a component in the thread pool, returns the future of its value."""
+        self.set_state(name, status="pending")
+        return self.pool.submit(self.track, name, fn, *args, **kwargs)
+
+    def state(self) -> str:
+        """starting while a component is loading, failed if one failed, ready otherwise."""
+        with self.lock:
+            statuses = [component["status"] for component in self.components.values()]
+        if "failed" in statuses:
+            return "failed"
+        if not statuses or any(status != "ready" for status in statuses):
+            return "starting"
+        return "ready"
+
+    def is_ready(self) -> bool:
+        return self.state() == "ready"
+
+    def status(self) -> dict:
+        state = self.state()
+        with self.lock:
+            return {
+                "state": state,
+                "elapsed": round(time.time() - self.started_at, 2),
+                "components": {name: dict(component) for name, component in self.components.items()}
+            }
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False)
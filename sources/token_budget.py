@@ -0,0 +1,212 @@
+import threading
+import importlib.util
+from collections import OrderedDict
+from typing import Any
+
+from sources.logger import Logger
+
+# context window in tokens of the model families, matched on the longest prefix of the model name
+CONTEXT_WINDOWS = {
+    "gpt-4.1": 1047576,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+    "claude": 200000,
+    "gemini": 1048576,
+    "deepseek-chat": 65536,
+    "deepseek-reasoner": 65536,
+    "deepseek-r1": 131072,
+    "deepseek-v3": 131072,
+    "deepseek-coder": 16384,
+    "qwen3": 40960,
+    "qwen2.5": 32768,
+    "qwq": 40960,
+    "llama3.1": 131072,
+    "llama3.2": 131072,
+    "llama3.3": 131072,
+    "llama3": 8192,
+    "llama2": 4096,
+    "mistral": 32768,
+    "mixtral": 32768,
+    "gemma3": 131072,
+    "gemma2": 8192,
+    "phi4": 16384,
+    "phi3": 131072,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# huggingface tokenizer of the model families served by ollama or llama.cpp, matched on the longest prefix of the model name
+TOKENIZERS = {
+    "qwen3": "Qwen/Qwen3-8B",
+    "qwen2.5": "Qwen/Qwen2.5-7B-Instruct",
+    "qwq": "Qwen/QwQ-32B",
+    "deepseek-r1": "deepseek-ai/DeepSeek-R1-Distill-Qwen-14B",
+    "deepseek-v3": "deepseek-ai/DeepSeek-V3",
+    "deepseek-chat": "deepseek-ai/DeepSeek-V3",
+    "deepseek-reasoner": "deepseek-ai/DeepSeek-V3",
+    "deepseek-coder": "deepseek-ai/deepseek-coder-6.7b-instruct",
+    "llama3": "NousResearch/Meta-Llama-3-8B-Instruct",
+    "phi4": "microsoft/phi-4",
+    "phi3": "microsoft/Phi-3-mini-128k-instruct",
+}
+
+def match_model(model_name: str | None, table: dict):
+    """
+    Value of the longest prefix of the model name in a per model table, None for unknown models.
+    Organization prefixes (eg: deepseek/deepseek-r1, meta-llama/...) and tags (eg: :14b) are ignored.
+    """
+    if not model_name:
+        return None
+    name = model_name.lower().split("/")[-1].replace("llama-3.", "llama3.").replace("llama-3", "llama3")
+    matches = [prefix for prefix in table if name.startswith(prefix)]
+    if not matches:
+        return None
+    return table[max(matches, key=len)]
+
+def get_context_window(model_name: str | None) -> int:
+    """Context window of a model from the per model table, DEFAULT_CONTEXT_WINDOW for unknown models."""
+    return match_model(model_name, CONTEXT_WINDOWS) or DEFAULT_CONTEXT_WINDOW
+
+class Tokenizer:
+    """
+    Encode and decode text with the huggingface tokenizer of the model or a tiktoken encoding.
+    """
+    def __init__(self, name: str, encoder: Any, is_tiktoken: bool):
+        self.name = name
+        self.encoder = encoder
+        self.is_tiktoken = is_tiktoken
+
+    def encode(self, text: str) -> list:
+        if self.is_tiktoken:
+            return self.encoder.encode(text, disallowed_special=())
+        return self.encoder.encode(text, add_special_tokens=False)
+
+    def decode(self, tokens: list) -> str:
+        return self.encoder.decode(tokens)
+
+def load_hf_tokenizer(repo_id: str, logger: Logger) -> Tokenizer | None:
+    """Load a huggingface tokenizer, None if it can't be loaded (offline, unknown or gated repository)."""
+    try:
+        from transformers import AutoTokenizer
+        return Tokenizer(repo_id, AutoTokenizer.from_pretrained(repo_id), is_tiktoken=False)
+    except Exception as e:
+        logger.warning(f"Could not load the tokenizer {repo_id}: {str(e)}")
+        return None
+
+def load_tiktoken(model_name: str | None, logger: Logger) -> Tokenizer | None:
+    """Load the tiktoken encoding of the model, cl100k_base for unknown models, None if tiktoken is not installed."""
+    if importlib.util.find_spec("tiktoken") is None:
+        return None
+    import tiktoken
+    name = (model_name or "").split("/")[-1]
+    try:
+        return Tokenizer(name, tiktoken.encoding_for_model(name), is_tiktoken=True)
+    except KeyError:
+        return Tokenizer("cl100k_base", tiktoken.get_encoding("cl100k_base"), is_tiktoken=True)
+
+tokenizers = {}
+tokenizers_lock = threading.Lock()
+
+def get_tokenizer(model_name: str | None) -> Tokenizer | None:
+    """
+    Tokenizer of a model shared by all agents, so it is loaded once per process.
+    The huggingface tokenizer of the model family is preferred, a model name that is a huggingface repository is used as is,
+    then tiktoken, None when neither can be loaded and tokens are estimated from characters.
+    """
+    with tokenizers_lock:
+        if model_name in tokenizers:
+            return tokenizers[model_name]
+        logger = Logger("memory.log")
+        tokenizer = None
+        for repo_id in [match_model(model_name, TOKENIZERS), model_name if model_name and "/" in model_name else None]:
+            if repo_id is not None and tokenizer is None:
+                tokenizer = load_hf_tokenizer(repo_id, logger)
+        if tokenizer is None:
+            tokenizer = load_tiktoken(model_name, logger)
+        if tokenizer is None:
+            logger.warning(f"No tokenizer for {model_name}, token counts are estimated from characters.")
+        else:
+            logger.info(f"Counting the tokens of {model_name} with {tokenizer.name}.")
+        tokenizers[model_name] = tokenizer
+        return tokenizer
+
+class TokenBudget:
+    """
+    TokenBudget counts the tokens of the conversation to keep the prompt under the context window of the model.
+    Token counts use the huggingface tokenizer of the model, then tiktoken, otherwise about 4 characters per token.
+    The tokenizer is loaded on the first count.
+    Counts are cached per message content, so counting the whole memory at each push is cheap.
+    """
+    def __init__(self, model_name: str | None,
+                 context_window: int | None = None,
+                 reserved_output: int = 1024,
+                 tokens_per_message: int = 4,
+                 cache_size: int = 4096):
+        """
+        Args:
+            model_name (str): Name of the model, used to find its context window and tokenizer.
+            context_window (int): Context window in tokens, overrides the per model table.
+            reserved_output (int): Tokens kept free for the answer of the model.
+            tokens_per_message (int): Tokens of the chat template around each message.
+            cache_size (int): Number of message token counts kept in cache.
+        """
+        self.model_name = model_name
+        self.context_window = context_window or get_context_window(model_name)
+        self.reserved_output = min(reserved_output, self.context_window // 4)
+        self.tokens_per_message = tokens_per_message
+        self.cache_size = cache_size
+        self.counts = OrderedDict()
+        self.logger = Logger("memory.log")
+        self.logger.info(f"Context window of {model_name}: {self.context_window} tokens.")
+
+    @property
+    def tokenizer(self) -> Tokenizer | None:
+        return get_tokenizer(self.model_name)
+
+    @property
+    def max_prompt_tokens(self) -> int:
+        return self.context_window - self.reserved_output
+
+    def count(self, text: str) -> int:
+        """Number of tokens of a text."""
+        if not text:
+            return 0
+        cached = self.counts.get(text, None)
+        if cached is not None:
+            self.counts.move_to_end(text)
+            return cached
+        tokenizer = self.tokenizer
+        if tokenizer is not None:
+            tokens = len(tokenizer.encode(text))
+        else:
+            tokens = (len(text) + 3) // 4
+        self.counts[text] = tokens
+        if len(self.counts) > self.cache_size:
+            self.counts.popitem(last=False)
+        return tokens
+
+    def count_messages(self, messages: list) -> int:
+        """Number of tokens of a conversation, including the chat template of each message."""
+        return sum(self.count(str(msg.get('content', ''))) + self.tokens_per_message for msg in messages)
+
+    def remaining(self, messages: list) -> int:
+        """Tokens left for the prompt after the given conversation."""
+        return self.max_prompt_tokens - self.count_messages(messages)
+
+    def fits(self, messages: list) -> bool:
+        """Whether the conversation fits in the context window with room for the answer."""
+        return self.remaining(messages) >= 0
+
+    def trim(self, text: str, max_tokens: int) -> str:
+        """Truncate a text to at most max_tokens tokens."""
+        max_tokens = max(0, max_tokens)
+        if self.count(text) <= max_tokens:
+            return text
+        tokenizer = self.tokenizer
+        if tokenizer is not None:
+            return tokenizer.decode(tokenizer.encode(text)[:max_tokens])
+        return text[:max_tokens * 4]
@@ -0,0 +1,58 @@
+import unittest
+import os
+import sys
+import asyncio
+import shutil
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # Add project root to Python path
+from sources.agents.agent import Agent
+from sources.memory import Memory
+
+class FakeStreamProvider:
+    """Provider streaming a few chunks then hanging like a slow generation."""
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.closed = False
+
+    async def respond_stream_async(self, history, verbose=False):
+        try:
+            yield "<think>planning</think>"
+            yield "Partial "
+            yield "answer"
+            self.started.set()
+            await asyncio.sleep(3600)
+            yield " never sent"
+        finally:
+            self.closed = True
+
+class TestAgentStop(unittest.TestCase):
+    def setUp(self):
+        self.provider = FakeStreamProvider()
+        self.agent = Agent("test", "prompts/base/casual_agent.txt", self.provider)
+        self.agent.memory = Memory("Test system prompt", memory_compression=False)
+        self.agent.memory.push("user", "Hello")
+
+    def tearDown(self):
+        shutil.rmtree("conversations", ignore_errors=True)
+
+    def test_stop_returns_partial_answer(self):
+        """/stop aborts the in-flight stream and the partial answer is kept"""
+        async def run():
+            request = asyncio.ensure_future(self.agent.llm_request())
+            await asyncio.wait_for(self.provider.started.wait(), timeout=5)
+            self.agent.request_stop()
+            return await asyncio.wait_for(request, timeout=5)
+        answer, reasoning = asyncio.run(run())
+        self.assertEqual(answer, "Partial answer")
+        self.assertEqual(reasoning, "<think>planning</think>")
+        self.assertTrue(self.provider.closed)
+        self.assertEqual(self.agent.memory.get()[-1]['content'], "Partial answer")
+        self.assertFalse(self.agent.llm_cancelled)
+
+    def test_cancel_without_request(self):
+        """Stopping an idle agent does nothing"""
+        self.agent.cancel_llm_request()
+        self.assertFalse(self.agent.llm_cancelled)
+
+if __name__ == '__main__':
+    unittest.main()
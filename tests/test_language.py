@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch
+import os, sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # Add project root to Python path
+from sources.language import LanguageUtility
+from sources.model_registry import ModelRegistry
+
+class FakeTokenizer:
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": list(texts)}
+
+    def batch_decode(self, outputs, skip_special_tokens=True):
+        return list(outputs)
+
+class FakeTranslator:
+    """Marian model translating a text to '<lang>:<text>', recording its generate calls."""
+    def __init__(self, lang: str):
+        self.lang = lang
+        self.calls = []
+
+    def generate(self, input_ids, **kwargs):
+        self.calls.append((list(input_ids), kwargs))
+        return [f"{self.lang}:{text}" for text in input_ids]
+
+class TestTranslation(unittest.TestCase):
+    def setUp(self):
+        self.registry = ModelRegistry()
+        self.translators = {lang: FakeTranslator(lang) for lang in ["fr", "zh"]}
+        for lang, translator in self.translators.items():
+            self.registry.register(f"Helsinki-NLP/opus-mt-{lang}-en", lambda t=translator: (FakeTokenizer(), t))
+        patcher = patch("sources.language.registry", self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cache_hit_and_miss(self):
+        """A translated text is not translated again"""
+        language = LanguageUtility(["en", "fr", "zh"])
+        self.assertEqual(language.translate("bonjour", "fr"), "fr:bonjour")
+        self.assertEqual(language.translate("bonjour", "fr"), "fr:bonjour")
+        self.assertEqual(len(self.translators["fr"].calls), 1)
+        self.assertEqual(language.translate("salut", "fr"), "fr:salut")
+        self.assertEqual(len(self.translators["fr"].calls), 2)
+
+    def test_cache_key_includes_language(self):
+        """The same text in another language is translated by the model of that language"""
+        language = LanguageUtility(["en", "fr", "zh"])
+        self.assertEqual(language.translate("chat", "fr"), "fr:chat")
+        self.assertEqual(language.translate("chat", "zh"), "zh:chat")
+        self.assertEqual(len(self.translators["zh"].calls), 1)
+
+    def test_batch_translates_missing_once(self):
+        """A batch translates its uncached texts in one call, duplicates included once"""
+        language = LanguageUtility(["en", "fr", "zh"])
+        language.translate("bonjour", "fr")
+        translations = language.translate_batch(["salut", "bonjour", "salut", "merci"], "fr")
+        self.assertEqual(translations, ["fr:salut", "fr:bonjour", "fr:salut", "fr:merci"])
+        self.assertEqual(self.translators["fr"].calls[-1][0], ["salut", "merci"])
+
+    def test_cache_size(self):
+        """The least recently used translation is evicted beyond cache_size"""
+        language = LanguageUtility(["en", "fr", "zh"], cache_size=2)
+        for text in ["un", "deux", "un", "trois"]:
+            language.translate(text, "fr")
+        self.assertEqual(list(language.cache.keys()), [("fr", "un"), ("fr", "trois")])
+
+    def test_english_and_unsupported_not_translated(self):
+        """English and unsupported languages are returned as is, without loading a model"""
+        language = LanguageUtility(["en", "fr"])
+        self.assertEqual(language.translate("hello", "en"), "hello")
+        self.assertEqual(language.translate("hallo", "de"), "hallo")
+        self.assertEqual(self.translators["fr"].calls, [])
+
+    def test_num_beams(self):
+        """Beams are given to generate when configured, by argument or TRANSLATION_NUM_BEAMS"""
+        LanguageUtility(["en", "fr"], num_beams=1, max_new_tokens=64).translate("bonjour", "fr")
+        self.assertEqual(self.translators["fr"].calls[-1][1], {"max_new_tokens": 64, "num_beams": 1})
+        with patch.dict(os.environ, {"TRANSLATION_NUM_BEAMS": "2"}):
+            LanguageUtility(["en", "fr"]).translate("salut", "fr")
+        self.assertEqual(self.translators["fr"].calls[-1][1]["num_beams"], 2)
+        with patch.dict(os.environ, {}, clear=False):
+            os.environ.pop("TRANSLATION_NUM_BEAMS", None)
+            LanguageUtility(["en", "fr"]).translate("merci", "fr")
+        self.assertNotIn("num_beams", self.translators["fr"].calls[-1][1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+import unittest
+import os, sys
+import types
+import tempfile
+import threading
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # Add project root to Python path
+
+from llm_server.sources.cache import Cache
+from llm_server.sources.generator import GeneratorLLM, GenerationState, HEARTBEAT, ERROR_MARKER
+
+class FakeGenerator(GeneratorLLM):
+    """Generator writing the given chunks once released, or failing with the given error."""
+    def __init__(self, chunks=(), error=None, **kwargs):
+        self.chunks = chunks
+        self.error = error
+        self.release = threading.Event()
+        self.generated = []
+        super().__init__(**kwargs)
+
+    def generate(self, history, state):
+        self.release.wait(5)
+        self.generated.append(history[-1]["content"])
+        for chunk in self.chunks:
+            with state.lock:
+                state.current_buffer += chunk
+                state.updated.notify_all()
+        if self.error is not None:
+            raise Exception(self.error)
+
+def messages(content):
+    return [{"role": "user", "content": content}]
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache = Cache(cache_dir=self.folder.name, max_entries=2)
+
+    def tearDown(self):
+        self.cache.db.close()
+        self.folder.cleanup()
+
+    def test_key_stability(self):
+        """Test that the key depends only on the model, the roles and the contents"""
+        history = [{"role": "user", "content": "hi", "time": "12:00"}]
+        key = Cache.make_key("model", history)
+        self.assertEqual(key, Cache.make_key("model", [{"role": "user", "content": "hi", "time": "13:00"}]))
+        self.assertNotEqual(key, Cache.make_key("other-model", history))
+        self.assertNotEqual(key, Cache.make_key("model", messages("hello")))
+        self.assertNotEqual(key, Cache.make_key("model", [{"role": "system", "content": "hi"}]))
+
+    def test_hit_and_persistence(self):
+        """Test that a response is found again, also by a new connection to the database"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", "answer")
+        self.assertEqual(self.cache.get("a"), "answer")
+        reopened = Cache(cache_dir=self.folder.name, max_entries=2)
+        self.assertEqual(reopened.get("a"), "answer")
+        reopened.db.close()
+
+    def test_lru_eviction(self):
+        """Test that the least recently used response is evicted beyond max_entries"""
+        self.cache.put("a", "1")
+        self.cache.put("b", "2")
+        self.cache.get("a")
+        self.cache.put("c", "3")
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), "1")
+        self.assertEqual(self.cache.get("c"), "3")
+
+    def test_disabled(self):
+        """Test that a cache of size 0 stores nothing"""
+        cache = Cache(cache_dir=self.folder.name, cache_file="disabled.db", max_entries=0)
+        cache.put("a", "1")
+        self.assertIsNone(cache.get("a"))
+        cache.db.close()
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def make_generator(self, **kwargs):
+        generator = FakeGenerator(cache_dir=self.folder.name, **kwargs)
+        self.addCleanup(generator.release.set)
+        return generator
+
+    def wait(self, generator, session_id):
+        return "".join(generator.stream(session_id, heartbeat=0.01)).replace(HEARTBEAT, "")
+
+    def test_arrival_order(self):
+        """Test that queued generations run in arrival order and report their queue position"""
+        generator = self.make_generator(chunks=["ok"], cache_size=0)
+        first = generator.start(messages("first"), model="model")
+        while generator.get_status(first)["is_queued"]:
+            pass
+        second = generator.start(messages("second"), model="model")
+        third = generator.start(messages("third"), model="model")
+        self.assertEqual(generator.get_status(third)["queue_position"], 1)
+        generator.release.set()
+        for session_id in (first, second, third):
+            self.assertEqual(self.wait(generator, session_id), "ok")
+        self.assertEqual(generator.generated, ["first", "second", "third"])
+
+    def test_full_queue_refused(self):
+        """Test that a request is refused once the queue is full"""
+        generator = self.make_generator(queue_size=1, cache_size=0)
+        running = generator.start(messages("running"), model="model")
+        while generator.get_status(running)["is_queued"]:
+            pass
+        self.assertIsNotNone(generator.start(messages("waiting"), model="model"))
+        self.assertIsNone(generator.start(messages("refused"), model="model"))
+
+    def test_cache_hit_skips_queue(self):
+        """Test that a cached response is answered at start, even with a full queue"""
+        generator = self.make_generator(chunks=["cached answer"], queue_size=1)
+        generator.release.set()
+        self.assertEqual(self.wait(generator, generator.start(messages("hi"), model="model")), "cached answer")
+        generator.release.clear()
+        running = generator.start(messages("running"), model="model")
+        while generator.get_status(running)["is_queued"]:
+            pass
+        generator.start(messages("waiting"), model="model")
+        session_id = generator.start(messages("hi"), model="model")
+        self.assertIsNotNone(session_id)
+        status = generator.get_status(session_id)
+        self.assertFalse(status["is_generating"])
+        self.assertEqual(status["sentence"], "cached answer")
+        self.assertEqual(generator.generated, ["hi"])
+
+    def test_failed_generation_not_cached(self):
+        """Test that the text of a failed generation is not cached"""
+        generator = self.make_generator(chunks=["partial"], error="out of memory")
+        generator.release.set()
+        self.wait(generator, generator.start(messages("hi"), model="model"))
+        self.assertEqual(len(generator.cache), 0)
+
+class TestStream(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_heartbeat_while_generating(self):
+        """Test that the stream stays open with heartbeats until the first text"""
+        generator = FakeGenerator(chunks=["Hello", " world"], cache_dir=self.folder.name, cache_size=0)
+        session_id = generator.start(messages("hi"), model="model")
+        stream = generator.stream(session_id, heartbeat=0.01)
+        self.assertEqual(next(stream), HEARTBEAT)
+        generator.release.set()
+        text = "".join(stream).replace(HEARTBEAT, "")
+        self.assertEqual(text, "Hello world")
+
+    def test_error_marker(self):
+        """Test that a failed generation ends the stream with the error marker"""
+        generator = FakeGenerator(chunks=["Hello"], error="out of memory", cache_dir=self.folder.name, cache_size=0)
+        generator.release.set()
+        session_id = generator.start(messages("hi"), model="model")
+        text = "".join(generator.stream(session_id, heartbeat=0.01)).replace(HEARTBEAT, "")
+        self.assertEqual(text, "Hello" + ERROR_MARKER + "out of memory")
+
+class FakeLlama:
+    """Stub of llama_cpp.Llama recording how the slots are created and which prompts they serve."""
+    created = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.prompts = []
+
+    @classmethod
+    def from_pretrained(cls, **kwargs):
+        llm = cls(**kwargs)
+        cls.created.append(llm)
+        return llm
+
+    def create_chat_completion(self, messages, stream=True):
+        self.prompts.append(messages[-1]["content"])
+        for text in ["Hello", " world"]:
+            yield {"choices": [{"delta": {"content": text}}]}
+
+class TestLlamacppSlots(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        FakeLlama.created = []
+        llama_cpp = types.ModuleType("llama_cpp")
+        llama_cpp.Llama = FakeLlama
+        llama_cpp.LlamaRAMCache = object
+        with patch.dict(sys.modules, {"llama_cpp": llama_cpp}):
+            sys.modules.pop("llm_server.sources.llamacpp_handler", None)
+            from llm_server.sources.llamacpp_handler import LlamacppLLM
+        self.handler_class = LlamacppLLM
+
+    def tearDown(self):
+        sys.modules.pop("llm_server.sources.llamacpp_handler", None)
+        self.folder.cleanup()
+
+    def make_handler(self, **kwargs):
+        return self.handler_class(cache_dir=self.folder.name, model="repo/model-GGUF", **kwargs)
+
+    def test_threads_divided_between_slots(self):
+        """Each slot gets its share of the CPU cores unless n_threads is given"""
+        with patch("os.cpu_count", return_value=8):
+            self.make_handler(workers=4)
+        self.assertEqual(len(FakeLlama.created), 4)
+        self.assertTrue(all(llm.kwargs["n_threads"] == 2 for llm in FakeLlama.created))
+        FakeLlama.created = []
+        with patch("os.cpu_count", return_value=2):
+            self.make_handler(workers=4)
+        self.assertTrue(all(llm.kwargs["n_threads"] == 1 for llm in FakeLlama.created))
+        FakeLlama.created = []
+        self.make_handler(workers=2, n_threads=3)
+        self.assertTrue(all(llm.kwargs["n_threads"] == 3 for llm in FakeLlama.created))
+
+    def test_conversation_pinned_to_slot(self):
+        """A conversation goes back to the slot holding its prefix, others take the least recently used slot"""
+        handler = self.make_handler(workers=2)
+        first, second = FakeLlama.created
+        self.assertIs(handler.acquire_slot("agent-a"), first)
+        handler.release_slot(first)
+        self.assertIs(handler.acquire_slot("agent-b"), second)
+        handler.release_slot(second)
+        self.assertIs(handler.acquire_slot("agent-a"), first)
+        handler.release_slot(first)
+
+    def test_generate_releases_slot(self):
+        """A generation streams into the state and frees its slot"""
+        handler = self.make_handler(workers=1)
+        state = GenerationState(model="repo/model-GGUF")
+        handler.generate([{"role": "system", "content": "agent"}, {"role": "user", "content": "hi"}], state)
+        self.assertEqual(state.current_buffer, "Hello world")
+        self.assertEqual(FakeLlama.created[0].prompts, ["hi"])
+        self.assertEqual(len(handler.free_slots), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,12 +3,24 @@ import os
 import sys
 import json
 import datetime
+import zlib
+import asyncio
+import threading
+import numpy as np
+from unittest.mock import patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # Add project root to Python path
 from sources.memory import Memory
+from sources.token_budget import TokenBudget, Tokenizer
+from sources import token_budget
+from sources.memory_compressor import MemoryCompressor
+from sources.session_log import SessionLog
+from sources.semantic_memory import SemanticMemory
+from sources.model_registry import registry
 
 class TestMemory(unittest.TestCase):
     def setUp(self):
+        token_budget.tokenizers.setdefault("deepseek-r1:14b", None) # count characters instead of downloading the tokenizer
         self.system_prompt = "Test system prompt"
         self.memory = Memory(
             system_prompt=self.system_prompt,
@@ -35,7 +47,7 @@ class TestMemory(unittest.TestCase):
     def test_get_filename(self):
         filename = self.memory.get_filename()
         self.assertTrue(filename.startswith("memory_"))
-        self.assertTrue(filename.endswith(".txt"))
+        self.assertTrue(filename.endswith(".jsonl"))
         self.assertIn(self.memory.session_time.strftime('%Y-%m-%d'), filename)
 
     def test_save_memory(self):
@@ -68,6 +80,22 @@ class TestMemory(unittest.TestCase):
         self.assertEqual(len(self.memory.memory), 3) # 3 msg with sys msg
         self.assertEqual(self.memory.memory[0]['role'], "system")
 
+    def test_save_is_incremental(self):
+        self.memory.push("user", "Hello")
+        self.memory.save_memory()
+        self.memory.push("assistant", "Hi")
+        self.memory.push("user", "How are you?")
+        self.memory.save_memory()
+        path = os.path.join(self.memory.conversation_folder, "casual_agent", self.memory.get_filename())
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([record["op"] for record in records], ["reset", "message", "message", "push", "push"])
+        self.assertEqual(SessionLog.replay(path), self.memory.memory)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(list(SessionLog.read_backward(path, block_size=7)), lines[::-1])
+        self.memory.session_log.close()
+
     def test_get(self):
         self.memory.push("user", "Hello")
         memory_content = self.memory.get()
@@ -89,5 +117,213 @@ class TestMemory(unittest.TestCase):
         self.assertEqual(len(new_memory.memory), 3)  # System + messages
         self.assertEqual(new_memory.memory[1]['content'], "Hello")
 
+    def test_context_window(self):
+        self.assertEqual(self.memory.get_ideal_ctx("deepseek-r1:14b"), 131072)
+        self.assertEqual(self.memory.get_ideal_ctx("meta-llama/Llama-3.3-70B-Instruct"), 131072)
+        self.assertEqual(self.memory.get_ideal_ctx("unknown-model"), 4096)
+
+    def test_served_context_window(self):
+        memory = Memory(self.system_prompt, memory_compression=False, model_provider="deepseek-r1:14b", context_window=8192)
+        self.assertEqual(memory.budget.context_window, 8192)
+        memory.push("user", "word " * 40000)
+        page = memory.trim_text_to_max_ctx("page " * 100000)
+        self.assertGreater(len(page), 0)
+        self.assertLessEqual(memory.budget.count(page), 1024)
+
+    def test_token_budget(self):
+        budget = TokenBudget("unknown-model", context_window=2048, reserved_output=512)
+        messages = [{"role": "user", "content": "hello world " * 100}]
+        self.assertEqual(budget.max_prompt_tokens, 1536)
+        self.assertTrue(budget.fits(messages))
+        self.assertFalse(budget.fits(messages * 20))
+        self.assertLessEqual(budget.count(budget.trim("hello world " * 1000, 100)), 100)
+
+    def test_model_tokenizer(self):
+        class FakeTokenizer:
+            def encode(self, text, add_special_tokens=True):
+                return text.split()
+            def decode(self, tokens):
+                return " ".join(tokens)
+        loaded = []
+        def load_hf_tokenizer(repo_id, logger):
+            loaded.append(repo_id)
+            return Tokenizer(repo_id, FakeTokenizer(), is_tiktoken=False)
+        original = token_budget.load_hf_tokenizer
+        token_budget.load_hf_tokenizer = load_hf_tokenizer
+        try:
+            token_budget.tokenizers.pop("qwen2.5:7b", None)
+            budget = TokenBudget("qwen2.5:7b")
+            self.assertEqual(budget.count("one two three"), 3)
+            self.assertEqual(budget.trim("one two three", 2), "one two")
+            self.assertEqual(loaded, ["Qwen/Qwen2.5-7B-Instruct"])
+            TokenBudget("qwen2.5:7b").count("four")
+            self.assertEqual(len(loaded), 1) # loaded once per process
+        finally:
+            token_budget.load_hf_tokenizer = original
+            token_budget.tokenizers.pop("qwen2.5:7b", None)
+
+    def test_background_compression(self):
+        class FakeCompressor(MemoryCompressor):
+            batches = []
+            def summarize_batch(self, texts):
+                self.batches.append(len(texts))
+                return [text[:100] for text in texts]
+        self.memory.compressor = FakeCompressor()
+        self.memory.budget = TokenBudget("unknown-model", context_window=2048, reserved_output=512)
+        self.memory.push("user", "a" * 2000)
+        self.memory.push("assistant", "b" * 2000)
+        self.memory.compress(needed_tokens=1000)
+        self.memory.wait_compression()
+        self.assertEqual(self.memory.memory[1]['content'], "a" * 100)
+        self.assertEqual(self.memory.memory[2]['content'], "b" * 100)
+        self.assertEqual(sum(FakeCompressor.batches), 2)
+        self.assertEqual(self.memory.compressor.get_cached("a" * 2000), "a" * 100)
+
+    def test_compression_failure(self):
+        class FailingCompressor(MemoryCompressor):
+            calls = 0
+            def summarize_batch(self, texts):
+                FailingCompressor.calls += 1
+                if FailingCompressor.calls == 1:
+                    raise RuntimeError("out of memory")
+                return [text[:100] for text in texts]
+        self.memory.compressor = FailingCompressor()
+        self.memory.budget = TokenBudget("unknown-model", context_window=2048, reserved_output=512)
+        self.memory.push("user", "a" * 2000)
+        self.memory.push("assistant", "b" * 2000)
+        self.memory.compress(needed_tokens=1000)
+        self.memory.wait_compression()
+        self.assertEqual(self.memory.memory[1]['content'], "a" * 2000) # kept as is
+        self.assertIsNone(self.memory.compressor.get_cached("a" * 2000)) # not cached, retried later
+        self.memory.compress(needed_tokens=1000)
+        self.memory.wait_compression()
+        self.assertEqual(self.memory.memory[1]['content'], "a" * 100)
+        self.assertEqual(self.memory.memory[2]['content'], "b" * 100)
+
+    def test_shared_compressor(self):
+        first = Memory(self.system_prompt, memory_compression=True)
+        second = Memory(self.system_prompt, memory_compression=True)
+        self.assertIs(first.compressor, second.compressor)
+        self.assertFalse(registry.is_loaded(first.compressor.model_name)) # loaded on first compression only
+
+    def test_recover_last_session_tail(self):
+        old_session = Memory(self.system_prompt, memory_compression=False)
+        old_session.session_time -= datetime.timedelta(days=1)
+        old_session.push("user", "Old session")
+        old_session.save_memory()
+        old_session.session_log.close()
+        self.memory.budget = TokenBudget("unknown-model", context_window=1024, reserved_output=256)
+        for i in range(100):
+            self.memory.push("user", f"Message {i} " * 20)
+        self.memory.push("assistant", "Done")
+        self.memory.save_memory()
+        self.memory.session_log.close()
+
+        new_memory = Memory(self.system_prompt, memory_compression=False)
+        new_memory.budget = self.memory.budget
+        new_memory.load_memory()
+        self.assertEqual(new_memory.memory[0]['role'], 'system')
+        self.assertEqual(new_memory.memory[-2]['content'], "Message 99 " * 20)
+        self.assertLess(len(new_memory.memory), 100)
+        self.assertTrue(new_memory.budget.fits(new_memory.memory))
+
+    def test_recover_reads_tail_only(self):
+        self.memory.budget = TokenBudget("unknown-model", context_window=1024, reserved_output=256)
+        for i in range(1000):
+            self.memory.push("user" if i % 2 == 0 else "assistant", f"Message {i} " * 20)
+        self.memory.save_memory()
+        self.memory.replace_content(self.memory.memory[-1], self.memory.memory[-1]['content'], "Compressed")
+        self.memory.session_log.close()
+
+        new_memory = Memory(self.system_prompt, memory_compression=False)
+        new_memory.budget = self.memory.budget
+        parsed = []
+        original_loads = json.loads
+        def counting_loads(line, *args, **kwargs):
+            parsed.append(line)
+            return original_loads(line, *args, **kwargs)
+        with patch("sources.session_log.json.loads", side_effect=counting_loads):
+            new_memory.load_memory()
+        self.assertLess(len(parsed), 50) # the 1000 messages of the snapshot are not all parsed
+        self.assertEqual(new_memory.memory[-1]['content'], "Compressed")
+        self.assertEqual(new_memory.memory[-2]['content'], "Message 998 " * 20)
+        self.assertTrue(new_memory.budget.fits(new_memory.memory))
+
+    def test_recover_legacy_session_log(self):
+        path = os.path.join("conversations", "casual_agent", "memory_2020-01-01_00-00-00.jsonl")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(json.dumps({"op": "reset", "messages": [{"role": "system", "content": "Old prompt"},
+                                                             {"role": "user", "content": "Hello"}]}) + "\n")
+            f.write(json.dumps({"op": "push", "message": {"role": "assistant", "content": "Hi"}}) + "\n")
+        self.memory.load_memory()
+        self.assertEqual([msg['content'] for msg in self.memory.memory], ["Old prompt", "Hello", "Hi"])
+
+    @staticmethod
+    def bag_of_words(texts):
+        vectors = np.zeros((len(texts), 64), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[i, zlib.crc32(word.encode()) % 64] += 1
+        return vectors
+
+    def test_semantic_memory(self):
+        semantic = SemanticMemory("conversations/", embedder=self.bag_of_words, min_length=8)
+        semantic.add("my favorite color is blue and green", "user")
+        semantic.add("the weather in paris is rainy today", "assistant")
+        semantic.wait()
+        results = semantic.search("what is my favorite color", k=1, min_score=0.1)
+        self.assertEqual(results[0][1]["content"], "my favorite color is blue and green")
+
+        reloaded = SemanticMemory("conversations/", embedder=self.bag_of_words, min_length=8)
+        self.assertEqual(len(reloaded.entries), 2)
+        self.memory.semantic_memory = reloaded
+        self.memory.push("user", "tell me my favorite color")
+        recalled = self.memory.get_with_recall(k=1)
+        self.assertIn("blue and green", recalled[-1]['content'])
+        self.assertEqual(self.memory.memory[-1]['content'], "tell me my favorite color")
+
+    def test_recall_saved_session(self):
+        semantic = SemanticMemory("conversations/", embedder=self.bag_of_words, min_length=8)
+        planner = Memory(self.system_prompt, memory_compression=False, agent_type="planner_agent")
+        planner.semantic_memory = semantic
+        planner.push("user", "plan my favorite color party with blue balloons")
+        planner.save_memory("planner_agent")
+        planner.session_log.close()
+        old_session = Memory(self.system_prompt, memory_compression=False, agent_type="casual_agent")
+        old_session.session_time -= datetime.timedelta(days=1)
+        old_session.push("user", "my favorite color is blue and green")
+        old_session.push("assistant", "Noted, blue and green it is")
+        old_session.save_memory("casual_agent") # saved before semantic memory was enabled
+        old_session.session_log.close()
+        self.assertEqual(len(semantic.entries), 1)
+
+        new_session = Memory(self.system_prompt, memory_compression=False, agent_type="casual_agent")
+        new_session.budget = TokenBudget("unknown-model", context_window=256, reserved_output=64)
+        new_session.semantic_memory = semantic
+        new_session.load_memory("casual_agent")
+        new_session.indexing_thread.join()
+        semantic.wait()
+        new_session.clear()
+        new_session.push("user", "what is my favorite color")
+        recalled = new_session.get_with_recall(k=3)
+        self.assertIn("blue and green", recalled[-1]['content'])
+        self.assertNotIn("balloons", recalled[-1]['content']) # messages of other agents are not recalled
+
+    def test_recall_async_off_event_loop(self):
+        threads = []
+        def embedder(texts):
+            threads.append(threading.get_ident())
+            return self.bag_of_words(texts)
+        semantic = SemanticMemory("conversations/", embedder=embedder, min_length=8)
+        semantic.add("my favorite color is blue and green", "user")
+        semantic.wait()
+        self.memory.semantic_memory = semantic
+        self.memory.push("user", "tell me my favorite color")
+        threads.clear()
+        recalled = asyncio.run(self.memory.get_with_recall_async(k=1))
+        self.assertIn("blue and green", recalled[-1]['content'])
+        self.assertNotIn(threading.get_ident(), threads)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
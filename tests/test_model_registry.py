@@ -0,0 +1,51 @@
+import unittest
+import os, sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # Add project root to Python path
+from sources.model_registry import ModelRegistry
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = ModelRegistry()
+        self.loads = []
+
+    def loader(self, name: str):
+        return lambda: self.loads.append(name) or f"{name} model"
+
+    def test_lazy_loading(self):
+        """A registered model is loaded on first use only, and once"""
+        self.registry.register("pinned", self.loader("pinned"), pinned=True)
+        self.assertFalse(self.registry.is_loaded("pinned"))
+        self.assertEqual(self.registry.get("pinned"), "pinned model")
+        self.assertEqual(self.registry.get("pinned"), "pinned model")
+        self.assertEqual(self.loads, ["pinned"])
+
+    def test_unknown_model(self):
+        """Getting a model that was never registered raises"""
+        with self.assertRaises(KeyError):
+            self.registry.get("unknown")
+
+    def test_unload_idle(self):
+        """Idle models are unloaded unless pinned, and loaded again on next use"""
+        self.registry.get("pinned", self.loader("pinned"), pinned=True)
+        self.registry.get("idle", self.loader("idle"))
+        self.registry.unload_idle(0)
+        self.assertTrue(self.registry.is_loaded("pinned"))
+        self.assertFalse(self.registry.is_loaded("idle"))
+        self.assertIn("idle", self.registry.status())
+        self.assertEqual(self.registry.get("idle"), "idle model")
+        self.assertEqual(self.loads, ["pinned", "idle", "idle"])
+
+    def test_idle_unloader(self):
+        """The background unloader unloads a model once it is idle"""
+        self.registry.get("idle", self.loader("idle"))
+        self.registry.start_idle_unloader(idle_seconds=0.05, interval=0.01)
+        self.addCleanup(self.registry.stop_idle_unloader)
+        deadline = time.time() + 5
+        while self.registry.is_loaded("idle") and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.registry.is_loaded("idle"))
+
+if __name__ == '__main__':
+    unittest.main()
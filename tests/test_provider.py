@@ -2,13 +2,20 @@ import unittest
 from unittest.mock import patch, MagicMock
 import os, sys
 import socket
+import asyncio
+import time
 import subprocess
 from urllib.parse import urlparse
+from email.utils import formatdate
 import platform
+import requests
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # Add project root to Python path
 
-from sources.llm_provider import Provider
+from sources.llm_provider import Provider, SERVER_HEARTBEAT, SERVER_ERROR_MARKER
+from sources.health_monitor import HealthMonitor
+from sources.provider_pool import ProviderPool
+from sources.rate_limiter import RateLimiter, RateLimitExceeded, get_retry_after
 
 class TestIsIpOnline(unittest.TestCase):
     def setUp(self):
@@ -66,5 +73,243 @@ class TestIsIpOnline(unittest.TestCase):
             result = self.checker.is_ip_online(address)
             self.assertTrue(result)
 
+class TestRespondStream(unittest.TestCase):
+    def setUp(self):
+        self.provider = Provider("test", "test-model")
+
+    def test_stream_matches_respond(self):
+        """Test that the streamed deltas join into the full answer"""
+        chunks = list(self.provider.respond_stream([], verbose=False))
+        self.assertGreater(len(chunks), 0)
+        self.assertEqual("".join(chunks), self.provider.respond([], verbose=False))
+
+    def test_async_matches_respond(self):
+        """Test that the async path returns the same answer"""
+        answer = asyncio.run(self.provider.respond_async([], verbose=False))
+        self.assertEqual(answer, self.provider.respond([], verbose=False))
+
+    def test_stream_listener(self):
+        """Test that listeners receive every delta then None"""
+        received = []
+        self.provider.add_stream_listener(received.append)
+        answer = self.provider.respond([], verbose=False)
+        self.provider.remove_stream_listener(received.append)
+        self.assertIsNone(received[-1])
+        self.assertEqual("".join(received[:-1]), answer)
+
+    def test_async_clients_per_event_loop(self):
+        """Async clients are kept per event loop and closed once their loop is closed"""
+        async def get_client():
+            return self.provider.get_async_http_client()
+        first = asyncio.run(get_client())
+        async def get_client_and_wait():
+            client = self.provider.get_async_http_client()
+            await asyncio.gather(*self.provider.closing_tasks)
+            return client
+        second = asyncio.run(get_client_and_wait())
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed)
+        self.assertFalse(second.is_closed)
+        self.assertEqual(len(self.provider.async_clients), 1)
+
+class TestContextWindow(unittest.TestCase):
+    def test_ollama_num_ctx(self):
+        """Test that Ollama serves the configured num_ctx, capped by the model context length"""
+        provider = Provider("ollama", "deepseek-r1:14b", context_window=16384)
+        response = MagicMock()
+        response.json.return_value = {"model_info": {"qwen2.context_length": 131072}}
+        with patch.object(provider.http_client, "post", return_value=response):
+            self.assertEqual(provider.get_context_window(), 16384)
+        provider = Provider("ollama", "small-model")
+        response.json.return_value = {"model_info": {"llama.context_length": 4096}}
+        with patch.object(provider.http_client, "post", return_value=response):
+            self.assertEqual(provider.get_context_window(), 4096)
+
+    def test_ollama_offline(self):
+        """Test that an unreachable Ollama server falls back to the default num_ctx"""
+        provider = Provider("ollama", "deepseek-r1:14b")
+        with patch.object(provider.http_client, "post", side_effect=Exception("Connection refused")):
+            self.assertEqual(provider.get_context_window(), 8192)
+
+    def test_server_n_ctx(self):
+        """Test that the self-hosted server is asked for its n_ctx"""
+        provider = Provider("server", "model", server_address="http://127.0.0.1:3333")
+        response = MagicMock()
+        response.json.return_value = {"model": "model", "n_ctx": 4096}
+        with patch.object(provider.http_client, "get", return_value=response) as get:
+            self.assertEqual(provider.get_context_window(), 4096)
+            get.assert_called_once()
+            self.assertTrue(get.call_args[0][0].endswith("/info"))
+
+class TestServerStream(unittest.TestCase):
+    def setUp(self):
+        self.provider = Provider("server", "model", server_address="http://127.0.0.1:3333")
+        self.provider.health.is_online = lambda address: True
+        started = MagicMock(status_code=202)
+        started.json.return_value = {"session_id": "abc"}
+        self.provider.session.post = MagicMock(return_value=started)
+
+    def stream_chunks(self, chunks):
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.iter_content.return_value = iter(chunks)
+        self.provider.session.get = MagicMock(return_value=response)
+
+    def test_heartbeats_are_dropped(self):
+        """Test that heartbeats sent while the server waits are not part of the answer"""
+        self.stream_chunks([SERVER_HEARTBEAT, SERVER_HEARTBEAT + "Hello", " world" + SERVER_HEARTBEAT])
+        self.assertEqual("".join(self.provider.server_stream_fn([])), "Hello world")
+
+    def test_error_marker_raises(self):
+        """Test that a generation failed on the server raises after the text already streamed"""
+        self.stream_chunks(["Hello", SERVER_ERROR_MARKER + "model ", "crashed"])
+        received = []
+        with self.assertRaises(Exception) as context:
+            for chunk in self.provider.server_stream_fn([]):
+                received.append(chunk)
+        self.assertEqual(received, ["Hello"])
+        self.assertIn("model crashed", str(context.exception))
+
+    def test_connection_lost_raises(self):
+        """Test that a stream cut mid-answer raises instead of returning a truncated answer"""
+        def chunks():
+            yield "Hello"
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+        self.stream_chunks(chunks())
+        with self.assertRaises(ConnectionError):
+            list(self.provider.server_stream_fn([]))
+
+class TestHealthMonitor(unittest.TestCase):
+    def setUp(self):
+        self.monitor = HealthMonitor(probe=lambda address: False, failure_threshold=2, cooldown=60)
+
+    def test_unknown_address_is_allowed(self):
+        """Test that an address without recorded failure is allowed"""
+        self.assertTrue(self.monitor.allow_request("10.0.0.1:3333"))
+
+    def test_circuit_opens_after_threshold(self):
+        """Test that the circuit opens after consecutive failures"""
+        self.monitor.record_failure("10.0.0.1:3333")
+        self.assertTrue(self.monitor.allow_request("10.0.0.1:3333"))
+        self.monitor.record_failure("10.0.0.1:3333")
+        self.assertFalse(self.monitor.allow_request("10.0.0.1:3333"))
+
+    def test_success_closes_circuit(self):
+        """Test that a successful request closes the circuit"""
+        self.monitor.record_failure("10.0.0.1:3333")
+        self.monitor.record_failure("10.0.0.1:3333")
+        self.monitor.record_success("10.0.0.1:3333")
+        self.assertTrue(self.monitor.allow_request("10.0.0.1:3333"))
+
+    def test_is_online_does_not_block(self):
+        """Test that the first lookup is optimistic and the probe runs in background"""
+        monitor = HealthMonitor(probe=lambda address: time.sleep(1) or False)
+        start = time.time()
+        self.assertTrue(monitor.is_online("10.0.0.1:3333"))
+        self.assertLess(time.time() - start, 0.5)
+
+class TestProviderPool(unittest.TestCase):
+    def setUp(self):
+        self.primary = Provider("test", "model-a", "10.0.0.1:5000")
+        self.fallback = Provider("test", "model-b", "10.0.0.2:5000", health=self.primary.health)
+        self.pool = ProviderPool([self.primary, self.fallback], strategy="priority")
+
+    def test_failover(self):
+        """A provider failing before its first token is replaced by the next one"""
+        self.primary.available_providers["test"] = MagicMock(side_effect=Exception("Connection refused"))
+        self.assertEqual(self.pool.respond([]), self.fallback.test_fn([]))
+        self.assertEqual(self.pool.backends[0].failures, 1)
+        self.assertEqual(self.pool.backends[0].outstanding, 0)
+
+    def test_async_failover(self):
+        """Async generation fails over too"""
+        self.primary.available_providers["test"] = MagicMock(side_effect=Exception("Server busy. Try again later."))
+        self.assertEqual(asyncio.run(self.pool.respond_async([])), self.fallback.test_fn([]))
+
+    def test_failure_recorded_once(self):
+        """Each failed request counts once in the circuit breaker, the answer names the last provider tried"""
+        for provider in (self.primary, self.fallback):
+            provider.available_providers["test"] = MagicMock(side_effect=Exception("Connection refused"))
+        answer = self.pool.respond([])
+        self.assertEqual(answer, f"Server {self.fallback.server_ip} seem offline. Unable to answer.")
+        status = self.primary.health.status()
+        self.assertEqual(status[self.primary.server_ip]["consecutive_failures"], 1)
+        self.assertEqual(status[self.fallback.server_ip]["consecutive_failures"], 1)
+
+    def test_all_circuits_open(self):
+        """A pool whose circuits are all open answers like a single provider with an open circuit"""
+        for provider in (self.primary, self.fallback):
+            for _ in range(provider.health.failure_threshold):
+                provider.health.record_failure(provider.server_ip)
+        self.assertEqual(self.pool.respond([]), self.fallback.respond([]))
+
+    def test_open_circuit_tried_last(self):
+        """Providers with an open circuit are tried after the others"""
+        for _ in range(self.primary.health.failure_threshold):
+            self.primary.health.record_failure(self.primary.server_ip)
+        self.assertIs(self.pool.ordered_backends()[0].provider, self.fallback)
+
+    def test_least_outstanding(self):
+        """The least loaded provider is chosen first"""
+        pool = ProviderPool([self.primary, self.fallback], strategy="least_outstanding")
+        pool.start_request(pool.backends[0])
+        self.assertIs(pool.ordered_backends()[0].provider, self.fallback)
+
+class TestRateLimiter(unittest.TestCase):
+    def test_requests_are_queued(self):
+        """Requests over the limit wait instead of failing"""
+        limiter = RateLimiter(requests_per_minute=60)
+        for _ in range(60):
+            self.assertEqual(limiter.reserve(), 0.0)
+        self.assertAlmostEqual(limiter.reserve(), 1.0, places=1)
+        self.assertAlmostEqual(limiter.reserve(), 2.0, places=1)
+
+    def test_retry_after(self):
+        """The Retry-After of the provider is honoured"""
+        limiter = RateLimiter()
+        cause = Exception("Error code: 429")
+        cause.status_code = 429
+        cause.response = MagicMock(headers={"retry-after": "5"})
+        error = Exception("OpenAI API error")
+        error.__cause__ = cause
+        delay = limiter.retry_delay(error, 0)
+        self.assertGreaterEqual(delay, 5)
+        self.assertGreaterEqual(limiter.reserve(), 4.9)
+
+    def test_retry_after_date(self):
+        """A Retry-After HTTP-date is honoured and an unparsable one falls back to the backoff"""
+        limiter = RateLimiter(base_delay=1.0)
+        error = Exception("Error code: 429")
+        error.status_code = 429
+        error.response = MagicMock(headers={"retry-after": formatdate(time.time() + 30, usegmt=True)})
+        self.assertAlmostEqual(get_retry_after(error), 30, delta=2)
+        error.response = MagicMock(headers={"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        self.assertEqual(get_retry_after(error), 0.0) # already passed
+        error.response = MagicMock(headers={"retry-after": "soon"})
+        self.assertIsNone(get_retry_after(error))
+        self.assertLessEqual(limiter.retry_delay(error, 0), 1.0)
+        self.assertIsNone(get_retry_after(RateLimitExceeded("Too many requests", retry_after="later")))
+
+    def test_no_retry(self):
+        """Other errors and exhausted retries are not retried"""
+        limiter = RateLimiter(max_retries=2)
+        self.assertIsNone(limiter.retry_delay(Exception("Connection refused"), 0))
+        self.assertIsNone(limiter.retry_delay(RateLimitExceeded("Too many requests"), 2))
+
+    def test_token_estimate(self):
+        """Prompt tokens are counted like the prompt budget of the memory"""
+        limiter = RateLimiter(tokens_per_minute=1000, model_name="unknown-model")
+        history = [{"role": "user", "content": "hello world " * 50}]
+        self.assertEqual(limiter.estimate_tokens(history), limiter.budget.count_messages(history))
+        self.assertEqual(RateLimiter().estimate_tokens(history), 0)
+
+    def test_provider_retries(self):
+        """A rate limited provider request is retried until it succeeds"""
+        provider = Provider("test", "model")
+        answer = provider.test_fn([])
+        provider.available_providers["test"] = MagicMock(side_effect=[RateLimitExceeded("Too many requests", retry_after=0), answer])
+        self.assertEqual(provider.respond([]), answer)
+        self.assertEqual(provider.available_providers["test"].call_count, 2)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
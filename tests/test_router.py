@@ -0,0 +1,138 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import os, sys
+from types import SimpleNamespace
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # Add project root to Python path
+from sources.router import AgentRouter, register_router_models, quantize_int8, ZERO_SHOT_MODELS
+from sources.router_cache import RouterCache
+from sources.model_registry import ModelRegistry
+
+class FakeClassifier:
+    """Classifier predicting fixed labels from the embeddings of its encoder, counting the encoder passes."""
+    def __init__(self, predictions, encoder_passes):
+        self.predictions = predictions
+        self.encoder_passes = encoder_passes
+
+    def _get_embeddings(self, texts):
+        self.encoder_passes.append(list(texts))
+        return [torch.tensor([float(len(text)), 1.0]) for text in texts]
+
+    def predict(self, text):
+        self._get_embeddings([text])
+        return self.predictions
+
+def make_router(backend: str = "classifier") -> AgentRouter:
+    """AgentRouter on fake classifiers, without loading the routing models."""
+    router = AgentRouter.__new__(AgentRouter)
+    router.agents = [
+        SimpleNamespace(agent_name="jarvis", role="talk", type="casual_agent"),
+        SimpleNamespace(agent_name="coder", role="code", type="code_agent"),
+        SimpleNamespace(agent_name="planner", role="planification", type="planner_agent")
+    ]
+    router.backend = backend
+    router.logger = MagicMock()
+    router.lang_analysis = MagicMock()
+    router.lang_analysis.detect_language.return_value = "fr"
+    router.lang_analysis.translate.side_effect = lambda text, lang: "Write a python script to ping a website"
+    router.pipelines = {}
+    router.encoder_passes = []
+    router.talk_classifier = FakeClassifier([("code", 0.9), ("talk", 0.1)], router.encoder_passes)
+    router.complexity_classifier = FakeClassifier([("LOW", 0.9), ("HIGH", 0.1)], router.encoder_passes)
+    router.embeddings = router.share_embeddings([router.talk_classifier, router.complexity_classifier])
+    router.cache = RouterCache(router.embed_queries)
+    router.asked_clarify = False
+    return router
+
+class TestRouterCache(unittest.TestCase):
+    def test_single_encoder_pass(self):
+        """A cache miss embeds the routed text once for the cache and both classifiers"""
+        router = make_router()
+        agent = router.select_agent("Ecris un script python pour ping un site web")
+        self.assertEqual(agent.type, "code_agent")
+        self.assertEqual(router.encoder_passes, [["Write a python script to ping a website"]])
+
+    def test_identical_query_skips_translation(self):
+        """An identical query is answered by the cache before being translated or embedded"""
+        router = make_router()
+        router.select_agent("Ecris un script python pour ping un site web")
+        router.select_agent("ECRIS un script python pour ping un site web !")
+        self.assertEqual(router.lang_analysis.translate.call_count, 1)
+        self.assertEqual(len(router.encoder_passes), 1)
+
+class TestRouterBackends(unittest.TestCase):
+    def setUp(self):
+        self.registry = ModelRegistry()
+        self.loads = []
+        patchers = [
+            patch("sources.router.registry", self.registry),
+            patch("sources.language.registry", self.registry),
+            patch("sources.router.load_zero_shot", lambda name, quantized=False: self.loads.append((name, quantized))),
+            patch("sources.router.load_router_classifier", lambda path, quantized=False: self.loads.append(("llm_router", quantized))),
+            patch("sources.router.load_multilingual_classifier", lambda quantized=False: self.loads.append(("multilingual", quantized)))
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_backend_models(self):
+        """Each backend registers its routing models, with the translators of the supported languages"""
+        translators = ["Helsinki-NLP/opus-mt-fr-en"]
+        self.assertEqual(register_router_models("vote", ["en", "fr"]), [ZERO_SHOT_MODELS["vote"], "llm_router"] + translators)
+        self.assertEqual(register_router_models("distilled", ["en", "fr"]),
+                         [ZERO_SHOT_MODELS["distilled"], "llm_router-int8"] + translators)
+        self.assertEqual(register_router_models("classifier", ["en", "fr"]), ["llm_router-int8"] + translators)
+        with self.assertRaises(ValueError):
+            register_router_models("unknown")
+
+    def test_quantized_backends(self):
+        """Only the vote backend keeps the full precision models"""
+        for backend in ["vote", "distilled"]:
+            for name in register_router_models(backend)[:2]:
+                self.registry.get(name)
+        self.assertEqual(self.loads, [(ZERO_SHOT_MODELS["vote"], False), ("llm_router", False),
+                                      (ZERO_SHOT_MODELS["distilled"], True), ("llm_router", True)])
+
+    def test_quantize_int8(self):
+        """Dynamic int8 quantization replaces the linear layers and keeps their outputs close"""
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(torch.nn.Linear(16, 16), torch.nn.ReLU(), torch.nn.Linear(16, 4))
+        inputs = torch.randn(8, 16)
+        expected = model(inputs)
+        quantized = quantize_int8(model)
+        self.assertNotIsInstance(quantized[0], torch.nn.Linear)
+        self.assertTrue(torch.allclose(quantized(inputs), expected, atol=0.1))
+
+    def test_classifier_backend_routes_alone(self):
+        """Without a zero-shot model the llm router decides alone"""
+        router = make_router("classifier")
+        self.assertEqual(router.router_vote_with_confidence("write a python script", ["talk", "code"]), ("code", 0.9))
+
+    def test_vote_backend(self):
+        """The zero-shot model scores every label in one batch and votes with the llm router"""
+        router = make_router("vote")
+        bart = MagicMock(return_value={"labels": ["talk", "code"], "scores": [0.95, 0.05]})
+        router.pipelines = {"bart": bart}
+        decision, confidence = router.router_vote_with_confidence("tell me a funny story", ["talk", "code"])
+        self.assertEqual(bart.call_args.kwargs["batch_size"], 2)
+        self.assertEqual(decision, "talk")
+        self.assertAlmostEqual(confidence, 0.95 / (0.95 + 0.9))
+
+    def test_multilingual_backend_models(self):
+        """The multilingual backend loads its own encoder and no translation model"""
+        self.assertEqual(register_router_models("multilingual", ["en", "fr", "zh"]), ["llm_router-multilingual"])
+        self.registry.get("llm_router-multilingual")
+        self.assertEqual(self.loads, [("multilingual", True)])
+        self.assertFalse(any(name.startswith("Helsinki-NLP") for name in self.registry.status()))
+
+    def test_multilingual_routes_without_translation(self):
+        """The multilingual backend classifies the query in its language"""
+        router = make_router("multilingual")
+        agent = router.select_agent("Ecris un script python pour ping un site web\nmerci")
+        self.assertEqual(agent.type, "code_agent")
+        router.lang_analysis.translate.assert_not_called()
+        self.assertEqual(router.encoder_passes, [["Ecris un script python pour ping un site web"]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # Add project root to Python path
+from sources.router_cache import RouterCache
+
+class FakeEmbedder:
+    """Embed texts with fixed vectors, recording the texts embedded."""
+    def __init__(self, vectors: dict):
+        self.vectors = vectors
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return np.array([self.vectors[text] for text in texts], dtype=np.float32)
+
+def unit(angle: float) -> list:
+    """Vector whose cosine similarity with [1, 0] is cos(angle)."""
+    return [np.cos(angle), np.sin(angle)]
+
+class TestRouterCache(unittest.TestCase):
+    def setUp(self):
+        self.embedder = FakeEmbedder({
+            "Find my report.pdf": unit(0.0),
+            "find my REPORT.pdf please": unit(0.2), # near-duplicate, similarity 0.980
+            "Search the web for report tips": unit(0.6), # different intent, similarity 0.825
+            "Tell me a joke": unit(1.5)
+        })
+        self.cache = RouterCache(self.embedder, max_size=3, similarity_threshold=0.95, min_confidence=0.7)
+
+    def test_miss_then_hit(self):
+        """An identical query after normalization hits without being embedded again"""
+        decision, embedding = self.cache.get("Find my report.pdf")
+        self.assertIsNone(decision)
+        self.cache.put("Find my report.pdf", "file_agent", 0.9, embedding)
+        self.assertEqual(self.cache.get("  find MY report.pdf ?")[0], "file_agent")
+        self.assertEqual(len(self.embedder.calls), 1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_embeds_original_text(self):
+        """The embedder gets the query as written, only the identical-query key is lowercased"""
+        self.cache.get("Find my report.pdf")
+        self.assertEqual(self.embedder.calls, [["Find my report.pdf"]])
+
+    def test_embedding_text(self):
+        """The text embedded can differ from the query, eg: the translated query the classifiers embed"""
+        decision, embedding = self.cache.get("Trouve mon report.pdf", embedding_text="Find my report.pdf")
+        self.assertEqual(self.embedder.calls, [["Find my report.pdf"]])
+        np.testing.assert_allclose(embedding, unit(0.0), atol=1e-6)
+
+    def test_near_duplicate(self):
+        """A near-duplicate reuses a confident decision, a different intent above the confidence gate does not"""
+        self.cache.put("Find my report.pdf", "file_agent", 0.9)
+        self.assertEqual(self.cache.get("find my REPORT.pdf please")[0], "file_agent")
+        self.assertIsNone(self.cache.get("Search the web for report tips")[0])
+        self.assertIsNone(self.cache.get("Tell me a joke")[0])
+        self.assertEqual(self.cache.stats()["similar_hits"], 1)
+
+    def test_min_confidence(self):
+        """A decision taken with low confidence is only reused by identical queries"""
+        self.cache.put("Find my report.pdf", "file_agent", 0.5)
+        self.assertIsNone(self.cache.get("find my REPORT.pdf please")[0])
+        self.assertEqual(self.cache.get("find my report.pdf")[0], "file_agent")
+
+    def test_eviction(self):
+        """The least recently used decision is evicted beyond max_size"""
+        self.cache.put("a", "casual_agent", 0.9, np.array(unit(0.0)))
+        self.cache.put("b", "code_agent", 0.9, np.array(unit(1.0)))
+        self.cache.get("a")
+        self.cache.put("c", "file_agent", 0.9, np.array(unit(2.0)))
+        self.cache.put("d", "browser_agent", 0.9, np.array(unit(3.0)))
+        self.assertEqual(self.cache.stats()["size"], 3)
+        self.assertEqual(self.cache.get_exact("a"), "casual_agent")
+        self.assertIsNone(self.cache.get_exact("b"))
+
+    def test_without_embedder(self):
+        """Without an embedder only identical queries are cached"""
+        cache = RouterCache(None)
+        cache.put("Find my report.pdf", "file_agent", 0.9)
+        self.assertEqual(cache.get("find my report.pdf")[0], "file_agent")
+        self.assertEqual(cache.get("find my REPORT.pdf please"), (None, None))
+
+if __name__ == '__main__':
+    unittest.main()
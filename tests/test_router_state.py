@@ -0,0 +1,87 @@
+import unittest
+import os, sys
+import json
+import tempfile
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # Add project root to Python path
+from adaptive_classifier import AdaptiveClassifier, Example, ModelConfig, PrototypeMemory
+from sources.router_state import RouterState
+
+def make_classifier(dim: int = 8) -> AdaptiveClassifier:
+    """Classifier without encoder, as the router forks them from the shared llm router."""
+    classifier = AdaptiveClassifier.__new__(AdaptiveClassifier)
+    classifier.config = ModelConfig()
+    classifier.device = "cpu"
+    classifier.embedding_dim = dim
+    classifier.memory = PrototypeMemory(dim, config=classifier.config)
+    classifier.adaptive_head = None
+    classifier.label_to_id = {}
+    classifier.id_to_label = {}
+    classifier.train_steps = 0
+    classifier.training_history = {}
+    classifier.model, classifier.tokenizer = None, None
+    return classifier
+
+class TestRouterState(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.state = RouterState(self.folder.name, os.path.join(self.folder.name, "model.safetensors"))
+        torch.manual_seed(0)
+        self.classifier = make_classifier()
+        for i, label in enumerate(["code", "web", "talk", "code", "web"]):
+            self.classifier.label_to_id.setdefault(label, len(self.classifier.label_to_id))
+            self.classifier.memory.add_example(Example(f"example {i}", label, torch.randn(8)), label)
+        self.classifier.id_to_label = {i: label for label, i in self.classifier.label_to_id.items()}
+        self.classifier.train_steps = 5
+        self.classifier._initialize_adaptive_head()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_save_and_load(self):
+        """A saved state restores the label maps, examples, prototypes and adaptive head"""
+        version = self.state.version([("example", "code")], "classifier")
+        self.state.save("talk", version, self.classifier)
+        restored = self.state.load("talk", version, make_classifier())
+        self.assertIsNotNone(restored)
+        self.assertEqual(restored.label_to_id, self.classifier.label_to_id)
+        self.assertEqual(restored.id_to_label, self.classifier.id_to_label)
+        self.assertEqual(restored.train_steps, 5)
+        self.assertEqual([e.text for e in restored.memory.examples["code"]], ["example 0", "example 3"])
+        for label, prototype in self.classifier.memory.prototypes.items():
+            self.assertTrue(torch.equal(restored.memory.prototypes[label], prototype))
+        for key, value in self.classifier.adaptive_head.state_dict().items():
+            self.assertTrue(torch.equal(restored.adaptive_head.state_dict()[key], value))
+        for label in ["code", "web", "talk"]:
+            query = self.classifier.memory.prototypes[label]
+            self.assertEqual(restored.memory.get_nearest_prototypes(query, k=1)[0][0], label)
+
+    def test_safe_format(self):
+        """A state is JSON and safetensors only, older versions and pickled states are removed"""
+        old_pickle = os.path.join(self.folder.name, "talk-0123456789abcdef.pt")
+        open(old_pickle, "wb").close()
+        self.state.save("talk", "old", self.classifier)
+        self.state.save("talk", "new", self.classifier)
+        self.assertEqual(os.listdir(self.folder.name), ["talk-new"])
+        self.assertEqual(sorted(os.listdir(self.state.path("talk", "new"))), ["state.json", "tensors.safetensors"])
+        with open(os.path.join(self.state.path("talk", "new"), "state.json")) as f:
+            self.assertEqual(json.load(f)["label_to_id"], self.classifier.label_to_id)
+
+    def test_missing_or_corrupt_state(self):
+        """A missing or unreadable state is rebuilt"""
+        self.assertIsNone(self.state.load("talk", "missing", make_classifier()))
+        self.state.save("talk", "corrupt", self.classifier)
+        with open(os.path.join(self.state.path("talk", "corrupt"), "tensors.safetensors"), "wb") as f:
+            f.write(b"not safetensors")
+        self.assertIsNone(self.state.load("talk", "corrupt", make_classifier()))
+
+    def test_version(self):
+        """The version does not depend on the examples order but on the examples and the backend"""
+        few_shots = [("hi", "talk"), ("write code", "code")]
+        self.assertEqual(self.state.version(few_shots, "vote"), self.state.version(few_shots[::-1], "vote"))
+        self.assertNotEqual(self.state.version(few_shots, "vote"), self.state.version(few_shots, "classifier"))
+        self.assertNotEqual(self.state.version(few_shots, "vote"), self.state.version(few_shots[:1], "vote"))
+
+if __name__ == '__main__':
+    unittest.main()
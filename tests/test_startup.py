@@ -0,0 +1,87 @@
+import unittest
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # Add project root to Python path
+from sources.startup import StartupTracker
+
+class TestStartupTracker(unittest.TestCase):
+    def setUp(self):
+        self.startup = StartupTracker(max_workers=2)
+
+    def tearDown(self):
+        self.startup.shutdown()
+
+    def test_starting_without_components(self):
+        self.assertEqual(self.startup.state(), "starting")
+        self.assertFalse(self.startup.is_ready())
+
+    def test_in_progress(self):
+        """A component still loading keeps the state starting"""
+        release = threading.Event()
+        fast = self.startup.submit("fast", lambda: "model")
+        slow = self.startup.submit("slow", release.wait, 5)
+        self.assertEqual(fast.result(timeout=5), "model")
+        self.assertEqual(self.startup.state(), "starting")
+        self.assertEqual(self.startup.status()["components"]["fast"]["status"], "ready")
+        self.assertIn(self.startup.status()["components"]["slow"]["status"], ("pending", "loading"))
+        release.set()
+        slow.result(timeout=5)
+        self.assertTrue(self.startup.is_ready())
+
+    def test_ready(self):
+        """Every component loaded makes the state ready, with their load times"""
+        futures = [self.startup.submit(name, lambda name=name: name) for name in ["browser", "router"]]
+        self.assertEqual([future.result(timeout=5) for future in futures], ["browser", "router"])
+        status = self.startup.status()
+        self.assertEqual(status["state"], "ready")
+        self.assertIn("load_time", status["components"]["router"])
+
+    def test_failed(self):
+        """A failing component makes the state failed and its error is raised to the caller"""
+        def fail():
+            raise RuntimeError("no chromedriver")
+        future = self.startup.submit("browser", fail)
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=5)
+        self.startup.submit("router", lambda: None).result(timeout=5)
+        status = self.startup.status()
+        self.assertEqual(status["state"], "failed")
+        self.assertEqual(status["components"]["browser"]["error"], "no chromedriver")
+
+class TestApiStartup(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import api
+        self.api = api
+        self.startup = StartupTracker()
+        self.original_startup = api.startup
+        api.startup = self.startup
+        self.client = TestClient(api.api) # the lifespan, which loads the system, is not run outside a with block
+
+    def tearDown(self):
+        self.api.startup = self.original_startup
+        self.startup.shutdown()
+
+    def test_not_ready_before_initialize_system(self):
+        """Endpoints answer 503 until initialize_system finishes"""
+        started, release = threading.Event(), threading.Event()
+        def initialize_system():
+            started.set()
+            release.wait(5)
+        loading = threading.Thread(target=self.startup.track, args=("interaction", initialize_system))
+        loading.start()
+        started.wait(5)
+        response = self.client.get("/health")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["status"], "starting")
+        response = self.client.get("/is_active")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["startup"]["components"]["interaction"]["status"], "loading")
+        release.set()
+        loading.join()
+        self.assertEqual(self.client.get("/health").status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()